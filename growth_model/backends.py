@@ -0,0 +1,354 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides the compute backends of the growth kernels: evaluation of the parameters a and b
+(equations 2 and 3) and the daily weight update (kernels.grow_day()):
+- "numpy": the reference, NumPy expressions with full-size temporaries on one core
+- "numexpr": fused expressions evaluated in blocks on all cores (optional package numexpr)
+- "numba": compiled parallel loops without temporaries (optional package numba)
+- "auto": the installed backend that is fastest on this machine (timed once per process)
+NumPy evaluates float32 powers with SIMD instructions on one core, the fused backends pay off with several cores.
+Check the backends against the reference and time them with: python -m growth_model.backends
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+
+from functools import lru_cache
+
+import numpy as np
+
+from growth_model.constants import C_AVG, PARAMETERS, T0
+from growth_model.equations import equation2, equation3
+from growth_model.kernels import grow_day
+
+KERNEL_BACKENDS = ('numpy', 'numexpr', 'numba', 'auto')
+
+# Shape of the fields and days integrated to select the backend "auto"
+AUTO_SHAPE = (18, 20000)
+AUTO_DAYS = 30
+
+# Largest relative difference to the reference accepted by check_backends()
+TOLERANCE = 1e-4
+
+
+class NumpyBackend:
+    """
+    Reference backend: equations.equation2(), equations.equation3() and kernels.grow_day()
+    """
+
+    name = 'numpy'
+
+    def a(self, temp):
+        """
+        @param temp: temperature (°C)
+        @return: parameter "a" (Eq. 2)
+        """
+        return equation2(temp)
+
+    def b(self, temp):
+        """
+        @param temp: temperature (°C)
+        @return: exponent "b" (Eq. 3)
+        """
+        return equation3(temp)
+
+    def grow_day(self, weight, growth_rates, a, b, dt=1, workspace=None, c_avg=C_AVG):
+        """
+        Advance the weight field by one time step (in place), see kernels.grow_day()
+
+        @return: None
+        """
+        grow_day(weight, growth_rates, a, b, dt, workspace, c_avg)
+
+
+class NumexprBackend(NumpyBackend):
+    """
+    Fused expressions evaluated by numexpr in cache-sized blocks on all cores
+
+    Constants are cast to the data type of the fields, so float32 fields are computed in float32 like the
+    reference. Scalars, integer temperatures and parameter sets fall back to the reference.
+    """
+
+    name = 'numexpr'
+
+    def __init__(self):
+        try:
+            import numexpr
+        except ImportError as error:
+            raise ImportError('Kernel backend "numexpr" requires the package "numexpr"') from error
+        self._evaluate = numexpr.evaluate
+
+    def a(self, temp):
+        temp = np.asarray(temp)
+        if not temp.ndim or temp.dtype.kind != 'f':
+            return super().a(temp)
+        return self._evaluate('a_r * exp(theta_a_r - theta_a / (temp + t0))'
+                              ' / (one + exp(theta_h_h - theta_h / (temp + t0)))',
+                              local_dict=dict(_constants(temp.dtype), temp=temp))
+
+    def b(self, temp):
+        temp = np.asarray(temp)
+        if not temp.ndim or temp.dtype.kind != 'f':
+            return super().b(temp)
+        return self._evaluate('b_r * exp(theta_b_r - theta_b / (temp + t0))',
+                              local_dict=dict(_constants(temp.dtype), temp=temp))
+
+    def grow_day(self, weight, growth_rates, a, b, dt=1, workspace=None, c_avg=C_AVG):
+        if weight.dtype.kind != 'f':
+            return super().grow_day(weight, growth_rates, a, b, dt, workspace, c_avg)
+        dtype = weight.dtype.type
+        values = dict(weight=weight, a=a, b=b, c_avg=np.asarray(c_avg, dtype=weight.dtype), scale=dtype(0.01),
+                      dt=dtype(dt), zero=dtype(0.), one=dtype(1.))
+        # growth_rate = 0.01 * (a * weight ** b - C_AVG), no growth below zero
+        self._evaluate('scale * (a * weight ** b - c_avg)', local_dict=values, out=growth_rates,
+                       casting='same_kind')
+        values['rate'] = growth_rates
+        self._evaluate('where(rate < zero, zero, rate)', local_dict=values, out=growth_rates, casting='same_kind')
+        # weight = weight * (1 + dt * growth_rate)
+        self._evaluate('weight * (one + dt * rate)', local_dict=values, out=weight, casting='same_kind')
+        return None
+
+
+class NumbaBackend(NumpyBackend):
+    """
+    Parallel loops compiled by Numba, one pass over the fields without temporaries
+
+    The loops are compiled on their first call (for each data type). a and b must match the trailing
+    dimensions of the weight field (e.g. the fields of the stacked cohorts share a and b), other layouts,
+    parameter sets and scalars fall back to the reference.
+    """
+
+    name = 'numba'
+
+    def __init__(self):
+        try:
+            import numba
+        except ImportError as error:
+            raise ImportError('Kernel backend "numba" requires the package "numba"') from error
+        self._kernels = _numba_kernels(numba)
+
+    def a(self, temp):
+        temp = np.asarray(temp)
+        if not temp.ndim or temp.dtype.kind != 'f':
+            return super().a(temp)
+        c = _constants(temp.dtype)
+        out = np.empty(temp.shape, dtype=temp.dtype)
+        self._kernels['a'](np.ascontiguousarray(temp).reshape(-1), out.reshape(-1), c['a_r'][()],
+                           c['theta_a_r'][()], c['theta_a'][()], c['theta_h_h'][()], c['theta_h'][()], c['t0'][()],
+                           c['one'][()])
+        return out
+
+    def b(self, temp):
+        temp = np.asarray(temp)
+        if not temp.ndim or temp.dtype.kind != 'f':
+            return super().b(temp)
+        c = _constants(temp.dtype)
+        out = np.empty(temp.shape, dtype=temp.dtype)
+        self._kernels['b'](np.ascontiguousarray(temp).reshape(-1), out.reshape(-1), c['b_r'][()],
+                           c['theta_b_r'][()], c['theta_b'][()], c['t0'][()])
+        return out
+
+    def grow_day(self, weight, growth_rates, a, b, dt=1, workspace=None, c_avg=C_AVG):
+        fields = (weight, growth_rates, a, b)
+        if (np.ndim(c_avg) or weight.dtype.kind != 'f'
+                or any(not isinstance(field, np.ndarray) or field.dtype != weight.dtype
+                       or not field.flags.c_contiguous for field in fields)
+                or growth_rates.shape != weight.shape or a.shape != b.shape
+                or a.shape != weight.shape[weight.ndim - a.ndim:]):
+            return super().grow_day(weight, growth_rates, a, b, dt, workspace, c_avg)
+        dtype = weight.dtype.type
+        self._kernels['grow_day'](weight.reshape(-1), growth_rates.reshape(-1), a.reshape(-1), b.reshape(-1),
+                                  dtype(dt), dtype(c_avg), dtype(0.01), dtype(0.), dtype(1.))
+        return None
+
+
+def _numba_kernels(numba):
+    """
+    Compile (lazily) the loops of NumbaBackend
+
+    @param numba: the numba module
+    @return: dict of functions a, b and grow_day
+    """
+    @numba.njit(parallel=True)
+    def a_kernel(temp, out, a_r, theta_a_r, theta_a, theta_h_h, theta_h, t0, one):
+        for i in numba.prange(temp.size):
+            temperature_kelvin = temp[i] + t0
+            out[i] = (a_r * np.exp(theta_a_r - theta_a / temperature_kelvin)
+                      / (one + np.exp(theta_h_h - theta_h / temperature_kelvin)))
+
+    @numba.njit(parallel=True)
+    def b_kernel(temp, out, b_r, theta_b_r, theta_b, t0):
+        for i in numba.prange(temp.size):
+            out[i] = b_r * np.exp(theta_b_r - theta_b / (temp[i] + t0))
+
+    @numba.njit(parallel=True)
+    def grow_day_kernel(weight, growth_rates, a, b, dt, c_avg, scale, zero, one):
+        # a and b repeat over the leading dimensions of weight
+        cells = a.size
+        for i in numba.prange(weight.size):
+            j = i % cells
+            rate = scale * (a[j] * weight[i] ** b[j] - c_avg)
+            if rate < zero:
+                rate = zero
+            growth_rates[i] = rate
+            weight[i] = weight[i] * (one + dt * rate)
+
+    return {'a': a_kernel, 'b': b_kernel, 'grow_day': grow_day_kernel}
+
+
+@lru_cache(maxsize=None)
+def _constants(dtype):
+    """
+    Coefficients of equations 2 and 3 in a data type, combined as in equations.py
+
+    @param dtype: numpy data type of the temperatures
+    @return: dict of 0-d arrays
+    """
+    p = PARAMETERS
+    values = {'a_r': p['A_R'], 'theta_a_r': p['THETA_A'] / p['T_R'], 'theta_a': p['THETA_A'],
+              'theta_h_h': p['THETA_H'] / p['T_H'], 'theta_h': p['THETA_H'], 'b_r': p['B_R'],
+              'theta_b_r': p['THETA_B'] / p['T_R'], 'theta_b': p['THETA_B'], 't0': T0, 'one': 1.}
+    return {name: np.asarray(value, dtype=dtype) for name, value in values.items()}
+
+
+_BACKEND_CLASSES = {'numpy': NumpyBackend, 'numexpr': NumexprBackend, 'numba': NumbaBackend}
+
+
+@lru_cache(maxsize=None)
+def get_backend(name: str = 'numpy'):
+    """
+    Compute backend of the growth kernels (one instance per process)
+
+    @param name: one of KERNEL_BACKENDS, "auto" times the installed backends (see check_backends()) and
+                 selects the fastest one that agrees with numpy
+    @return: backend with methods a(temp), b(temp) and grow_day(weight, growth_rates, a, b, dt, workspace, c_avg)
+    """
+    if name == 'auto':
+        results = check_backends(AUTO_SHAPE, AUTO_DAYS, repeat=2)
+        name = min((candidate for candidate, result in results.items() if result['max_rel_diff'] <= TOLERANCE),
+                   key=lambda candidate: results[candidate]['seconds'])
+        logging.info(f'Kernel backend: {name} ('
+                     + ', '.join(f'{candidate} {result["seconds"]:.4f} s' for candidate, result in results.items())
+                     + ')')
+    if name not in _BACKEND_CLASSES:
+        raise ValueError(f'Unknown kernel_backend "{name}", expected one of {KERNEL_BACKENDS}')
+    return _BACKEND_CLASSES[name]()
+
+
+@lru_cache(maxsize=None)
+def available_backends():
+    """
+    @return: tuple of the names of the backends whose packages are installed
+    """
+    names = []
+    for name, backend in _BACKEND_CLASSES.items():
+        try:
+            backend()
+        except ImportError:
+            continue
+        names.append(name)
+    return tuple(names)
+
+
+def check_backends(shape=(18, 220), days: int = 360, backends=None, seed: int = 0, repeat: int = 3):
+    """
+    Integrate one year of daily growth with every backend, compare with the reference and time it
+
+    The temperatures of the fields are drawn between -2 and 30 °C (one field per month of 30 days),
+    a tenth of the points is NaN (land).
+
+    @param shape: shape of the float32 fields
+    @param days: number of days integrated
+    @param backends: names of the backends (default: all installed backends)
+    @param seed: seed of the random temperatures
+    @param repeat: runs of every backend, the fastest is reported (the first call compiles numba loops)
+    @return: dict by backend with seconds, cell_days_per_s, speedup (over numpy) and max_rel_diff
+             (largest difference of a, b, growth rate and weight to numpy relative to the largest value)
+    """
+    from growth_model.kernels import allocate_workspace, integrate_year
+
+    backends = available_backends() if backends is None else tuple(backends)
+    rng = np.random.default_rng(seed)
+    months = max(1, days // 30)
+    temp = rng.uniform(-2., 30., (months,) + tuple(shape)).astype('f')
+    temp[:, rng.random(shape) < 0.1] = np.nan
+    durations = np.full(months, days / months)
+
+    results, reference = {}, None
+    for name in ('numpy',) + tuple(name for name in backends if name != 'numpy'):
+        backend = get_backend(name)
+        seconds = np.inf
+        for _ in range(max(1, repeat)):
+            fields = {'weight': np.ones(shape, dtype='f'), 'growth_rate': np.zeros(shape, dtype='f'),
+                      'a': np.zeros(shape, dtype='f'), 'b': np.zeros(shape, dtype='f')}
+            workspace = allocate_workspace(shape)
+            begin = time.perf_counter()
+            integrate_year(temp, fields['weight'], fields['growth_rate'], fields['a'], fields['b'],
+                           workspace=workspace, parameters=(backend.a, backend.b), durations=durations,
+                           backend=backend)
+            seconds = min(seconds, time.perf_counter() - begin)
+        if reference is None:
+            reference = fields
+        # Largest difference relative to the range of every field (growth rates may be close to zero)
+        difference = max(float(np.nanmax(np.abs(fields[key] - reference[key]), initial=0.)
+                               / max(float(np.nanmax(np.abs(reference[key]), initial=0.)), np.finfo('f').tiny))
+                         for key in fields)
+        results[name] = {'seconds': seconds, 'cell_days_per_s': np.prod(shape) * days / seconds,
+                         'speedup': results['numpy']['seconds'] / seconds if results else 1.,
+                         'max_rel_diff': difference}
+    return {name: result for name, result in results.items() if name in backends or name == 'numpy'}
+
+
+def _parse_args(argv=None):
+    """
+    Parsing the commandline arguments
+
+    @return: the parsed arguments (argparse.Namespace)
+    """
+    parser = argparse.ArgumentParser(description='Check the kernel backends against the NumPy reference and '
+                                                 'time one year of daily growth with each of them')
+    parser.add_argument('--shape', type=int, nargs='+', default=[18, 220],
+                        help='Shape of the fields (default: 18 220, the grid of the bundled SODA data)')
+    parser.add_argument('--days', type=int, default=360, help='Number of days integrated (default: 360)')
+    parser.add_argument('--backends', type=str, nargs='+', choices=KERNEL_BACKENDS[:-1],
+                        help='Backends to check (default: all installed backends)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of every backend, the fastest is reported')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help=f'Largest accepted relative difference to numpy (default: {TOLERANCE})')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Check and time the kernel backends
+
+    @return: exit code (1 if a backend differs from the reference by more than the tolerance)
+    """
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = _parse_args(argv)
+    try:
+        results = check_backends(tuple(args.shape), args.days, args.backends, repeat=args.repeat)
+    except ImportError as error:
+        sys.exit(f'Error: {error}')
+    logging.info(f'Installed backends: {", ".join(available_backends())}')
+    failed = []
+    for name, result in results.items():
+        logging.info(f'{name}: {result["seconds"]:.4f} s, {result["cell_days_per_s"]:.3g} cell-days/s, '
+                     f'{result["speedup"]:.2f} x numpy, max relative difference {result["max_rel_diff"]:.2e}')
+        if result['max_rel_diff'] > args.tolerance:
+            failed.append(name)
+    print(json.dumps(results, indent=1))
+    if failed:
+        logging.warning(f'Backends {failed} differ from numpy by more than {args.tolerance}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides the batch runner of the growth models:
+- many runs in one call: config files (.toml, globs are expanded) or batch files with several [[runs]] tables
+- runs of model multi_dim on the same input folder are grouped, a group opens its input once and reads
+  every year once for all of its runs (as long as the years fit into the memory cap)
+- groups run in parallel worker processes, a summary lists the status and time of every run
+
+A batch file holds the settings shared by all runs in [model_settings] and one [[runs]] table per run
+with its own settings, an optional "name" and an optional "output" (relative to the output folder):
+
+    [model_settings]
+    model = "multi_dim"
+    input_data = "./input_data/"
+    ...
+
+    [[runs]]
+    name = "CelticSea_shallow"
+    depth = [ 30, 40, 50 ]
+
+Usage: cod-growth-model-batch OUTPUT CONFIG [CONFIG ...] [--workers N]
+"""
+
+import sys
+import glob
+import json
+import time
+import pathlib
+import logging
+import argparse
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import tomli
+
+# Memory cap (MB) of the input shared by the runs of a group
+INPUT_CACHE_MB = 2048
+
+SUMMARY_NAME = 'batch_summary.json'
+
+
+def load_runs(config_files: list):
+    """
+    Read the runs of config files and batch files
+
+    @param config_files: config files or glob patterns
+    @return: list of dicts with name, settings (model settings), output (output path relative to the
+             output folder or None) and config_file
+    """
+    paths = []
+    for pattern in config_files:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise ValueError(f'No config file matches "{pattern}"')
+        paths.extend(matches)
+
+    runs = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            config = tomli.load(f)
+        stem = pathlib.Path(path).stem
+        defaults = config.get('model_settings', {})
+        if 'runs' not in config:
+            runs.append({'name': stem, 'settings': dict(defaults), 'output': None, 'config_file': path})
+            continue
+        for number, run in enumerate(config['runs'], start=1):
+            settings = dict(defaults, **run)
+            name = str(settings.pop('name', f'{stem}_{number}'))
+            runs.append({'name': name, 'settings': settings, 'output': settings.pop('output', None),
+                         'config_file': path})
+
+    names = [run['name'] for run in runs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f'Run names must be unique, found {duplicates} more than once')
+    return runs
+
+
+def plan_tasks(runs: list, workers: int = 1):
+    """
+    Group the runs by their input: runs of model multi_dim on the same input folder share one task
+
+    If there are less tasks than workers, the largest tasks are split (each part reads the input once).
+
+    @param runs: runs of load_runs()
+    @param workers: number of worker processes
+    @return: list of tasks (lists of runs)
+    """
+    groups = {}
+    for number, run in enumerate(runs):
+        settings = run['settings']
+        if settings.get('model') == 'multi_dim' and 'input_data' in settings:
+            key = str(pathlib.Path(settings['input_data']).resolve())
+        else:
+            key = number
+        groups.setdefault(key, []).append(run)
+    tasks = list(groups.values())
+    while len(tasks) < workers:
+        largest = max(tasks, key=len)
+        if len(largest) < 2:
+            break
+        tasks.remove(largest)
+        half = (len(largest) + 1) // 2
+        tasks.extend([largest[:half], largest[half:]])
+    return tasks
+
+
+def run_batch(runs: list, output: pathlib.Path, workers: int = 1, input_cache_mb: float = INPUT_CACHE_MB):
+    """
+    Run all runs of a batch, failed runs do not stop the others
+
+    @param runs: runs of load_runs()
+    @param output: output folder, multi_dim runs write to <output>/<name>/, the other models to
+                   <output>/<name>.csv unless a run sets its own output
+    @param workers: number of worker processes (1 runs everything in this process)
+    @param input_cache_mb: memory cap (MB) of the input shared by the runs of a group
+    @return: list of dicts with name, model, status ("ok" or "failed"), seconds, output and error of every run
+    """
+    tasks = plan_tasks(runs, workers)
+    logging.info(f'Running {len(runs)} runs in {len(tasks)} groups on {workers} worker(s)')
+    results = []
+    if workers <= 1:
+        for task in tasks:
+            results.extend(_run_task(task, output, input_cache_mb))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_run_task, task, output, input_cache_mb, True) for task in tasks]
+            for future in as_completed(futures):
+                results.extend(future.result())
+    order = {run['name']: number for number, run in enumerate(runs)}
+    return sorted(results, key=lambda result: order[result['name']])
+
+
+def _run_task(task: list, output: pathlib.Path, input_cache_mb: float, parallel: bool = False):
+    """
+    Run the runs of one task one after another, multi_dim runs share their input
+
+    @param parallel: the task runs in a worker process next to others
+    @return: list of results (see run_batch())
+    """
+    import dask
+
+    from growth_model.cli import run_model
+
+    if parallel:
+        # Tasks already run in parallel, do not start dask threads within a worker
+        dask.config.set(scheduler='synchronous')
+    shared_input = _shared_input(task, input_cache_mb)
+
+    results = []
+    for run in task:
+        settings = run['settings']
+        model = settings.get('model')
+        if run['output'] is not None:
+            run_output = output.joinpath(run['output'])
+        elif model == 'multi_dim':
+            run_output = output.joinpath(run['name'])
+        else:
+            run_output = output.joinpath(f'{run["name"]}.csv')
+        result = {'name': run['name'], 'model': model, 'status': 'ok', 'output': str(run_output), 'error': None}
+        logging.info(f'Run "{run["name"]}" ({run["config_file"]})')
+        begin_time = time.perf_counter()
+        try:
+            run_model(settings, run_output, shared_input=shared_input if model == 'multi_dim' else None)
+        except Exception as error:
+            result.update(status='failed', error=f'{type(error).__name__}: {error}')
+        result['seconds'] = time.perf_counter() - begin_time
+        if result['error'] is not None:
+            logging.error(f'Run "{run["name"]}" failed: {result["error"]}')
+        results.append(result)
+    if shared_input is not None:
+        logging.info(f'Shared input: {shared_input}')
+    return results
+
+
+def _shared_input(task: list, input_cache_mb: float):
+    """
+    Open the input of the multi_dim runs of a task once
+
+    @return: temperature.SharedInput or None if the runs do not share an input, read prepared input or
+             the input cannot be opened (every run then opens its input and reports its own errors)
+    """
+    from growth_model.prepared import open_prepared
+    from growth_model.temperature import SharedInput, open_input
+
+    settings = [run['settings'] for run in task if run['settings'].get('model') == 'multi_dim']
+    if len(settings) < 2:
+        return None
+    try:
+        if all(run.get('prepared_input', True) and open_prepared(
+                run['input_data'], run['first_year'], run['final_year'], run['depth'], run['lat'], run['lon'],
+                run.get('prepared_dir')) is not None for run in settings):
+            logging.info(f'Runs of {settings[0]["input_data"]} read prepared input')
+            return None
+        input_files = open_input(settings[0]['input_data'], min(run['first_year'] for run in settings),
+                                 max(run['final_year'] for run in settings))
+        # Runs selecting coordinates that are not in the input fail on their own
+        selections = [(run['depth'], run['lat'], run['lon']) for run in settings]
+        selections = [selection for selection in selections if all(
+            (input_files.indexes[name].get_indexer(labels) >= 0).all()
+            for name, labels in zip(('depth_coord', 'latitude', 'longitude'), selection))]
+        return SharedInput(input_files, selections, max_mb=input_cache_mb)
+    except (KeyError, ValueError, OSError) as error:
+        logging.warning(f'Runs of {settings[0].get("input_data")} open their input separately: {error}')
+        return None
+
+
+def _log_summary(results: list):
+    """
+    Log the status and time of every run
+
+    @return: None
+    """
+    width = max(len(result['name']) for result in results)
+    logging.info(f'{"run":{width}}  {"model":10}  {"status":6}  {"seconds":>9}')
+    for result in results:
+        logging.info(f'{result["name"]:{width}}  {str(result["model"]):10}  {result["status"]:6}  '
+                     f'{result["seconds"]:9.3f}' + (f'  {result["error"]}' if result['error'] else ''))
+    failed = sum(result['status'] != 'ok' for result in results)
+    logging.info(f'{len(results) - failed} of {len(results)} runs completed, {failed} failed')
+
+
+def _parse_args():
+    """
+    Parsing the commandline arguments
+
+    @return: the parsed arguments (argparse.Namespace)
+    """
+    parser = argparse.ArgumentParser(description='Runs many growth model configurations in one call',
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('output', type=str,
+                        help='Output folder: model "multi_dim" writes to <output>/<run name>/, the other models\n'
+                             f'to <output>/<run name>.csv, the summary is saved to <output>/{SUMMARY_NAME}')
+    parser.add_argument('config_files', type=str, nargs='+', metavar='CONFIG',
+                        help='Config files (.toml) or glob patterns (e.g. "config/ensemble/*.toml"),\n'
+                             'a config file with [[runs]] tables holds several runs')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes (default: 1)')
+    parser.add_argument('--input-cache-mb', type=float, default=INPUT_CACHE_MB,
+                        help=f'Memory cap (MB) of the input shared by the runs of a group (default: {INPUT_CACHE_MB})')
+    return parser.parse_args()
+
+
+def main():
+    """
+    Entrypoint of the batch runner
+
+    @return: exit code (1 if a run failed)
+    """
+    from growth_model.utils import init_logger
+
+    init_logger(pathlib.Path.cwd().joinpath('logger.conf'))
+    args = _parse_args()
+    output = pathlib.Path(args.output)
+    if output.is_file():
+        sys.exit('Error: Output must be a directory')
+    try:
+        runs = load_runs(args.config_files)
+    except (OSError, ValueError, tomli.TOMLDecodeError) as error:
+        sys.exit(f'Error: {error}')
+
+    begin_time = time.perf_counter()
+    results = run_batch(runs, output, args.workers, args.input_cache_mb)
+    _log_summary(results)
+
+    output.mkdir(parents=True, exist_ok=True)
+    with open(output.joinpath(SUMMARY_NAME), 'w') as f:
+        json.dump({'seconds': time.perf_counter() - begin_time, 'workers': args.workers, 'runs': results}, f,
+                  indent=1)
+    sys.exit(1 if any(result['status'] != 'ok' for result in results) else 0)
+
+
+if __name__ == '__main__':
+    main()
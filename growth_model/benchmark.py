@@ -0,0 +1,616 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides a benchmark suite of the growth models:
+- synthetic input temperature files of configurable size (depth x lat x lon x years) in the layout of
+  the bundled SODA data
+- load, compute and write time, throughput in cell-days per second and peak memory of every model,
+  each case runs in a fresh process
+- startup time of the command line interface: time to import the model registry and each model
+  in a fresh interpreter, and the heavy dependencies a model imports
+- kernel backends (see backends.py): one year of daily growth on fields of the problem size with every
+  installed backend, checked against the NumPy reference
+- results as JSON and a regression check against the results of an earlier run
+
+Usage: python -m growth_model.benchmark results.json [--size large] [--startup] [--backends]
+       [--baseline baseline.json]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import pathlib
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+# Benchmark cases: models and multi_dim cohort modes
+CASES = ('base', 'one_temp', 'one_weight', 'sweep', 'one_dim', 'multi_dim', 'multi_dim_stacked')
+
+# Problem sizes: a laptop-sized run (the size of the bundled SODA data) and a run for servers
+SIZES = {
+    'small': dict(depth=18, lat=10, lon=22, years=10, max_age=5, temps=65, weights=1000,
+                  one_dim_temps=65, one_dim_max_age=20, repeat_calls=200),
+    'large': dict(depth=50, lat=180, lon=360, years=15, max_age=5, temps=1000, weights=10000,
+                  one_dim_temps=321, one_dim_max_age=50, repeat_calls=2000),
+}
+
+# Relative change of throughput or peak memory reported as regression
+REGRESSION_THRESHOLD = 0.1
+
+# Days of a multi_dim model year (12 months of 30 days)
+MULTI_DIM_DAYS = 360
+
+# Heavy dependencies listed by the startup benchmark if a model imports them
+HEAVY_MODULES = ('pandas', 'xarray', 'dask', 'netCDF4', 'pyarrow')
+
+# Imports the model registry and one model in a fresh interpreter (model name in sys.argv[1])
+_STARTUP_CODE = '''
+import sys, json, time
+begin = time.perf_counter()
+from growth_model.cli import load_model
+registry_s = time.perf_counter() - begin
+load_model(sys.argv[1])
+import_s = time.perf_counter() - begin
+print(json.dumps({'registry_s': registry_s, 'import_s': import_s,
+                  'modules': [name for name in sys.argv[2:] if name in sys.modules]}))
+'''
+
+FIRST_YEAR = 2000
+INPUT_INFO = 'benchmark_input.json'
+
+
+def make_input(folder: pathlib.Path, depth: int, lat: int, lon: int, years: int,
+               first_year: int = FIRST_YEAR, seed: int = 0):
+    """
+    Write synthetic monthly temperature files, one per year (variable "thetao", 360_day calendar)
+
+    Temperatures follow a seasonal cycle that decreases with depth plus noise. Every (lat, lon) column
+    has a random sea floor, about a quarter of the columns are land; points below the sea floor are
+    masked. Files of an earlier call with the same arguments are reused.
+
+    @param folder: output folder
+    @param depth: number of depth levels
+    @param lat: number of latitudes
+    @param lon: number of longitudes
+    @param years: number of years
+    @param first_year: first year
+    @param seed: seed of the random numbers
+    @return: dict with the coordinate lists depth, lat, lon of the files
+    """
+    import netCDF4
+
+    depths = [float(level) for level in np.round(np.geomspace(30, 30 + 20 * depth, depth) - 20)]
+    lats = [float(value) for value in 40.25 + 0.5 * np.arange(lat)]
+    lons = [float(value) for value in -30.25 + 0.5 * np.arange(lon)]
+    coordinates = dict(depth=depths, lat=lats, lon=lons)
+
+    info = dict(coordinates, years=years, first_year=first_year, seed=seed)
+    info_file = folder.joinpath(INPUT_INFO)
+    if info_file.exists():
+        with open(info_file) as f:
+            if json.load(f) == info:
+                logging.info(f'Using synthetic input in {folder}')
+                return coordinates
+        shutil.rmtree(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    logging.info(f'Writing synthetic input {depth} x {lat} x {lon} x {years} years to {folder}')
+    random = np.random.default_rng(seed)
+    level = np.array(depths, dtype='f')[:, np.newaxis, np.newaxis]
+    # Sea floor of every column, deeper than the deepest level or above the first level (land)
+    floor = random.uniform(-0.25, 1.25, size=(lat, lon)) * depths[-1]
+    dry = level > floor[np.newaxis]
+    mean = (4. + 8. * np.exp(-level / 150.) + np.linspace(3., -3., lat)[:, np.newaxis]).astype('f')
+    for year in range(first_year, first_year + years):
+        filename = folder.joinpath(f'{year}_temp_synthetic.nc')
+        with netCDF4.Dataset(filename, 'w') as ds:
+            ds.createDimension('time', None)
+            ds.createDimension('depth_coord', depth)
+            ds.createDimension('latitude', lat)
+            ds.createDimension('longitude', lon)
+            time_variable = ds.createVariable('time', 'f', ('time',))
+            time_variable.units = 'months since 1960-01-01'
+            time_variable.calendar = '360_day'
+            ds.createVariable('depth_coord', 'f', ('depth_coord',))[:] = depths
+            ds.createVariable('latitude', 'd', ('latitude',))[:] = lats
+            ds.createVariable('longitude', 'd', ('longitude',))[:] = lons
+            thetao = ds.createVariable('thetao', 'f', ('time', 'depth_coord', 'latitude', 'longitude'),
+                                       fill_value=np.float32(-9.99e33))
+            thetao.units = 'Celsius_scale'
+            for month in range(12):
+                time_variable[month] = (year - 1960) * 12 + month + 0.5
+                season = 3. * np.sin(2 * np.pi * (month - 2) / 12) * np.exp(-level / 100.)
+                field = mean + season + random.normal(0., 0.5, size=(depth, lat, lon)).astype('f')
+                thetao[month] = np.ma.masked_array(field, mask=dry)
+
+    with open(info_file, 'w') as f:
+        json.dump(info, f)
+    return coordinates
+
+
+class _PhaseTimer:
+    """
+    Accumulate the time spent in the phases of a run
+    """
+
+    def __init__(self):
+        self.seconds = {'load': 0., 'compute': 0., 'write': 0.}
+
+    def add(self, phase: str, begin: float):
+        self.seconds[phase] += time.perf_counter() - begin
+
+
+class _TimedTemperature:
+    """
+    TemperatureCache counting the time of get() and chunks() as load time
+    """
+
+    def __init__(self, temperature, timer: _PhaseTimer):
+        self.temperature = temperature
+        self.timer = timer
+
+    def get(self, *args):
+        begin = time.perf_counter()
+        try:
+            return self.temperature.get(*args)
+        finally:
+            self.timer.add('load', begin)
+
+    def chunks(self, *args):
+        chunks = self.temperature.chunks(*args)
+        while True:
+            begin = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                self.timer.add('load', begin)
+            yield chunk
+
+
+class _TimedWriter:
+    """
+    Output writer counting the time of write(), flush() and close() as write time
+    """
+
+    def __init__(self, writer, timer: _PhaseTimer):
+        self.writer = writer
+        self.timer = timer
+
+    def write(self, *args):
+        begin = time.perf_counter()
+        try:
+            self.writer.write(*args)
+        finally:
+            self.timer.add('write', begin)
+
+    def flush(self):
+        begin = time.perf_counter()
+        try:
+            self.writer.flush()
+        finally:
+            self.timer.add('write', begin)
+
+    def pending(self):
+        return self.writer.pending()
+
+    def close(self):
+        begin = time.perf_counter()
+        try:
+            self.writer.close()
+        finally:
+            self.timer.add('write', begin)
+
+
+def _run_sweep_case(case: str, size: dict, work_dir: pathlib.Path):
+    """
+    Models base, one_temp, one_weight and sweep: growth of (temperature, weight) combinations over one day
+
+    base, one_temp and one_weight are wrappers around models.sweep.sweep_frame(), base is called
+    repeat_calls times for a single combination.
+
+    @return: (phase seconds, cell-days)
+    """
+    from growth_model.models.sweep import sweep_frame
+
+    temps = np.linspace(-2., 30., size['temps'])
+    weights = np.geomspace(1., 10000., size['weights'])
+    arguments = {'base': [(10., 1000.)] * size['repeat_calls'],
+                 'one_temp': [(10., weights)],
+                 'one_weight': [(temps, 1000.)],
+                 'sweep': [(temps, weights)]}[case]
+
+    timer = _PhaseTimer()
+    frames = []
+    begin = time.perf_counter()
+    for temp, weight in arguments:
+        frames.append(sweep_frame(temp, weight))
+    timer.add('compute', begin)
+    begin = time.perf_counter()
+    output = work_dir.joinpath(f'{case}.csv')
+    for number, df in enumerate(frames):
+        df.to_csv(output, mode='a' if number else 'w', header=not number, index=False)
+    timer.add('write', begin)
+    return timer.seconds, sum(len(df) for df in frames)
+
+
+def _run_one_dim_case(size: dict, work_dir: pathlib.Path):
+    """
+    Model one_dim: daily growth over max_age years for a range of temperatures
+
+    @return: (phase seconds, cell-days)
+    """
+    from growth_model.models.one_dim import growth_parameters, one_dim
+
+    timer = _PhaseTimer()
+    begin = time.perf_counter()
+    growth_parameters()
+    timer.add('load', begin)
+    begin = time.perf_counter()
+    df = one_dim(min_temp=-2, max_temp=-2 + 0.1 * size['one_dim_temps'], temp_step=0.1, weight=1,
+                 max_age=size['one_dim_max_age'], output=None)
+    timer.add('compute', begin)
+    begin = time.perf_counter()
+    df.to_csv(work_dir.joinpath('one_dim.csv'))
+    timer.add('write', begin)
+    return timer.seconds, df.shape[0] * df.shape[1]
+
+
+def _run_multi_dim_case(cohort_mode: str, size: dict, settings: dict, input_dir: pathlib.Path,
+                        work_dir: pathlib.Path):
+    """
+    Model multi_dim on the synthetic input: the cohort loop of one region with the model settings
+
+    Tiling (tile_memory_mb, workers), checkpoints, incremental runs and reductions (their boxes refer to the
+    grid of the config file) are not part of the benchmark.
+
+    @return: (phase seconds, cell-days)
+    """
+    from growth_model.backends import get_backend
+    from growth_model.lookup import parameter_functions
+    from growth_model.models.multi_dim import _required_variables, _run_sequential, _run_stacked
+    from growth_model.output import create_writer
+    from growth_model.temperature import TemperatureCache, load_wet_points, open_input
+
+    coordinates = make_input(input_dir, size['depth'], size['lat'], size['lon'], size['years'])
+    depth, lat, lon = coordinates['depth'], coordinates['lat'], coordinates['lon']
+    first_year, final_year, max_age = FIRST_YEAR, FIRST_YEAR + size['years'] - 1, size['max_age']
+
+    timer = _PhaseTimer()
+    begin = time.perf_counter()
+    input_files = open_input(str(input_dir), first_year, final_year)
+    points = None
+    if settings.get('compact_wet_points', True):
+        points = load_wet_points(input_files, first_year, final_year, depth, lat, lon)
+    temperature = TemperatureCache(input_files, max_mb=settings.get('temp_cache_mb', 512), points=points)
+    backend = get_backend(settings.get('kernel_backend', 'numpy'))
+    parameters = parameter_functions(settings.get('parameter_engine', 'exact'), settings.get('lut_step', 0.01),
+                                     backend)
+    timer.add('load', begin)
+
+    begin = time.perf_counter()
+    writer = create_writer(output_format=settings.get('output_format', 'netcdf'),
+                           output_dir=work_dir.joinpath(cohort_mode), depth=depth, lat=lat, lon=lon,
+                           max_age=max_age, first_cohort=first_year, name='benchmark',
+                           complevel=settings.get('output_complevel', 4), chunks=settings.get('output_chunks'),
+                           asynchronous=settings.get('async_output', False),
+                           queue_size=settings.get('output_queue_size', 4),
+                           variables=settings.get('output_variables'))
+    timer.add('write', begin)
+    run = _run_stacked if cohort_mode == 'stacked' else _run_sequential
+    propagator_steps = (settings.get('propagator_temp_step', 0.05), settings.get('propagator_log_weight_step', 0.01))
+
+    before = dict(timer.seconds)
+    begin = time.perf_counter()
+    timed_writer = _TimedWriter(writer, timer)
+    try:
+        run(_TimedTemperature(temperature, timer), lat, lon, depth, max_age, first_year, final_year, timed_writer,
+            points, parameters, settings.get('integrator', 'daily'), propagator_steps,
+            variables=_required_variables(settings.get('output_variables')), backend=backend)
+    finally:
+        timed_writer.close()
+    # Everything but reading and writing within the cohort loop is computation
+    timer.seconds['compute'] += (time.perf_counter() - begin - (timer.seconds['load'] - before['load'])
+                                 - (timer.seconds['write'] - before['write']))
+
+    cohort_years = max(0, final_year - max_age - first_year + 1) * max_age
+    cells = len(depth) * len(lat) * len(lon)
+    return timer.seconds, cells * cohort_years * MULTI_DIM_DAYS
+
+
+def _run_case(case: str, size: dict, settings: dict, input_dir: str, work_dir: str):
+    """
+    Run one benchmark case (in a fresh worker process)
+
+    @return: dict with the results of the case (see run())
+    """
+    import resource
+
+    work_dir = pathlib.Path(work_dir).joinpath(case)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    if case == 'one_dim':
+        seconds, cell_days = _run_one_dim_case(size, work_dir)
+    elif case.startswith('multi_dim'):
+        cohort_mode = 'stacked' if case == 'multi_dim_stacked' else 'sequential'
+        seconds, cell_days = _run_multi_dim_case(cohort_mode, size, settings, pathlib.Path(input_dir), work_dir)
+    else:
+        seconds, cell_days = _run_sweep_case(case, size, work_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Peak resident memory of this process, in kB on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / 1024 ** (2 if sys.platform == 'darwin' else 1)
+    total = sum(seconds.values())
+    return {'load_s': seconds['load'], 'compute_s': seconds['compute'], 'write_s': seconds['write'],
+            'total_s': total, 'cell_days': cell_days,
+            'cell_days_per_s': cell_days / total if total > 0 else float('inf'),
+            'peak_rss_mb': peak_rss_mb}
+
+
+def run(size: dict, cases=CASES, settings: dict = None, data_dir: pathlib.Path = None, repeat: int = 1):
+    """
+    Run the benchmark cases, every case in a fresh process
+
+    @param size: problem size, see SIZES
+    @param cases: names of the cases, see CASES
+    @param settings: multi_dim model settings (e.g. cohort_mode, output_format, parameter_engine, integrator)
+    @param data_dir: folder of the synthetic input, reused by later runs (default: temporary folder)
+    @param repeat: number of runs of every case, the fastest run is reported
+    @return: dict with the size, the environment and the results by case
+    """
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        raise ValueError(f'Unknown benchmark cases {sorted(unknown)}, expected some of {CASES}')
+    settings = settings or {}
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='growth_model_benchmark_') as work_dir:
+        input_dir = pathlib.Path(data_dir) if data_dir is not None else pathlib.Path(work_dir, 'input')
+        if any(case.startswith('multi_dim') for case in cases):
+            # Write the input once, outside of the timed cases
+            make_input(input_dir, size['depth'], size['lat'], size['lon'], size['years'])
+        for case in cases:
+            runs = []
+            for _ in range(repeat):
+                # A fresh process per run: peak memory of the case, no caches of earlier runs
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    runs.append(executor.submit(_run_case, case, size, settings, str(input_dir),
+                                                work_dir).result())
+            results[case] = min(runs, key=lambda result: result['total_s'])
+            logging.info(f'{case}: {_describe(results[case])}')
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'size': size, 'settings': settings,
+            'environment': _environment(), 'results': results}
+
+
+def startup(models=None, repeat: int = 5):
+    """
+    Measure the startup time of the command line interface for every model, each run in a fresh interpreter
+
+    @param models: model names (default: all models of cli.MODELS)
+    @param repeat: runs of every model, the fastest is reported
+    @return: dict by model with import_s (import of the registry and the model module), registry_s (import
+             of the registry), process_s (wall time of the interpreter process) and modules (HEAVY_MODULES
+             imported); dependencies a model only imports while running (e.g. pandas of "one_temp") are
+             not included
+    """
+    from growth_model.cli import MODELS
+
+    models = list(MODELS) if models is None else models
+    unknown = set(models) - set(MODELS)
+    if unknown:
+        raise ValueError(f'Unknown models {sorted(unknown)}, expected some of {list(MODELS)}')
+    # Run the interpreters on this source tree, also when the package is not installed
+    package_root = str(pathlib.Path(__file__).resolve().parents[1])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_root, os.environ.get('PYTHONPATH')])))
+
+    results = {}
+    for model in models:
+        runs = []
+        for _ in range(repeat):
+            begin = time.perf_counter()
+            process = subprocess.run([sys.executable, '-c', _STARTUP_CODE, model, *HEAVY_MODULES], env=env,
+                                     capture_output=True, text=True, check=True)
+            result = dict(json.loads(process.stdout), process_s=time.perf_counter() - begin)
+            runs.append(result)
+        results[model] = min(runs, key=lambda result: result['process_s'])
+        logging.info(f'startup {model}: import {results[model]["import_s"]:.3f} s, process '
+                     f'{results[model]["process_s"]:.3f} s, imports {", ".join(results[model]["modules"]) or "-"}')
+    return results
+
+
+def kernel_backends(size: dict, repeat: int = 3):
+    """
+    Time one year of daily growth with every installed kernel backend (see backends.check_backends())
+
+    @param size: problem size, the fields have the shape (depth, lat * lon)
+    @param repeat: runs of every backend, the fastest is reported
+    @return: dict by backend with seconds, cell_days_per_s, speedup (over numpy) and max_rel_diff
+    """
+    from growth_model.backends import check_backends
+
+    results = check_backends((size['depth'], size['lat'] * size['lon']), MULTI_DIM_DAYS, repeat=repeat)
+    for name, result in results.items():
+        logging.info(f'backend {name}: {result["cell_days_per_s"]:.3g} cell-days/s, {result["speedup"]:.2f} x numpy, '
+                     f'max relative difference {result["max_rel_diff"]:.2e}')
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD):
+    """
+    Compare results with the results of an earlier run of the same size
+
+    @param results: results of run() (and of startup() under key "startup", of kernel_backends() under key
+                    "backends")
+    @param baseline: results of run() (and of startup() under key "startup", of kernel_backends() under key
+                     "backends")
+    @param threshold: relative loss of throughput (cell-days per second), growth of peak memory or growth
+                      of the startup time reported as regression
+    @return: list of regression messages (empty if there is none)
+    """
+    regressions = []
+    if results.get('backends') and baseline.get('backends') and results['size'] == baseline['size']:
+        for name, result in results['backends'].items():
+            reference = baseline['backends'].get(name)
+            if reference is None:
+                continue
+            speed = result['cell_days_per_s'] / reference['cell_days_per_s']
+            logging.info(f'backend {name}: throughput {speed:.2f} x of the baseline')
+            if speed < 1 - threshold:
+                regressions.append(f'backend {name}: throughput {result["cell_days_per_s"]:.3g} cell-days/s is '
+                                   f'{1 - speed:.0%} below the baseline {reference["cell_days_per_s"]:.3g}')
+    for model, result in results.get('startup', {}).items():
+        reference = baseline.get('startup', {}).get(model)
+        if reference is None:
+            continue
+        growth = result['process_s'] / reference['process_s']
+        logging.info(f'startup {model}: {growth:.2f} x of the baseline')
+        if growth > 1 + threshold:
+            regressions.append(f'startup {model}: {result["process_s"]:.3f} s is {growth - 1:.0%} above the '
+                               f'baseline {reference["process_s"]:.3f} s')
+    if not results['results'] or not baseline['results']:
+        return regressions
+    if results['size'] != baseline['size']:
+        raise ValueError(f'Cannot compare benchmark results of size {results["size"]} with a baseline '
+                         f'of size {baseline["size"]}')
+    regressions = []
+    for case, result in results['results'].items():
+        reference = baseline['results'].get(case)
+        if reference is None:
+            logging.info(f'{case}: not in the baseline')
+            continue
+        speed = result['cell_days_per_s'] / reference['cell_days_per_s']
+        memory = result['peak_rss_mb'] / reference['peak_rss_mb']
+        logging.info(f'{case}: throughput {speed:.2f} x, peak memory {memory:.2f} x of the baseline')
+        if speed < 1 - threshold:
+            regressions.append(f'{case}: throughput {result["cell_days_per_s"]:.3g} cell-days/s is '
+                               f'{1 - speed:.0%} below the baseline {reference["cell_days_per_s"]:.3g}')
+        if memory > 1 + threshold:
+            regressions.append(f'{case}: peak memory {result["peak_rss_mb"]:.1f} MB is '
+                               f'{memory - 1:.0%} above the baseline {reference["peak_rss_mb"]:.1f} MB')
+    return regressions
+
+
+def _describe(result: dict):
+    return (f'load {result["load_s"]:.3f} s, compute {result["compute_s"]:.3f} s, '
+            f'write {result["write_s"]:.3f} s, {result["cell_days_per_s"]:.3g} cell-days/s, '
+            f'peak memory {result["peak_rss_mb"]:.1f} MB')
+
+
+def _environment():
+    """
+    Description of the machine and the software versions
+
+    @return: dict
+    """
+    from importlib import metadata
+
+    try:
+        version = metadata.version('growth_model')
+    except metadata.PackageNotFoundError:
+        version = None
+    from growth_model.backends import available_backends
+
+    return {'growth_model': version, 'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'backends': list(available_backends())}
+
+
+def _parse_args():
+    """
+    Parsing the commandline arguments
+
+    @return: the parsed arguments (argparse.Namespace)
+    """
+    parser = argparse.ArgumentParser(description='Benchmark of the growth models on synthetic input',
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('output', type=str, help='Results (.json)')
+    parser.add_argument('--size', choices=sorted(SIZES), default='small',
+                        help='Problem size: "small" (laptop, the size of the bundled SODA data) or "large" (servers)')
+    for name in SIZES['small']:
+        parser.add_argument(f'--{name.replace("_", "-")}', type=int, dest=name,
+                            help=f'Override "{name}" of the problem size')
+    parser.add_argument('--cases', type=str, nargs='+', default=list(CASES), choices=CASES, metavar='CASE',
+                        help=f'Cases to run (default: all of {", ".join(CASES)})')
+    parser.add_argument('--config', type=str,
+                        help='multi_dim config file (.toml), its settings apart from grid, years, cohort mode and\n'
+                             'input/output folders are used by the multi_dim cases')
+    parser.add_argument('--data-dir', type=str,
+                        help='Folder of the synthetic input, kept and reused by later runs of the same size')
+    parser.add_argument('--repeat', type=int,
+                        help='Runs of every case, the fastest is reported (default: 1, 5 with --startup,\n'
+                             '3 with --backends)')
+    parser.add_argument('--startup', action='store_true',
+                        help='Only measure the startup time of the command line interface for every model\n'
+                             '(import time in a fresh interpreter and the heavy dependencies it imports)')
+    parser.add_argument('--backends', action='store_true',
+                        help='Only time the kernel backends (one year of daily growth on fields of the problem size)\n'
+                             'and check them against the NumPy reference')
+    parser.add_argument('--baseline', type=str, help='Results (.json) of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help=f'Relative change reported as regression (default: {REGRESSION_THRESHOLD})')
+    return parser.parse_args()
+
+
+def main():
+    """
+    Run the benchmark, save the results and compare them with a baseline
+
+    @return: exit code (1 if there are regressions)
+    """
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = _parse_args()
+    size = dict(SIZES[args.size])
+    size.update({name: getattr(args, name) for name in size if getattr(args, name) is not None})
+    settings = {}
+    if args.config:
+        from growth_model.utils import load_config
+
+        # The cases set the cohort mode, the size sets grid and years
+        excluded = ('model', 'lat', 'lon', 'depth', 'max_age', 'first_year', 'final_year', 'exp_name', 'region',
+                    'input_data', 'cohort_mode')
+        settings = {key: value for key, value in load_config(args.config).items() if key not in excluded}
+
+    if args.startup:
+        results = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'size': size, 'settings': {},
+                   'environment': _environment(), 'results': {}, 'startup': startup(repeat=args.repeat or 5)}
+    elif args.backends:
+        results = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'size': size, 'settings': {},
+                   'environment': _environment(), 'results': {}, 'backends': kernel_backends(size, args.repeat or 3)}
+    else:
+        results = run(size, args.cases, settings, args.data_dir, args.repeat or 1)
+    output = pathlib.Path(args.output)
+    if not output.parent.exists():
+        output.parent.mkdir(parents=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    logging.info(f'Saved results to {output.resolve()}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        try:
+            regressions = compare(results, baseline, args.threshold)
+        except ValueError as error:
+            sys.exit(f'Error: {error}')
+        for regression in regressions:
+            logging.warning(f'Regression: {regression}')
+        if regressions:
+            return 1
+        logging.info('No regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
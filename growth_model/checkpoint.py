@@ -0,0 +1,143 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides restart support for long multi_dim runs:
+- periodic checkpoints of the model state, a killed run resumes from the last checkpoint
+- a record of the completed cohorts and their inputs, an incremental run only computes
+  cohorts that are new or whose input files changed
+"""
+
+import os
+import json
+import pathlib
+import hashlib
+import logging
+
+import numpy as np
+
+RECORD_NAME = '.growth_model_record.json'
+
+# Prefix of the fields of pending writes in a checkpoint
+_PENDING = 'pending.'
+
+
+def fingerprint(**settings):
+    """
+    Hash of the settings that determine the model results
+
+    @param settings: JSON serializable settings
+    @return: hex digest
+    """
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Checkpoint:
+    """
+    Model state saved every interval calls of save() to an .npz file
+
+    The computation does not wait for the output: writes still pending in a background writer are saved
+    with the checkpoint and written again by a run resumed from it (see load()), which then continues with
+    the first output that may be missing.
+    """
+
+    def __init__(self, filename: pathlib.Path, run_fingerprint: str, interval: int = 1):
+        """
+        @param filename: checkpoint file (.npz)
+        @param run_fingerprint: fingerprint() of the run, checkpoints of other runs are ignored
+        @param interval: number of completed steps (years) between checkpoints, 0 disables checkpoints
+        """
+        self.filename = filename
+        self.run_fingerprint = run_fingerprint
+        self.interval = interval
+        self._steps = 0
+
+    def load(self):
+        """
+        Load the state of the last checkpoint
+
+        @return: dict of the saved state or None if there is no matching checkpoint
+        """
+        if not self.filename.exists():
+            logging.info(f'No checkpoint {self.filename}, starting from the beginning')
+            return None
+        with np.load(self.filename) as checkpoint:
+            state = {name: checkpoint[name] for name in checkpoint.files}
+        if str(state.pop('fingerprint')) != self.run_fingerprint:
+            logging.warning(f'Ignoring checkpoint {self.filename} of a run with other settings or inputs')
+            return None
+        # Output that was not written when the checkpoint was saved
+        fields = {name[len(_PENDING):]: state.pop(name) for name in list(state) if name.startswith(_PENDING)}
+        keys = state.pop('pending_keys', np.empty((0, 2), dtype='i4'))
+        state['pending'] = [(int(year), int(age), {var_name: values[number] for var_name, values in fields.items()})
+                            for number, (year, age) in enumerate(keys)]
+        logging.info(f'Resuming from checkpoint {self.filename} ({len(state["pending"])} pending writes)')
+        return state
+
+    def save(self, writer, force: bool = False, **state):
+        """
+        Count a completed step and save the state if a checkpoint is due
+
+        @param writer: output writer (flushed, its pending writes are saved), None if all output is written
+        @param force: save regardless of the interval
+        @param state: numpy arrays and numbers
+        @return: None
+        """
+        self._steps += 1
+        if not force and (not self.interval or self._steps % self.interval):
+            return
+        pending = []
+        if writer is not None:
+            writer.flush()
+            pending = writer.pending()
+        fields = {}
+        for number, (_, _, item_fields) in enumerate(pending):
+            for var_name, data in item_fields.items():
+                fields.setdefault(_PENDING + var_name, [None] * len(pending))[number] = data
+        keys = np.array([(year, age) for year, age, _ in pending], dtype='i4').reshape(-1, 2)
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.filename.with_name(f'{self.filename.stem}.{os.getpid()}.tmp')
+        with open(temporary, 'wb') as f:
+            # Not compressed: compressing the state would take longer than writing it
+            np.savez(f, fingerprint=self.run_fingerprint, pending_keys=keys,
+                     **{name: np.stack(values) for name, values in fields.items()}, **state)
+        os.replace(temporary, self.filename)
+        logging.debug(f'Saved checkpoint {self.filename}')
+
+
+def load_record(output_dir: pathlib.Path, run_fingerprint: str):
+    """
+    Input hashes of the cohorts completed by earlier runs with the same settings
+
+    @param output_dir: output folder of the experiment and region
+    @param run_fingerprint: fingerprint() of the settings
+    @return: dict of input hash by cohort (birth year)
+    """
+    filename = output_dir.joinpath(RECORD_NAME)
+    if not filename.exists():
+        return {}
+    with open(filename) as f:
+        record = json.load(f)
+    if record.get('fingerprint') != run_fingerprint:
+        logging.info(f'Ignoring the record of output in {output_dir} computed with other settings')
+        return {}
+    return {int(cohort): inputs for cohort, inputs in record['cohorts'].items()}
+
+
+def save_record(output_dir: pathlib.Path, run_fingerprint: str, cohorts: dict):
+    """
+    Record the completed cohorts
+
+    @param output_dir: output folder of the experiment and region
+    @param run_fingerprint: fingerprint() of the settings
+    @param cohorts: dict of input hash by cohort (birth year)
+    @return: None
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    filename = output_dir.joinpath(RECORD_NAME)
+    temporary = filename.with_name(f'{RECORD_NAME}.{os.getpid()}')
+    with open(temporary, 'w') as f:
+        json.dump({'fingerprint': run_fingerprint, 'cohorts': {str(cohort): inputs for cohort, inputs
+                                                                in sorted(cohorts.items())}}, f, indent=1)
+    os.replace(temporary, filename)
@@ -7,19 +7,153 @@ Functions in this file take information from a command line user input and param
 """
 
 import argparse
+import importlib
 import sys
 import pathlib
 import logging
 
+from growth_model import metrics
+from growth_model.lookup import LUT_STEP
+from growth_model.propagator import PROPAGATOR_LOG_WEIGHT_STEP, PROPAGATOR_TEMP_STEP
 from growth_model.utils import init_logger
-from growth_model.models.base import base
-from growth_model.models.one_temp_input import one_temp
-from growth_model.models.one_init_weight import one_weight
-from growth_model.models.one_dim import one_dim
-from growth_model.models.multi_dim import multi_dim
 from growth_model.utils import load_config
 
 
+def _run_base(base, settings: dict, output: pathlib.Path, resume: bool, shared_input):
+    """
+    Run model "base" with the settings of a config file (see run_model())
+    """
+    base(temp=settings['temp'], weight=settings['weight'], output=output)
+
+
+def _run_one_dim(one_dim, settings: dict, output: pathlib.Path, resume: bool, shared_input):
+    """
+    Run model "one_dim" with the settings of a config file (see run_model())
+    """
+    one_dim(min_temp=settings['min_temp'], max_temp=settings['max_temp'], temp_step=settings['temp_step'],
+            weight=settings['weight'], max_age=settings['max_age'], output=output,
+            float32=settings.get('float32', False))
+
+
+def _run_one_temp(one_temp, settings: dict, output: pathlib.Path, resume: bool, shared_input):
+    """
+    Run model "one_temp" with the settings of a config file (see run_model())
+    """
+    one_temp(temp=settings['temp'], weight=settings['weight'],
+             output=output)
+
+
+def _run_one_weight(one_weight, settings: dict, output: pathlib.Path, resume: bool, shared_input):
+    """
+    Run model "one_weight" with the settings of a config file (see run_model())
+    """
+    one_weight(temp=settings['temp'], weight=settings['weight'],
+               output=output)
+
+
+def _run_sweep(sweep, settings: dict, output: pathlib.Path, resume: bool, shared_input):
+    """
+    Run model "sweep" with the settings of a config file (see run_model())
+    """
+    sweep(temp=settings['temp'], weight=settings['weight'], output=output, dt=settings.get('dt', 1),
+          chunk_rows=settings.get('chunk_rows', 1000000))
+
+
+def _run_monte_carlo(monte_carlo, settings: dict, output: pathlib.Path, resume: bool, shared_input):
+    """
+    Run model "monte_carlo" with the settings of a config file (see run_model())
+    """
+    monte_carlo(temp=settings['temp'], weight=settings['weight'], max_age=settings['max_age'],
+                draws=settings['draws'], distributions=settings.get('distributions', {}), output=output,
+                batch_size=settings.get('batch_size', 1000),
+                quantiles=settings.get('quantiles', (0.05, 0.5, 0.95)), seed=settings.get('seed'))
+
+
+def _run_trajectory(trajectory, settings: dict, output: pathlib.Path, resume: bool, shared_input):
+    """
+    Run model "trajectory" with the settings of a config file (see run_model())
+    """
+    trajectory(input_data=settings['input_data'], first_year=settings['first_year'],
+               final_year=settings['final_year'], max_age=settings['max_age'], depth=settings['depth'],
+               lat=settings['lat'], lon=settings['lon'], output=output, weight=settings.get('weight', 1.),
+               individuals=settings.get('individuals', 1000),
+               movement=settings.get('movement', 'random_walk'), tracks=settings.get('tracks'),
+               start_positions=settings.get('start_positions'), step_km=settings.get('step_km', 5.),
+               step_depth=settings.get('step_depth', 2.), seed=settings.get('seed'),
+               batch_size=settings.get('batch_size', 50000),
+               parameter_engine=settings.get('parameter_engine', 'exact'),
+               lut_step=settings.get('lut_step', LUT_STEP),
+               output_complevel=settings.get('output_complevel', 4),
+               kernel_backend=settings.get('kernel_backend', 'numpy'))
+
+
+def _run_multi_dim(multi_dim, settings: dict, output: pathlib.Path, resume: bool, shared_input):
+    """
+    Run model "multi_dim" with the settings of a config file (see run_model())
+    """
+    multi_dim(lat=settings['lat'], lon=settings['lon'], depth=settings['depth'],
+              max_age=settings['max_age'], first_year=settings['first_year'],
+              final_year=settings['final_year'], exp_name=settings['exp_name'],
+              region=settings['region'], input_data=settings['input_data'], output=output,
+              cohort_mode=settings.get('cohort_mode', 'sequential'),
+              temp_cache_mb=settings.get('temp_cache_mb', 512),
+              output_format=settings.get('output_format', 'netcdf'),
+              output_complevel=settings.get('output_complevel', 4),
+              output_chunks=settings.get('output_chunks'),
+              async_output=settings.get('async_output', False),
+              output_queue_size=settings.get('output_queue_size', 4),
+              tile_memory_mb=settings.get('tile_memory_mb', 0),
+              workers=settings.get('workers', 1),
+              compact_wet_points=settings.get('compact_wet_points', True),
+              parameter_engine=settings.get('parameter_engine', 'exact'),
+              lut_step=settings.get('lut_step', LUT_STEP),
+              integrator=settings.get('integrator', 'daily'),
+              propagator_temp_step=settings.get('propagator_temp_step', PROPAGATOR_TEMP_STEP),
+              propagator_log_weight_step=settings.get('propagator_log_weight_step', PROPAGATOR_LOG_WEIGHT_STEP),
+              checkpoint_years=settings.get('checkpoint_years', 0),
+              resume=resume,
+              incremental=settings.get('incremental', False),
+              shared_input=shared_input,
+              time_chunk_steps=settings.get('time_chunk_steps', 0),
+              prepared_input=settings.get('prepared_input', True),
+              prepared_dir=settings.get('prepared_dir'),
+              output_variables=settings.get('output_variables'),
+              reductions=settings.get('reductions', []),
+              kernel_backend=settings.get('kernel_backend', 'numpy'))
+
+
+# Registry of the models: module and function of every model and the function running it with the settings of
+# a config file, called as runner(model function, settings, output, resume, shared_input). A model module (and
+# its dependencies, e.g. xarray and dask for "multi_dim") is only imported when the model runs, see load_model()
+MODELS = {
+    'base': ('growth_model.models.base', 'base', _run_base),
+    'one_dim': ('growth_model.models.one_dim', 'one_dim', _run_one_dim),
+    'one_temp': ('growth_model.models.one_temp_input', 'one_temp', _run_one_temp),
+    'one_weight': ('growth_model.models.one_init_weight', 'one_weight', _run_one_weight),
+    'sweep': ('growth_model.models.sweep', 'sweep', _run_sweep),
+    'monte_carlo': ('growth_model.models.monte_carlo', 'monte_carlo', _run_monte_carlo),
+    'multi_dim': ('growth_model.models.multi_dim', 'multi_dim', _run_multi_dim),
+    'trajectory': ('growth_model.models.trajectory', 'trajectory', _run_trajectory),
+}
+
+# Models writing to an output folder or to an output file
+MODELS_OUTPUT_DIR = ('multi_dim',)
+MODELS_OUTPUT_FILE = ('base', 'one_dim', 'one_temp', 'one_weight', 'sweep', 'monte_carlo', 'trajectory')
+
+
+def load_model(model: str):
+    """
+    Import the function of a model
+
+    @param model: model name (see MODELS)
+    @return: model function
+    """
+    if model not in MODELS:
+        raise ValueError(f'model "{model}" not available')
+    module, function, _ = MODELS[model]
+    return getattr(importlib.import_module(module), function)
+
+
 def _parse_args():
     """
     Parsing the commandline arguments
@@ -28,7 +162,9 @@ def _parse_args():
     """
 
     parser = argparse.ArgumentParser(description='Estimates  growth-rate per day and the weight of atlantic cod',
-                                     formatter_class=argparse.RawTextHelpFormatter)
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog='"cod-growth-model serve --help" describes the growth query service,\n'
+                                            '"cod-growth-model prepare --help" the prepared input of model multi_dim')
 
     parser.add_argument('config_file', type=str,
                         help='Configuration file (.toml) - contains model and settings for '
@@ -38,10 +174,47 @@ def _parse_args():
                         help='Output where calculation results are stored. '
                              'Destination will be created if it does not exist, existing files will be overwritten.\n'
                              'For models "base", "one_dim", "one_temp" and "one_weight" the output is a CSV-File\n'
+                             'For model "sweep" the output is a CSV-File or a Parquet-File (suffix ".parquet")\n'
+                             'For model "monte_carlo" the output is a CSV-File of statistics over the parameter sets\n'
+                             'For model "trajectory" the output is a NC-file with the state of every individual per year\n'
                              'For model "multi_dim" the output is a directory, where results are stored as NC-files')
+
+    parser.add_argument('--resume', action='store_true',
+                        help='Model "multi_dim": continue a killed run with the same config file and output\n'
+                             'from its last checkpoint (see "checkpoint_years" in the config file, fails if\n'
+                             'checkpoints are disabled and there is no checkpoint)')
+
+    parser.add_argument('--metrics', type=str, metavar='FILE',
+                        help='Save a JSON report of the time spent in the phases of the run (config load, input open,\n'
+                             'temperature selection, kernel, output) and of the cells integrated, bytes read and written')
+
+    parser.add_argument('--profile', type=str, metavar='FILE',
+                        help='Profile the integration kernel with cProfile and save the statistics\n'
+                             '(e.g. for "python -m pstats FILE" or snakeviz), the report of --metrics lists the top functions')
+
+    parser.add_argument('--backend', type=str, metavar='NAME',
+                        help='Models "multi_dim" and "trajectory": compute backend of the growth kernels, "numpy",\n'
+                             '"numexpr", "numba" or "auto" (replaces "kernel_backend" of the config file,\n'
+                             'compare the backends with "python -m growth_model.backends")')
     return parser.parse_args()
 
 
+def run_model(settings: dict, output: pathlib.Path, resume: bool = False, shared_input=None):
+    """
+    Run the model of a config file
+
+    @param settings: model settings (see utils.load_config())
+    @param output: output file or folder (see MODELS_OUTPUT_DIR and MODELS_OUTPUT_FILE)
+    @param resume: model "multi_dim": continue a killed run from its last checkpoint
+    @param shared_input: model "multi_dim": temperature.SharedInput holding the input data of the run
+    @return: None, raises KeyError for missing settings and ValueError or ImportError for invalid settings
+    """
+    model = settings['model']
+    function = load_model(model)
+    logging.info(f'Calculating growth model with model "{model}"...')
+    MODELS[model][2](function, settings, output, resume, shared_input)
+
+
 def main():
     """
     Entrypoint of the command line interface for interacting with  cod-growth-models
@@ -49,70 +222,54 @@ def main():
     @return: exit code
     """
 
+    if sys.argv[1:2] == ['serve']:
+        # cod-growth-model serve [...]: long-lived growth query service (see server.py)
+        from growth_model.server import main as serve
+
+        return serve(sys.argv[2:])
+    if sys.argv[1:2] == ['prepare']:
+        # cod-growth-model prepare CONFIG [...]: memory-mapped cache of the input of multi_dim runs (see prepared.py)
+        from growth_model.prepared import main as prepare
+
+        return prepare(sys.argv[2:])
+
     # Initialize logger
     logger_config = pathlib.Path.cwd().joinpath('logger.conf')
     init_logger(logger_config)
 
     # Parse cli arguments
     args = _parse_args()
-    settings = load_config(args.config_file)
+    if args.metrics or args.profile:
+        metrics.enable(profile=args.profile is not None)
+    with metrics.span('config_load'):
+        settings = load_config(args.config_file)
+    if args.backend:
+        settings['kernel_backend'] = args.backend
 
-    model = settings['model']
+    model = settings.get('model')
     output = pathlib.Path(args.output)
 
-    models_output_dir = ['multi_dim']
-    models_output_file = ['base', 'one_dim', 'one_temp', 'one_weight']
-
-    if model in models_output_dir and output.is_file():
-        sys.exit(f'Error: Output must be directory for models {models_output_dir}')
-    if model in models_output_file and output.is_dir():
-        sys.exit(f'Error: Output must be a file for models {models_output_file}')
-
-    if model == 'base':
-        logging.info('Calculating growth model with model "base"...')
-        try:
-            base(temp=settings['temp'], weight=settings['weight'], output=output)
-        except KeyError:
-            sys.exit(f'Error: Model-Settings for model "base" in config-file {args.config_file} are incomplete!')
-
-    elif model == 'one_dim':
-        logging.info('Calculating growth model with model "one_dim"...')
-        try:
-            one_dim(min_temp=settings['min_temp'], max_temp=settings['max_temp'], temp_step=settings['temp_step'],
-                    weight=settings['weight'], max_age=settings['max_age'], output=output)
-        except KeyError:
-            sys.exit(f'Error: Model-Settings for model "one_dim" in config-file {args.config_file}'
-                     f' are incomplete!')
-
-    elif model == 'one_temp':
-        logging.info('Calculating growth model with model "one_temp"...')
-        try:
-            one_temp(temp=settings['temp'], weight=settings['weight'],
-                     output=output)
-        except KeyError:
-            sys.exit(f'Error: Model-Settings for model "one_temp" in config-file {args.config_file} are incomplete!')
-
-    elif model == 'one_weight':
-        logging.info('Calculating growth model with model "one_weight"..')
-        try:
-            one_weight(temp=settings['temp'], weight=settings['weight'],
-                       output=output)
-        except KeyError:
-            sys.exit(f'Error: Model-Settings for model "one_weight" in config-file {args.config_file} are incomplete!')
-
-    elif model == 'multi_dim':
-        logging.info('Calculating growth model with model "multi_dim"...')
-        try:
-            multi_dim(lat=settings['lat'], lon=settings['lon'], depth=settings['depth'],
-                      max_age=settings['max_age'], first_year=settings['first_year'],
-                      final_year=settings['final_year'], exp_name=settings['exp_name'],
-                      region=settings['region'], input_data=settings['input_data'], output=output)
-        except KeyError:
-            sys.exit('Error: model "multi_dim" expects parameter-settings!')
-    else:
+    if model not in MODELS_OUTPUT_DIR + MODELS_OUTPUT_FILE:
         logging.critical(f'Error: model "{model}" not available')
         sys.exit(1)
+    if model in MODELS_OUTPUT_DIR and output.is_file():
+        sys.exit(f'Error: Output must be directory for models {list(MODELS_OUTPUT_DIR)}')
+    if model in MODELS_OUTPUT_FILE and output.is_dir():
+        sys.exit(f'Error: Output must be a file for models {list(MODELS_OUTPUT_FILE)}')
+
+    try:
+        run_model(settings, output, resume=args.resume)
+    except KeyError:
+        if model == 'multi_dim':
+            sys.exit('Error: model "multi_dim" expects parameter-settings!')
+        sys.exit(f'Error: Model-Settings for model "{model}" in config-file {args.config_file} are incomplete!')
+    except (ValueError, ImportError) as error:
+        sys.exit(f'Error: {error}')
 
+    if metrics.enabled():
+        metrics.write_report(pathlib.Path(args.metrics) if args.metrics else None,
+                             pathlib.Path(args.profile) if args.profile else None,
+                             model=model, config_file=args.config_file)
     sys.exit(0)
 
 
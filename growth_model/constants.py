@@ -16,3 +16,7 @@ THETA_H = 25234     # Arrhenius temperature (K) for inhibited reaction kinetics
 T_R = 283           # Reference optimum temperature (K) = 9.85°C
 T_H = 286           # Temperature for inhibitive processes (K) = 12.85°C
 C_AVG = 0.291       # Independent of temperature and weight constant (% d^-1)
+
+# Coefficients that can be varied by parameter sets (see uncertainty.sample_parameters())
+PARAMETERS = {'A_R': A_R, 'B_R': B_R, 'THETA_A': THETA_A, 'THETA_B': THETA_B, 'THETA_H': THETA_H,
+              'T_R': T_R, 'T_H': T_H, 'C_AVG': C_AVG}
@@ -6,20 +6,24 @@ SPDX-License-Identifier: MIT
 In this file functions for coefficients a and b are defined (Eq. 2 and 3 in Butzin and Poertner, 2016)
 """
 
-from growth_model.constants import A_R, THETA_A, T_R, THETA_H, T_H, B_R, THETA_B, T0
+from growth_model.constants import PARAMETERS, T0
 
-from numpy import exp
+from numpy import exp, ndim, reshape
 
 
-def equation2(input_temp):
+def equation2(input_temp, parameters=None):
     """
     This function calculates parameter "a" (Eg. 2 in Butzin and Poertner, 2016)
     This is a nonlinear master reaction model of poikilotherm development 
     with growth inhibition at higher temperatures.
 
     @param input_temp: input temperature for growth rate calculation (°C)
-    @return: a
+    @param parameters: parameter sets, dict of arrays of draws of the coefficients A_R, THETA_A, T_R, THETA_H
+                       and T_H (see uncertainty.sample_parameters()), coefficients that are not given keep the
+                       values of constants.py
+    @return: a, with a leading draw axis if any of its coefficients is drawn
     """
+    A_R, THETA_A, T_R, THETA_H, T_H = _coefficients(parameters, input_temp, 'A_R', 'THETA_A', 'T_R', 'THETA_H', 'T_H')
     temperature_kelvin = input_temp + T0
     # Calculate a
     a_numerator = A_R * exp(THETA_A / T_R - THETA_A / temperature_kelvin)
@@ -28,15 +32,33 @@ def equation2(input_temp):
     return a
 
 
-def equation3(input_temp):
+def equation3(input_temp, parameters=None):
     """
     This function calculates an allometric scaling exponent "b" 
     (Arrhenius equation, Eg. 3 in Butzin and Poertner, 2016)
 
     @param input_temp: input temperature for growth rate calculation (°C)
-    @return: b
+    @param parameters: parameter sets, dict of arrays of draws of the coefficients B_R, THETA_B and T_R
+                       (see equation2())
+    @return: b, with a leading draw axis if any of its coefficients is drawn
     """
+    B_R, THETA_B, T_R = _coefficients(parameters, input_temp, 'B_R', 'THETA_B', 'T_R')
     temperature_kelvin = input_temp + T0
     # Calculate b
     b = B_R * exp(THETA_B / T_R - THETA_B / temperature_kelvin)
     return b
+
+
+def _coefficients(parameters, input_temp, *names):
+    """
+    Values of coefficients, drawn coefficients broadcast over a leading draw axis in front of input_temp
+
+    @param parameters: dict of arrays of draws or None
+    @param input_temp: input temperature
+    @param names: names of the coefficients (see constants.PARAMETERS)
+    @return: list of values
+    """
+    if parameters is None:
+        return [PARAMETERS[name] for name in names]
+    shape = (-1,) + (1,) * ndim(input_temp)
+    return [reshape(parameters[name], shape) if name in parameters else PARAMETERS[name] for name in names]
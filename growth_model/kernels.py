@@ -0,0 +1,115 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides the vectorized integration kernel of the multi_dim model
+"""
+
+import numpy as np
+
+from growth_model import metrics
+from growth_model.constants import C_AVG
+from growth_model.equations import equation2, equation3
+
+
+def allocate_workspace(shape, dtype='f'):
+    """
+    Allocate the scratch buffers used by grow_day()
+
+    @param shape: shape of the weight field
+    @param dtype: data type of the weight field
+    @return: tuple of (step buffer, mask buffer)
+    """
+    return np.empty(shape, dtype=dtype), np.empty(shape, dtype=bool)
+
+
+def grow_day(weight, growth_rates, a, b, dt=1, workspace=None, c_avg=C_AVG):
+    """
+    Advance the weight field by one time step (in place)
+
+    Uses the same operation order as the original per-depth loop, so results are bit-identical.
+
+    @param weight: weight field (g), updated in place
+    @param growth_rates: relative growth rate field, overwritten with the rates of this step
+    @param a: parameter "a" (broadcastable to weight)
+    @param b: negative allometric exponent "-b" (broadcastable to weight)
+    @param dt: time step (days)
+    @param workspace: scratch buffers from allocate_workspace()
+    @param c_avg: C_AVG (broadcastable to weight, e.g. draws of shape (draw, 1) of parameter sets)
+    @return: None
+    """
+    step, negative = workspace if workspace is not None else allocate_workspace(weight.shape, weight.dtype)
+    # growth_rate = 0.01 * (a * weight ** b - C_AVG), no growth below zero
+    np.power(weight, b, out=growth_rates)
+    growth_rates *= a
+    growth_rates -= c_avg
+    growth_rates *= 0.01
+    np.less(growth_rates, 0, out=negative)
+    np.copyto(growth_rates, 0, where=negative)
+    # weight = weight * (1 + dt * growth_rate)
+    np.multiply(growth_rates, dt, out=step)
+    step += 1.
+    weight *= step
+
+
+def integrate_year(temp_3d, weight, growth_rates, a, b, dt=1, days_per_month=30, workspace=None,
+                   parameters=None, propagators=None, c_avg=C_AVG, durations=None, year_end=True, backend=None):
+    """
+    Integrate daily growth over one year of temperature fields (in place)
+
+    Parameters a and b only depend on temperature, so they are evaluated once per time step of the input
+    for the whole (depth, cell) field; all depth levels are stepped together. A time step of the input
+    is integrated in steps of dt and a shorter last step if its duration is not a multiple of dt.
+    With propagators, each month is advanced by one table lookup. The last day of the year is still
+    a daily step, so the returned growth rates, a and b belong to the last day as with daily steps.
+    Time steps of another duration than the propagators are integrated in steps of dt.
+    A year may be integrated in chunks of time steps by consecutive calls (see year_end).
+
+    @param temp_3d: temperature (step, depth, cell) in °C, NaN on land points
+    @param weight: weight field (g), updated in place
+    @param growth_rates: relative growth rate field, holds the rates of the last day on return
+    @param a: buffer for parameter "a", holds the values of the last time step on return
+    @param b: buffer for exponent "-b", holds the values of the last time step on return
+    @param dt: time step (days)
+    @param days_per_month: number of daily steps per monthly temperature field (if durations is None)
+    @param workspace: scratch buffers from allocate_workspace()
+    @param parameters: functions (a(temp), b(temp)), by default (equation2, equation3),
+                       see lookup.parameter_functions()
+    @param propagators: propagators (whole month, month without its last day),
+                        see propagator.monthly_propagators(), None integrates daily steps
+    @param c_avg: C_AVG of grow_day(), with parameter sets (see uncertainty.py) the fields have a leading
+                  draw axis and parameters evaluate every draw in one pass
+    @param durations: duration (days) of every temperature field (see time_axis.py),
+                      None for days_per_month steps of dt each
+    @param year_end: the last temperature field ends the year (False for all but the last chunk of a year)
+    @param backend: compute backend of the daily steps (see backends.get_backend()), None for grow_day()
+    @return: None
+    """
+    if durations is None:
+        durations = np.full(len(temp_3d), days_per_month * dt)
+    if year_end:
+        metrics.count('cells_integrated', weight.size)
+    metrics.count('cell_days', round(weight.size * float(np.sum(durations))))
+    with metrics.span('kernel'):
+        if workspace is None:
+            workspace = allocate_workspace(weight.shape, weight.dtype)
+        a_function, b_function = parameters if parameters is not None else (equation2, equation3)
+        grow = backend.grow_day if backend is not None else grow_day
+        last_step = len(temp_3d) - 1 if year_end else -1
+        for number, (step_temp, duration) in enumerate(zip(temp_3d, durations)):
+            monthly = propagators is not None and duration == propagators[0].days * propagators[0].dt
+            if monthly and number != last_step:
+                propagators[0].advance(weight, step_temp)
+                continue
+            a[...] = a_function(step_temp)
+            b[...] = b_function(step_temp) * (-1.)
+            if monthly:
+                propagators[1].advance(weight, step_temp)
+                grow(weight, growth_rates, a, b, dt, workspace, c_avg)
+                continue
+            steps, remainder = divmod(duration, dt)
+            for _ in range(int(steps)):
+                grow(weight, growth_rates, a, b, dt, workspace, c_avg)
+            if remainder > 1e-6 * dt:
+                grow(weight, growth_rates, a, b, remainder, workspace, c_avg)
@@ -0,0 +1,130 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides lookup tables of the parameters a and b (Eq. 2 and 3 in Butzin and Poertner, 2016):
+- tabulation of equation2() and equation3() on a regular temperature grid
+- evaluation by vectorized linear interpolation with a known maximum error
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from growth_model.equations import equation2, equation3
+
+# Parameter engines of the models: exact formulas or lookup tables
+PARAMETER_ENGINES = ('exact', 'lut')
+
+# Default temperature grid (°C) of the lookup tables
+LUT_STEP = 0.01
+LUT_MIN_TEMP = -5.
+LUT_MAX_TEMP = 40.
+
+
+class ParameterTable:
+    """
+    Lookup tables of the parameters a and b on a regular temperature grid
+
+    Values between grid points are linearly interpolated. For a function f the error of linear
+    interpolation on an interval of width h is at most h^2 / 8 * max|f''|, the bound is evaluated
+    per interval from the second differences of the table and stored as relative error in
+    max_error. With the default step of 0.01 K it is below 1e-6 for a and b, i.e. smaller than the
+    rounding error of the float32 fields of the multi_dim model.
+    Temperatures outside of the table are evaluated with the exact formulas, NaN stays NaN.
+    """
+
+    def __init__(self, step: float = LUT_STEP, min_temp: float = LUT_MIN_TEMP, max_temp: float = LUT_MAX_TEMP):
+        """
+        @param step: temperature step of the table (K)
+        @param min_temp: lowest temperature of the table (°C)
+        @param max_temp: highest temperature of the table (°C)
+        """
+        if step <= 0 or max_temp - min_temp < 2 * step:
+            raise ValueError(f'Invalid lookup table: step {step} K for {min_temp} - {max_temp} °C')
+        self.step = float(step)
+        self.min_temp = float(min_temp)
+        self.max_temp = float(max_temp)
+        self.temp = np.linspace(self.min_temp, self.max_temp, int(round((max_temp - min_temp) / step)) + 1)
+        self.a_values = equation2(self.temp)
+        self.b_values = equation3(self.temp)
+        self.max_error = {'a': _error_bound(self.a_values), 'b': _error_bound(self.b_values)}
+
+    def a(self, input_temp):
+        """
+        Interpolate parameter "a" (see equations.equation2())
+
+        @param input_temp: input temperature (°C), scalar or numpy array
+        @return: a (float64)
+        """
+        return self._interpolate(input_temp, self.a_values, equation2)
+
+    def b(self, input_temp):
+        """
+        Interpolate the allometric exponent "b" (see equations.equation3())
+
+        @param input_temp: input temperature (°C), scalar or numpy array
+        @return: b (float64)
+        """
+        return self._interpolate(input_temp, self.b_values, equation3)
+
+    def _interpolate(self, input_temp, values, equation):
+        input_temp = np.asarray(input_temp, dtype='d')
+        result = np.interp(input_temp, self.temp, values)
+        outside = (input_temp < self.min_temp) | (input_temp > self.max_temp)
+        if outside.any():
+            if result.ndim == 0:
+                return equation(input_temp)
+            result[outside] = equation(input_temp[outside])
+        return result
+
+    def __repr__(self):
+        return (f'ParameterTable({len(self.temp)} points, {self.min_temp} - {self.max_temp} °C, '
+                f'step {self.step} K, max. relative error a {self.max_error["a"]:.1e}, b {self.max_error["b"]:.1e})')
+
+
+def _error_bound(values):
+    """
+    Bound of the relative error of linear interpolation in a table of a smooth positive function
+
+    @param values: function values on a regular grid
+    @return: maximum relative error
+    """
+    # h^2 * f'' is approximated by the second differences, take the larger of both ends of an interval
+    second = np.abs(np.diff(values, n=2))
+    second = np.maximum(np.r_[second[0], second], np.r_[second, second[-1]])
+    return float(np.max(second / 8 / np.minimum(values[:-1], values[1:])))
+
+
+@lru_cache(maxsize=8)
+def parameter_table(step: float = LUT_STEP, min_temp: float = LUT_MIN_TEMP, max_temp: float = LUT_MAX_TEMP):
+    """
+    Lookup tables of the parameters a and b, built once per process for every set of arguments
+
+    @param step: temperature step of the table (K)
+    @param min_temp: lowest temperature of the table (°C)
+    @param max_temp: highest temperature of the table (°C)
+    @return: ParameterTable
+    """
+    return ParameterTable(step, min_temp, max_temp)
+
+
+def parameter_functions(engine: str = 'exact', step: float = LUT_STEP, backend=None):
+    """
+    Functions evaluating the parameters a and b
+
+    @param engine: "exact" evaluates equation2() and equation3(), "lut" interpolates in lookup tables
+    @param step: temperature step of the lookup tables (K)
+    @param backend: compute backend evaluating the equations of engine "exact" (see backends.get_backend()),
+                    None for equation2() and equation3()
+    @return: tuple of functions (a(temp), b(temp))
+    """
+    if engine == 'exact':
+        if backend is not None:
+            return backend.a, backend.b
+        return equation2, equation3
+    if engine == 'lut':
+        table = parameter_table(float(step))
+        return table.a, table.b
+    raise ValueError(f'Unknown parameter_engine "{engine}", expected one of {PARAMETER_ENGINES}')
@@ -0,0 +1,177 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides an index of the input temperature files of a folder:
+- metadata of every file (years and durations of the time steps, calendar, coordinates, content hash) is read once
+  and cached in a manifest file next to the data
+- selecting the files of a range of years without opening the other files
+"""
+
+import os
+import json
+import pathlib
+import hashlib
+import logging
+
+import netCDF4
+
+from growth_model.time_axis import decode, year_days
+
+# Name of the manifest file in the input folder
+MANIFEST_NAME = '.growth_model_manifest.json'
+MANIFEST_VERSION = 2
+
+
+def load_manifest(input_data: str):
+    """
+    Index the netCDF files of a folder
+
+    Files are only scanned if they are new or their size or modification time changed since the
+    manifest was written. The manifest is kept in memory if the folder is not writable.
+
+    @param input_data: input folder (reads *.nc - files)
+    @return: dict of file entries by file name, each with keys size, mtime, hash, variables, units,
+             calendar, time_steps, years (year of every time step), durations (days of every time step),
+             depth_coord, latitude, longitude
+    """
+    folder = pathlib.Path(input_data)
+    manifest_file = folder.joinpath(MANIFEST_NAME)
+    cached = {}
+    if manifest_file.exists():
+        try:
+            with open(manifest_file) as f:
+                content = json.load(f)
+            if content.get('version') == MANIFEST_VERSION:
+                cached = content['files']
+        except (OSError, ValueError, KeyError) as error:
+            logging.warning(f'Ignoring unreadable input manifest {manifest_file}: {error}')
+
+    files = {}
+    scanned = 0
+    for path in sorted(folder.glob('*.nc')):
+        stat = path.stat()
+        entry = cached.get(path.name)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+            entry = _scan(path, stat)
+            scanned += 1
+        files[path.name] = entry
+    logging.debug(f'Input manifest: {len(files)} files, {scanned} scanned')
+
+    if scanned or len(files) != len(cached):
+        try:
+            temporary = manifest_file.with_name(f'{MANIFEST_NAME}.{os.getpid()}')
+            with open(temporary, 'w') as f:
+                json.dump({'version': MANIFEST_VERSION, 'files': files}, f)
+            os.replace(temporary, manifest_file)
+        except OSError as error:
+            logging.warning(f'Could not write input manifest {manifest_file}: {error}')
+    return files
+
+
+def select_files(input_data: str, first_year: int, final_year: int, variable: str = 'thetao'):
+    """
+    Files of a folder holding a variable for the years first_year..final_year, ordered by time
+
+    The time steps of every year must cover the year of the calendar (daily, pentad, monthly or any other
+    resolution) without gaps or overlap between files.
+
+    @param input_data: input folder (reads *.nc - files)
+    @param first_year: first year
+    @param final_year: last year
+    @param variable: variable name
+    @return: tuple of (list of file paths, list of years of all time steps of these files,
+             list of durations (days) of all time steps of these files, calendar)
+    """
+    manifest = load_manifest(input_data)
+    selected = [(entry['years'][0], name, entry) for name, entry in manifest.items()
+                if variable in entry['variables'] and entry['years']
+                and entry['years'][0] <= final_year and entry['years'][-1] >= first_year]
+    selected.sort()
+
+    years = [year for _, _, entry in selected for year in entry['years']]
+    durations = [duration for _, _, entry in selected for duration in entry['durations']]
+    missing = sorted(set(range(first_year, final_year + 1)) - set(years))
+    if missing:
+        raise ValueError(f'No "{variable}" data for the years {missing} in input folder {input_data}')
+    calendars = sorted({_calendar(entry['calendar']) for _, _, entry in selected})
+    if len(calendars) > 1:
+        raise ValueError(f'Input files in {input_data} have different calendars {calendars}')
+    for year in range(first_year, final_year + 1):
+        steps = [duration for step_year, duration in zip(years, durations) if step_year == year]
+        # Steps reaching into the neighbouring year (e.g. pentads) belong to the year of their time value
+        if abs(sum(steps) - year_days(year, calendars[0])) >= max(steps):
+            raise ValueError(f'The time steps of {year} in {input_data} cover {sum(steps):g} of '
+                             f'{year_days(year, calendars[0]):g} days, the input files must cover every year '
+                             f'without gaps or overlap between files')
+    for name in ('depth_coord', 'latitude', 'longitude'):
+        if any(entry[name] != selected[0][2][name] for _, _, entry in selected):
+            raise ValueError(f'Input files in {input_data} have different {name} coordinates')
+    return [pathlib.Path(input_data).joinpath(name) for _, name, _ in selected], years, durations, calendars[0]
+
+
+def year_hashes(input_data: str, first_year: int, final_year: int, variable: str = 'thetao'):
+    """
+    Content hash of the input of every year
+
+    @param input_data: input folder (reads *.nc - files)
+    @param first_year: first year
+    @param final_year: last year
+    @param variable: variable name
+    @return: dict of the hash of the file holding a year by year
+    """
+    manifest = load_manifest(input_data)
+    hashes = {}
+    for entry in manifest.values():
+        if variable in entry['variables']:
+            for year in set(entry['years']):
+                if first_year <= year <= final_year:
+                    hashes[year] = entry['hash']
+    return hashes
+
+
+def _scan(path: pathlib.Path, stat):
+    """
+    Read the metadata of one file and hash its content
+
+    @param path: netCDF file
+    @param stat: os.stat_result of the file
+    @return: dict (see load_manifest())
+    """
+    logging.info(f'Indexing input file {path}')
+    with netCDF4.Dataset(path) as ds:
+        time = ds['time']
+        units = getattr(time, 'units', '')
+        calendar = getattr(time, 'calendar', 'standard')
+        bounds = getattr(time, 'bounds', None)
+        years, durations = decode(time[:], units, calendar, ds[bounds][:] if bounds in ds.variables else None)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': _hash(path),
+                 'variables': [name for name in ds.variables if name not in ds.dimensions],
+                 'units': units, 'calendar': calendar, 'time_steps': len(years), 'years': years,
+                 'durations': durations}
+        for name in ('depth_coord', 'latitude', 'longitude'):
+            entry[name] = ds[name][:].tolist() if name in ds.variables else None
+    return entry
+
+
+def _calendar(calendar: str):
+    """
+    @return: CF calendar name, aliases of the standard calendar are replaced by "standard"
+    """
+    calendar = calendar.lower()
+    return 'standard' if calendar == 'gregorian' else calendar
+
+
+def _hash(path: pathlib.Path):
+    """
+    SHA-256 hash of the file content
+
+    @param path: file
+    @return: hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 ** 2), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,230 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides the instrumentation of the models:
+- named spans (number of calls and seconds), e.g. config_load, input_open, temperature_select,
+  kernel, save_netcdf
+- counters, e.g. cells integrated, bytes read and bytes written
+- a JSON metrics report and an optional cProfile profile of the kernel spans
+
+Instrumentation is disabled by default, a disabled span or counter costs one function call.
+"""
+
+import time
+import json
+import pstats
+import cProfile
+import logging
+import pathlib
+import threading
+
+from contextlib import nullcontext
+
+# Spans profiled by the optional profiler
+PROFILED_SPANS = ('kernel',)
+
+_NULL_SPAN = nullcontext()
+_recorder = None
+
+
+class Recorder:
+    """
+    Accumulated spans and counters of a run, shared by all threads of a process
+    """
+
+    def __init__(self, profile: bool = False):
+        """
+        @param profile: profile the spans PROFILED_SPANS with cProfile
+        """
+        self.begin_time = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, seconds: float, calls: int = 1):
+        with self._lock:
+            span = self.spans.setdefault(name, {'calls': 0, 'seconds': 0.})
+            span['calls'] += calls
+            span['seconds'] += seconds
+
+    def add_count(self, name: str, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, snapshot: dict):
+        """
+        Add the spans and counters of another process (see snapshot())
+
+        @param snapshot: dict with spans and counters
+        @return: None
+        """
+        for name, span in snapshot['spans'].items():
+            self.add_span(name, span['seconds'], span['calls'])
+        for name, value in snapshot['counters'].items():
+            self.add_count(name, value)
+
+    def snapshot(self):
+        """
+        @return: dict with copies of the spans and counters
+        """
+        with self._lock:
+            return {'spans': {name: dict(span) for name, span in self.spans.items()},
+                    'counters': dict(self.counters)}
+
+
+class _Span:
+    """
+    Context manager timing one call of a span
+    """
+
+    __slots__ = ('recorder', 'name', 'begin', 'profiled')
+
+    def __init__(self, recorder: Recorder, name: str):
+        self.recorder = recorder
+        self.name = name
+        # The profiler only covers the thread that runs the model (the main thread)
+        self.profiled = (recorder.profiler is not None and name in PROFILED_SPANS
+                         and threading.current_thread() is threading.main_thread())
+
+    def __enter__(self):
+        if self.profiled:
+            self.recorder.profiler.enable()
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.begin
+        if self.profiled:
+            self.recorder.profiler.disable()
+        self.recorder.add_span(self.name, seconds)
+        return False
+
+
+def enable(profile: bool = False):
+    """
+    Start recording spans and counters in this process (resets earlier records)
+
+    @param profile: profile the spans PROFILED_SPANS with cProfile
+    @return: Recorder
+    """
+    global _recorder
+    _recorder = Recorder(profile)
+    return _recorder
+
+
+def disable():
+    """
+    Stop recording
+
+    @return: None
+    """
+    global _recorder
+    _recorder = None
+
+
+def enabled():
+    """
+    @return: True if spans and counters are recorded
+    """
+    return _recorder is not None
+
+
+def span(name: str):
+    """
+    Time a block of code, e.g. "with metrics.span('kernel'): ..."
+
+    @param name: span name
+    @return: context manager
+    """
+    if _recorder is None:
+        return _NULL_SPAN
+    return _Span(_recorder, name)
+
+
+def count(name: str, value=1):
+    """
+    Increase a counter
+
+    @param name: counter name
+    @param value: increment
+    @return: None
+    """
+    if _recorder is not None:
+        _recorder.add_count(name, value)
+
+
+def snapshot():
+    """
+    Spans and counters recorded in this process, e.g. to be merged into the report of the main process
+
+    @return: dict with spans and counters or None if recording is disabled
+    """
+    return _recorder.snapshot() if _recorder is not None else None
+
+
+def merge(snapshot_of_process: dict):
+    """
+    Add spans and counters of another process (see snapshot())
+
+    @param snapshot_of_process: dict with spans and counters or None
+    @return: None
+    """
+    if _recorder is not None and snapshot_of_process is not None:
+        _recorder.merge(snapshot_of_process)
+
+
+def report(profile_entries: int = 20, **info):
+    """
+    Metrics report of the run
+
+    @param profile_entries: number of functions listed from the profile (by cumulative time)
+    @param info: further JSON serializable entries (e.g. model name)
+    @return: dict with info, wall time, spans, counters and the top profile entries
+    """
+    if _recorder is None:
+        raise RuntimeError('Metrics are not enabled')
+    result = dict(info, wall_seconds=time.perf_counter() - _recorder.begin_time)
+    result.update(_recorder.snapshot())
+    if _recorder.profiler is not None:
+        result['profile'] = _profile_entries(_recorder.profiler, profile_entries)
+    return result
+
+
+def write_report(filename: pathlib.Path, profile_file: pathlib.Path = None, **info):
+    """
+    Save the metrics report as JSON and the profile of the kernel spans
+
+    @param filename: report file (.json), None only saves the profile
+    @param profile_file: profile file readable by pstats (e.g. .prof), None skips it
+    @param info: further JSON serializable entries of the report
+    @return: None
+    """
+    if filename is not None:
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        with open(filename, 'w') as f:
+            json.dump(report(**info), f, indent=1)
+        logging.info(f'Saved metrics to {filename.resolve()}')
+    if profile_file is not None and _recorder is not None and _recorder.profiler is not None:
+        profile_file.parent.mkdir(parents=True, exist_ok=True)
+        _recorder.profiler.dump_stats(profile_file)
+        logging.info(f'Saved kernel profile to {profile_file.resolve()}')
+
+
+def _profile_entries(profiler: cProfile.Profile, entries: int):
+    """
+    Functions with the highest cumulative time of a profile
+
+    @return: list of dicts with function, calls, seconds (own time) and cumulative_seconds
+    """
+    stats = pstats.Stats(profiler)
+    if not stats.stats:
+        return []
+    rows = []
+    for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({'function': f'{pathlib.Path(filename).name}:{line}({function})', 'calls': calls,
+                     'seconds': own, 'cumulative_seconds': cumulative})
+    rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+    return rows[:entries]
@@ -6,14 +6,13 @@ SPDX-License-Identifier: MIT
 This file provides the base model setup
 """
 
+import csv
 import time
 import pathlib
 import logging
 
-import pandas as pd
-
-from growth_model.equations import equation2, equation3
-from growth_model import constants
+from growth_model import metrics
+from growth_model.models.sweep import sweep_columns
 
 
 def base(temp: float, weight: float, output: pathlib.Path, dt=1):
@@ -39,17 +38,12 @@ def base(temp: float, weight: float, output: pathlib.Path, dt=1):
     # Record starting time for calculations
     begin_time = time.time()
 
-    # Calculate a (Eq.2 in Butzin and Poertner, 2016)
-    a = equation2(temp)
-
-    # Calculate b (Eg.3 in Butzin and Poertner, 2016)
-    b = equation3(temp) * (-1.0)
-
-    # Calculate relative growth rate
-    growth_rate = 0.01 * (a * weight ** b - constants.C_AVG)
-
-    # Calculate weight (g)
-    final_weight = weight * (1.0 + dt * growth_rate)
+    # Calculate a, b (Eq. 2 and 3 in Butzin and Poertner, 2016), relative growth rate and weight (g)
+    result = sweep_columns(temp, weight, dt)
+    a = result['a'][0]
+    b = result['b'][0]
+    growth_rate = result['growth_rate'][0]
+    final_weight = result['final_weight'][0]
 
     # print model results
     logging.info(f'Relative growth rate: {growth_rate.round(7)} per day')  # round the value to the first 5 decimals
@@ -62,17 +56,18 @@ def base(temp: float, weight: float, output: pathlib.Path, dt=1):
     calc_time = finish_time - begin_time
     logging.info(f'Calculated over time: {round(calc_time, 3)} seconds')
     
-    # Create an empty data frame to save the output values
-    df = pd.DataFrame(index=['output'])
-    df['init_weight'] = weight
-    df['input_temp'] = temp
-    df['a'] = a
-    df['b'] = b
-    df['growth_rate'] = growth_rate.round(3)
-    df['final_weight'] = final_weight
+    # One row of output values, written without pandas (a single-point run is dominated by imports)
+    row = {'init_weight': weight, 'input_temp': temp, 'a': a, 'b': b, 'growth_rate': growth_rate.round(3),
+           'final_weight': final_weight}
 
     if not output.parent.exists():
         output.parent.mkdir(parents=True)
-    # Save the data frame to csv
-    df.to_csv(output)
+    # Save the row to csv (in the layout of pandas.DataFrame.to_csv() with index "output")
+    with metrics.span('write_csv'):
+        with open(output, 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow([''] + list(row))
+            writer.writerow(['output'] + [value if isinstance(value, int) else repr(float(value))
+                                          for value in row.values()])
+    metrics.count('bytes_written', output.stat().st_size)
     logging.info(f'Saved results to {output.resolve()}')
@@ -0,0 +1,101 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides the monte_carlo model setup: weight-at-age under constant temperatures for many
+parameter sets of the growth model coefficients, reduced to means and quantiles over the parameter sets
+"""
+
+import time
+import pathlib
+import logging
+
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from growth_model import metrics
+from growth_model.constants import C_AVG
+from growth_model.equations import equation2, equation3
+from growth_model.kernels import allocate_workspace, integrate_year
+from growth_model.models.sweep import sweep_values
+from growth_model.uncertainty import StreamingStats, sample_parameters
+
+# Fields of the monte_carlo result, one column per field and statistic (e.g. weight_mean, weight_q50)
+MONTE_CARLO_FIELDS = ('weight', 'growth_rate')
+
+
+def monte_carlo(temp, weight: float, max_age: int, draws: int, distributions: dict, output: pathlib.Path,
+                batch_size: int = 1000, quantiles=(0.05, 0.5, 0.95), seed=None):
+    """
+    Integrate growth over max_age years of constant monthly temperatures for parameter sets drawn from
+    distributions of the coefficients
+
+    All parameter sets of a batch and all temperatures are stepped together as one field with a leading
+    draw axis. The results of a batch are added to running statistics, so memory depends on batch_size
+    but not on the number of draws.
+
+    @param temp: temperatures (°C), see sweep.sweep_values()
+    @param weight: initial weight of individual (g)
+    @param max_age: maximum age of individual (years)
+    @param draws: number of parameter sets
+    @param distributions: distribution by coefficient name, see uncertainty.sample_parameters()
+    @param output: output file (CSV), None skips writing
+    @param batch_size: number of parameter sets integrated at once
+    @param quantiles: probabilities of the estimated quantiles
+    @param seed: seed of the random generator, None draws different parameter sets every run
+    @return: pandas.DataFrame with one row per (temperature, age) and columns temp, age, draws and
+             <field>_<statistic> for the fields MONTE_CARLO_FIELDS and statistics mean, std, min, max
+             and the quantiles (e.g. weight_q50)
+    """
+    temps = sweep_values(temp).astype('d')
+    parameters = sample_parameters(distributions, draws, seed)
+    logging.info(f'Monte Carlo over {draws} parameter sets of {sorted(parameters) or "no coefficients"}, '
+                 f'{len(temps)} temperatures, {max_age} years')
+
+    begin_time = time.time()
+    # Twelve months of constant temperature, all temperatures are cells of one field
+    temp_months = np.broadcast_to(temps, (12, len(temps)))
+    stats = {field: StreamingStats((max_age, len(temps)), quantiles) for field in MONTE_CARLO_FIELDS}
+    batch_size = max(1, batch_size)
+    for start in range(0, draws, batch_size):
+        batch = {name: values[start:start + batch_size] for name, values in parameters.items()}
+        size = min(batch_size, draws - start)
+        field_shape = (size, len(temps))
+        weight_field = np.full(field_shape, float(weight))
+        growth_rates = np.zeros(field_shape)
+        a = np.zeros(field_shape)
+        b = np.zeros(field_shape)
+        workspace = allocate_workspace(field_shape, weight_field.dtype)
+        functions = (partial(equation2, parameters=batch), partial(equation3, parameters=batch))
+        c_avg = batch['C_AVG'][:, np.newaxis] if 'C_AVG' in batch else C_AVG
+
+        results = {field: np.empty((size, max_age, len(temps))) for field in MONTE_CARLO_FIELDS}
+        for age in range(max_age):
+            integrate_year(temp_months, weight_field, growth_rates, a, b, workspace=workspace,
+                           parameters=functions, c_avg=c_avg)
+            results['weight'][:, age] = weight_field
+            results['growth_rate'][:, age] = growth_rates
+        for field in MONTE_CARLO_FIELDS:
+            stats[field].update(results[field])
+        logging.debug(f'Completed {stats["weight"].count} of {draws} parameter sets')
+
+    columns = {'temp': temps.repeat(max_age), 'age': np.tile(np.arange(1, max_age + 1), len(temps)),
+               'draws': draws}
+    for field in MONTE_CARLO_FIELDS:
+        for statistic, values in stats[field].result().items():
+            # (age, temp) -> rows ordered by temperature, ages vary fastest
+            columns[f'{field}_{statistic}'] = values.T.ravel()
+    df = pd.DataFrame(columns)
+    logging.info(f'Calculated {draws} parameter sets over time: {round(time.time() - begin_time, 3)} seconds')
+
+    if output is not None:
+        if not output.parent.exists():
+            output.parent.mkdir(parents=True)
+        with metrics.span('write_csv'):
+            df.to_csv(output, index=False)
+        metrics.count('bytes_written', output.stat().st_size)
+        logging.info(f'Saved results to {output.resolve()}')
+    return df
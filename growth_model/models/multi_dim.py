@@ -10,22 +10,55 @@ This file provides a multi_dim model setup
 import warnings
 import pathlib
 import logging
+import threading
+import multiprocessing
 
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import dask
+import dask.array
 import numpy as np
 import pandas as pd
 import xarray as xr
 
-from growth_model.constants import C_AVG
-from growth_model.equations import equation2, equation3
-from growth_model.utils import save_netcdf
+from growth_model import metrics
+from growth_model.backends import get_backend
+from growth_model.checkpoint import Checkpoint, fingerprint, load_record, save_record
+from growth_model.kernels import allocate_workspace, integrate_year
+from growth_model.lookup import LUT_STEP, parameter_functions
+from growth_model.manifest import select_files, year_hashes
+from growth_model.propagator import PROPAGATOR_LOG_WEIGHT_STEP, PROPAGATOR_TEMP_STEP, INTEGRATORS, monthly_propagators
+from growth_model.output import (OUTPUT_VARIABLES, SURFACE_VARIABLES, FileWriter, MemoryWriter, TeeWriter,
+                                  cohort_dataset, cohort_stored, create_writer, select_variables)
+from growth_model.prepared import PreparedInput, open_prepared
+from growth_model.reductions import STATE_NAME, parse_reductions
+from growth_model.temperature import STEP_DAYS, TemperatureCache, load_wet_points, open_input
+from growth_model.time_axis import index_step_days
+from growth_model.utils import netcdf_filename
 
+# Execution modes of the cohort (birth year) loop
+COHORT_MODES = ('sequential', 'stacked')
 
 def multi_dim(lat: list, lon: list, depth: list,
               max_age: int, first_year: int, final_year: int,
-              exp_name: str, region: str, input_data: str, output: pathlib.Path):
+              exp_name: str, region: str, input_data: str, output: pathlib.Path,
+              cohort_mode: str = 'sequential', temp_cache_mb: float = 512,
+              output_format: str = 'netcdf', output_complevel: int = 4, output_chunks: dict = None,
+              async_output: bool = False, output_queue_size: int = 4,
+              tile_memory_mb: float = 0, workers: int = 1, compact_wet_points: bool = True,
+              parameter_engine: str = 'exact', lut_step: float = LUT_STEP, integrator: str = 'daily',
+              propagator_temp_step: float = PROPAGATOR_TEMP_STEP,
+              propagator_log_weight_step: float = PROPAGATOR_LOG_WEIGHT_STEP,
+              checkpoint_years: int = 0, resume: bool = False, incremental: bool = False, shared_input=None,
+              time_chunk_steps: int = 0, prepared_input: bool = True, prepared_dir: str = None,
+              output_variables: list = None, reductions: list = None, kernel_backend: str = 'numpy'):
     """
     Compute weight-at-age of Atlantic cod using multidimensional ocean temperature data.
 
+    Growth is integrated along the time axis of the input files in their calendar (daily, pentad, monthly
+    or any other time step, standard, noleap, 360_day, ...), every time step is weighted by its duration.
+
     @param lat: latitude (as a list of floating numbers)
     @param lon: longitude (as a list of floating numbers)
     @param depth: depth levels (as a list of floating numbers)
@@ -36,11 +69,593 @@ def multi_dim(lat: list, lon: list, depth: list,
     @param region: region name (e.g. Celtic Sea)
     @param input_data: input folder (reads *.nc - files)
     @param output: ouput folder 
+    @param cohort_mode: "sequential" integrates one cohort (birth year) after another,
+                        "stacked" walks each calendar year once and advances all living cohorts together
+    @param temp_cache_mb: memory cap (MB) of the cache of yearly temperature fields, 0 disables caching
+    @param output_format: "netcdf" writes one file per variable, year and age,
+                          "store" appends all variables to one file "<exp_name>_<region>.nc" per run
+    @param output_complevel: compression level of the output store (0 - 9)
+    @param output_chunks: chunk sizes of the output store by dimension name
+                          (cohort, age, depth_coord, latitude, longitude)
+    @param async_output: write output in a background thread while the next year is integrated
+    @param output_queue_size: maximum number of cohort-years waiting to be written in the background
+    @param tile_memory_mb: memory budget (MB) per worker, splits the (lat, lon) grid into tiles
+                           that are computed independently (0 computes the whole grid at once)
+    @param workers: number of worker processes running tiles in parallel
+    @param compact_wet_points: integrate only points with valid temperature data (ocean points above
+                               the sea floor), land points are set to NaN when the output is written
+    @param parameter_engine: "exact" evaluates equations 2 and 3, "lut" interpolates them in lookup tables
+                             (see lookup.ParameterTable for the error bound)
+    @param lut_step: temperature step of the lookup tables (K)
+    @param integrator: "daily" integrates daily steps over every time step of the input, "monthly" advances
+                       each month of 30 days by one lookup in a propagator table (see propagator.MonthlyPropagator)
+    @param propagator_temp_step: temperature step of the propagator table (K)
+    @param propagator_log_weight_step: step of the natural logarithm of weight of the propagator table
+    @param checkpoint_years: save the model state every checkpoint_years computed years (0 disables checkpoints)
+    @param resume: continue a killed run with the same settings from its last checkpoint (ValueError if
+                   checkpoints are disabled and there is no checkpoint)
+    @param incremental: only compute cohorts that are not in the output of earlier runs with the same
+                        settings or whose input files changed (e.g. after adding a year to the input data)
+    @param shared_input: temperature.SharedInput holding input_data, the input is not opened again
+                         (e.g. by a batch of runs, not used by tiled runs)
+    @param time_chunk_steps: read years of more time steps in chunks of time_chunk_steps steps in the order of
+                             time, only the current chunk is held in memory (0 reads and caches whole years)
+    @param prepared_input: read the input from a prepared cache covering the run if there is an up-to-date one
+                           (see prepared.prepare()), otherwise from the netCDF files
+    @param prepared_dir: folder of the prepared caches, None for prepared.PREPARED_DIR in input_data
+    @param output_variables: output variables written in output_format, None for all (see output.OUTPUT_VARIABLES),
+                             empty writes only the summaries of the reductions
+    @param reductions: summaries computed while the model runs and written to "<exp_name>_<region>_summary.nc"
+                       (list of dicts, see reductions.parse_reductions()), not available for tiled and
+                       incremental runs
+    @param kernel_backend: compute backend of the parameters a and b and the daily steps: "numpy" (reference),
+                           "numexpr", "numba" or "auto" (fastest installed one), see backends.py
     @author: nsokolov 2018 - 2022
     @author: arohner 2021 - 2022
     @return: None
     """
 
+    if cohort_mode not in COHORT_MODES:
+        raise ValueError(f'Unknown cohort_mode "{cohort_mode}", expected one of {COHORT_MODES}')
+    # Fail early on an unknown engine or backend, worker processes build their own tables and kernels
+    parameter_functions(parameter_engine, lut_step)
+    kernel_backend = get_backend(kernel_backend).name
+    if integrator not in INTEGRATORS:
+        raise ValueError(f'Unknown integrator "{integrator}", expected one of {INTEGRATORS}')
+    output_variables = select_variables(output_variables)
+    parse_reductions(reductions, depth, lat, lon, max_age)
+    if reductions and tile_memory_mb:
+        raise ValueError('Reductions summarize the whole grid, set tile_memory_mb = 0')
+    if reductions and incremental:
+        raise ValueError('Reductions summarize all cohorts of a run, they are not available for incremental runs')
+
+    # Index the input files once, before worker processes read the manifest
+    select_files(input_data, first_year, final_year)
+
+    # Create output directories if they do not exist
+    output_dir = output.joinpath(exp_name, region)
+    logging.debug(f'MY OUTPUT FOLDER: {output_dir}')
+    name = f'{exp_name}_{region}'
+
+    # Cohorts completing their life cycle within the input data and the hash of their inputs
+    hashes = year_hashes(input_data, first_year, final_year)
+    cohort_inputs = {cohort: fingerprint(inputs=[hashes[year] for year in range(cohort, cohort + max_age)])
+                     for cohort in range(first_year, final_year - max_age + 1)}
+    # Settings that determine the output of a cohort and its place in the output store (first cohort first_year)
+    output_fingerprint = fingerprint(lat=lat, lon=lon, depth=depth, max_age=max_age, output_format=output_format,
+                                     name=name, first_year=first_year, parameter_engine=parameter_engine,
+                                     lut_step=lut_step, integrator=integrator, propagator_temp_step=propagator_temp_step,
+                                     propagator_log_weight_step=propagator_log_weight_step,
+                                     kernel_backend=kernel_backend)
+    if resume and not checkpoint_years and not any(output_dir.glob(_checkpoint_name('*'))):
+        raise ValueError(f'Cannot resume the run in {output_dir}: checkpoints are disabled (checkpoint_years = 0) '
+                         f'and there is no checkpoint, run without --resume or set checkpoint_years')
+    cohorts = None
+    if incremental:
+        record = load_record(output_dir, output_fingerprint)
+        cohorts = [cohort for cohort, inputs in cohort_inputs.items() if record.get(cohort) != inputs
+                   or not _cohort_written(output_format, output_dir, name, cohort, max_age, output_variables)]
+        logging.info(f'Incremental run: {len(cohort_inputs) - len(cohorts)} of {len(cohort_inputs)} '
+                     f'cohorts are up to date')
+        if not cohorts:
+            return None
+    checkpoint_settings = dict(directory=output_dir, interval=checkpoint_years, resume=resume,
+                               fingerprint=fingerprint(output=output_fingerprint, cohorts=cohorts,
+                                                       first_year=first_year, final_year=final_year,
+                                                       cohort_mode=cohort_mode, inputs=hashes,
+                                                       output_variables=output_variables, reductions=reductions))
+
+    writer_settings = dict(output_format=output_format, output_dir=output_dir, depth=depth, lat=lat, lon=lon,
+                           max_age=max_age, first_cohort=first_year, name=name,
+                           complevel=output_complevel, chunks=output_chunks,
+                           asynchronous=async_output, queue_size=output_queue_size,
+                           # An incremental run without any up-to-date cohort starts a new output store
+                           append=resume or (incremental and len(cohorts) < len(cohort_inputs)),
+                           variables=output_variables, reductions=reductions)
+    run_settings = dict(input_data=input_data, lat=lat, lon=lon, depth=depth, max_age=max_age,
+                        first_year=first_year, final_year=final_year, cohort_mode=cohort_mode,
+                        temp_cache_mb=temp_cache_mb, compact_wet_points=compact_wet_points,
+                        parameter_engine=parameter_engine, lut_step=lut_step, integrator=integrator,
+                        propagator_steps=(propagator_temp_step, propagator_log_weight_step),
+                        writer_settings=writer_settings, cohorts=cohorts, checkpoint_settings=checkpoint_settings,
+                        time_chunk_steps=time_chunk_steps, kernel_backend=kernel_backend)
+    if prepared_input and shared_input is None:
+        # Every region (tile) maps the cache itself, worker processes only get its header file
+        prepared = open_prepared(input_data, first_year, final_year, depth, lat, lon, prepared_dir)
+        if prepared is not None:
+            logging.info(f'Reading prepared input {prepared}')
+            run_settings['prepared_file'] = prepared.header_file
+
+    if tile_memory_mb:
+        _run_tiled(run_settings, tile_memory_mb, workers)
+    else:
+        temperature = _run_region(**run_settings, shared_input=shared_input)
+        logging.info(f'Input temperature: {temperature}')
+
+    # The run completed: record its cohorts for incremental runs, checkpoints are no longer needed
+    record = load_record(output_dir, output_fingerprint)
+    record.update(cohort_inputs if cohorts is None else {cohort: cohort_inputs[cohort] for cohort in cohorts})
+    save_record(output_dir, output_fingerprint, record)
+    for filename in output_dir.glob(_checkpoint_name('*')):
+        filename.unlink()
+    output_dir.joinpath(STATE_NAME).unlink(missing_ok=True)
+
+    logging.info(f'Saved results to folder {output.resolve()}')
+    return None
+
+
+def multi_dim_dataset(temperature, max_age: int, first_year: int, final_year: int,
+                      lat: list = None, lon: list = None, depth: list = None,
+                      cohort_mode: str = 'stacked', temp_cache_mb: float = 512, compact_wet_points: bool = True,
+                      parameter_engine: str = 'exact', lut_step: float = LUT_STEP, integrator: str = 'daily',
+                      propagator_temp_step: float = PROPAGATOR_TEMP_STEP,
+                      propagator_log_weight_step: float = PROPAGATOR_LOG_WEIGHT_STEP, time_chunk_steps: int = 0,
+                      kernel_backend: str = 'numpy', output: pathlib.Path = None, output_format: str = 'netcdf',
+                      lazy: bool = True, **output_settings):
+    """
+    Compute weight-at-age of Atlantic cod from temperature data in memory and return the results
+
+    Same model as multi_dim() without reading input files: the results are returned as Dataset with cohort
+    and age dimensions, writing files is optional.
+
+    By default (lazy and no output) the variables are dask arrays with one chunk per cohort, a cohort is
+    computed from the years of its life cycle when its values are needed (e.g. by .sel(cohort=...).values,
+    .compute() or writing the Dataset). The wet points are found when the first cohort is computed, the yearly
+    temperature fields are cached for the other cohorts as long as the Dataset exists. Otherwise all cohorts
+    are computed before returning and the results are held in memory (see output.MemoryWriter), with output
+    they are written to files as well.
+
+    @param temperature: xarray.Dataset with variable "thetao" (or xarray.DataArray) with dimensions
+                        (time, depth_coord, latitude, longitude) and a datetime or cftime time coordinate
+                        (durations of the time steps from the coordinate "step_days" or the time coordinate,
+                        see time_axis.step_days()), or numpy array (time, depth, lat, lon) of monthly fields
+                        of 30 days starting in January of first_year (360_day calendar)
+    @param max_age: maximum age of fish (in years)
+    @param first_year: first year of the input
+    @param final_year: last year of the input
+    @param lat: latitudes (default: all latitudes of the dataset, required for numpy arrays)
+    @param lon: longitudes (default: all longitudes of the dataset, required for numpy arrays)
+    @param depth: depth levels (default: all depth levels of the dataset, required for numpy arrays)
+    @param cohort_mode: "stacked" (default) or "sequential", see multi_dim(), lazy cohorts are computed one by one
+    @param temp_cache_mb: memory cap (MB) of the cache of yearly temperature fields (shared by lazy cohorts)
+    @param compact_wet_points: integrate only points with valid temperature data
+    @param parameter_engine: "exact" or "lut", see multi_dim()
+    @param lut_step: temperature step of the lookup tables (K)
+    @param integrator: "daily" or "monthly", see multi_dim()
+    @param propagator_temp_step: temperature step of the propagator table (K)
+    @param propagator_log_weight_step: step of the natural logarithm of weight of the propagator table
+    @param time_chunk_steps: maximum number of time steps held in memory, see multi_dim()
+    @param kernel_backend: "numpy", "numexpr", "numba" or "auto", see multi_dim()
+    @param output: output folder, the results are also written there if given
+    @param output_format: "netcdf" or "store", see multi_dim()
+    @param lazy: return dask arrays computed per cohort when needed, False computes all cohorts at once
+                 (ignored with output, written results are computed at once)
+    @param output_settings: further arguments of output.create_writer() (e.g. name, complevel, asynchronous)
+    @return: xarray.Dataset with the variables a_3d, b_3d, growth_rates_3d, weight_3d (kg) and weight_max (kg)
+             with dimensions (cohort, age, depth_coord, latitude, longitude), see output.cohort_dataset()
+    """
+    if cohort_mode not in COHORT_MODES:
+        raise ValueError(f'Unknown cohort_mode "{cohort_mode}", expected one of {COHORT_MODES}')
+    if integrator not in INTEGRATORS:
+        raise ValueError(f'Unknown integrator "{integrator}", expected one of {INTEGRATORS}')
+    backend = get_backend(kernel_backend)
+    parameters = parameter_functions(parameter_engine, lut_step, backend)
+    input_files = _input_dataset(temperature, first_year, final_year, depth, lat, lon)
+    depth, lat, lon = [list(input_files.indexes[name]) if labels is None else labels for name, labels in
+                       (('depth_coord', depth), ('latitude', lat), ('longitude', lon))]
+
+    propagator_steps = (propagator_temp_step, propagator_log_weight_step)
+    cohorts = range(first_year, max(first_year, final_year - max_age + 1))
+    if lazy and output is None and len(cohorts):
+        lazy_cohorts = _LazyCohorts(input_files, first_year, final_year, max_age, depth, lat, lon, temp_cache_mb,
+                                    compact_wet_points, time_chunk_steps,
+                                    dict(parameters=parameters, integrator=integrator,
+                                         propagator_steps=propagator_steps, backend=backend))
+        # The input is only held by lazy_cohorts, dask would compute an input Dataset of dask arrays as argument
+        blocks = [dask.delayed(lazy_cohorts.fields)(cohort) for cohort in cohorts]
+        arrays = {}
+        for var_name in OUTPUT_VARIABLES:
+            shape = (len(lat), len(lon)) if var_name in SURFACE_VARIABLES else (len(depth), len(lat), len(lon))
+            arrays[var_name] = dask.array.concatenate([dask.array.from_delayed(block[var_name], (1, max_age) + shape,
+                                                                               dtype='f') for block in blocks])
+        return cohort_dataset(arrays, cohorts, range(1, max_age + 1), depth, lat, lon)
+
+    points = None
+    if compact_wet_points:
+        points = load_wet_points(input_files, first_year, final_year, depth, lat, lon)
+        logging.info(f'Integrating {len(points)} of {len(depth) * len(lat) * len(lon)} wet points')
+    cache = TemperatureCache(input_files, max_mb=temp_cache_mb, points=points, chunk_steps=time_chunk_steps)
+
+    memory = MemoryWriter(depth, lat, lon, max_age, cohorts)
+    writer = memory
+    if output is not None:
+        writer = TeeWriter(memory, create_writer(output_format, output, depth, lat, lon, max_age, first_year,
+                                                 **output_settings))
+    run = _run_stacked if cohort_mode == 'stacked' else _run_sequential
+    try:
+        run(cache, lat, lon, depth, max_age, first_year, final_year, writer, points, parameters, integrator,
+            propagator_steps, backend=backend)
+    finally:
+        writer.close()
+    logging.info(f'Input temperature: {cache}')
+    return memory.dataset()
+
+
+class _LazyCohorts:
+    """
+    Cohorts of the lazy Dataset of multi_dim_dataset(), computed one by one when dask needs their chunks
+
+    All cohorts share the wet points of the run and one cache of yearly temperature fields, which are read
+    under a lock (dask computes chunks in threads).
+    """
+
+    def __init__(self, input_files, first_year: int, final_year: int, max_age: int, depth: list, lat: list,
+                 lon: list, temp_cache_mb: float, compact_wet_points: bool, time_chunk_steps: int, run_settings: dict):
+        """
+        @param input_files: input dataset, see _input_dataset()
+        @param run_settings: further arguments of _run_sequential() (parameters, integrator, ...)
+        """
+        self.input_files = input_files
+        self.first_year = first_year
+        self.final_year = final_year
+        self.max_age = max_age
+        self.depth = depth
+        self.lat = lat
+        self.lon = lon
+        self.temp_cache_mb = temp_cache_mb
+        self.compact_wet_points = compact_wet_points
+        self.time_chunk_steps = time_chunk_steps
+        self.run_settings = run_settings
+        self.points = None
+        self.cache = None
+        self.lock = threading.Lock()
+
+    def fields(self, cohort: int):
+        """
+        Compute the output of one cohort
+
+        @param cohort: birth year
+        @return: numpy arrays (1, age, depth, lat, lon) or (1, age, lat, lon) by variable name
+        """
+        with self.lock:
+            if self.cache is None:
+                if self.compact_wet_points:
+                    self.points = load_wet_points(self.input_files, self.first_year, self.final_year, self.depth,
+                                                  self.lat, self.lon)
+                    logging.info(f'Integrating {len(self.points)} of {len(self.depth) * len(self.lat) * len(self.lon)} '
+                                 f'wet points')
+                self.cache = TemperatureCache(self.input_files, max_mb=self.temp_cache_mb, points=self.points,
+                                              chunk_steps=self.time_chunk_steps)
+        memory = MemoryWriter(self.depth, self.lat, self.lon, self.max_age, [cohort])
+        _run_sequential(self, self.lat, self.lon, self.depth, self.max_age, self.first_year, self.final_year, memory,
+                        self.points, cohorts=(cohort,), **self.run_settings)
+        return memory.arrays
+
+    def chunks(self, year: int, depth: list, lat: list, lon: list):
+        """
+        Temperature fields of one year from the shared cache, see TemperatureCache.chunks()
+        """
+        iterator = self.cache.chunks(year, depth, lat, lon)
+        while True:
+            with self.lock:
+                chunk = next(iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+
+
+def _input_dataset(temperature, first_year: int, final_year: int, depth: list, lat: list, lon: list):
+    """
+    Wrap temperature data in memory as input dataset of the model
+
+    @param temperature: xarray.Dataset, xarray.DataArray or numpy array, see multi_dim_dataset()
+    @return: xarray.Dataset with variable "thetao", a time index selectable by year and the durations of
+             the time steps (coordinate STEP_DAYS)
+    """
+    if isinstance(temperature, xr.DataArray):
+        temperature = temperature.to_dataset(name='thetao')
+    if isinstance(temperature, xr.Dataset):
+        if 'thetao' not in temperature:
+            raise ValueError('The input dataset needs a temperature variable "thetao"')
+        if not isinstance(temperature.indexes.get('time'), (pd.DatetimeIndex, xr.CFTimeIndex)):
+            raise ValueError('The time coordinate of the input dataset must hold dates '
+                             '(open it with decode_times=True or assign a time index)')
+        if STEP_DAYS not in temperature.coords:
+            temperature = temperature.assign_coords({STEP_DAYS: ('time', index_step_days(temperature.indexes['time']))})
+        return temperature
+
+    values = np.asarray(temperature)
+    months = 12 * (final_year - first_year + 1)
+    if values.ndim != 4 or len(values) < months:
+        raise ValueError(f'Expected a temperature array (time, depth, lat, lon) with at least {months} monthly '
+                         f'fields for {first_year} - {final_year}, got shape {values.shape}')
+    if depth is None or lat is None or lon is None:
+        raise ValueError('depth, lat and lon are required for a temperature array')
+    if values.shape[1:] != (len(depth), len(lat), len(lon)):
+        raise ValueError(f'Temperature array of shape {values.shape} does not match {len(depth)} depth levels, '
+                         f'{len(lat)} latitudes and {len(lon)} longitudes')
+    time = xr.date_range(f'{first_year}-01-01', periods=len(values), freq='MS', calendar='360_day', use_cftime=True)
+    return xr.Dataset({'thetao': (('time', 'depth_coord', 'latitude', 'longitude'), values)},
+                      coords={'time': time, STEP_DAYS: ('time', np.full(len(values), 30.)), 'depth_coord': depth,
+                              'latitude': lat, 'longitude': lon})
+
+
+def _cohort_written(output_format: str, output_dir: pathlib.Path, name: str, cohort: int, max_age: int,
+                    variables=OUTPUT_VARIABLES):
+    """
+    Check that the output of a cohort exists
+
+    @param variables: written output variables
+    @return: bool
+    """
+    if output_format == 'store':
+        return not variables or cohort_stored(output_dir.joinpath(name + '.nc'), cohort, max_age, variables)
+    return all(netcdf_filename(output_dir.joinpath(var_name), var_name, cohort + age, age).exists()
+               for var_name in variables for age in range(1, max_age + 1))
+
+
+def _checkpoint_name(region):
+    """
+    File name of the checkpoint of a region
+
+    @param region: (lat slice, lon slice), None for the whole grid or "*" for a pattern matching all regions
+    @return: str
+    """
+    if region is None or region == '*':
+        suffix = '' if region is None else '*'
+    else:
+        suffix = f'_{region[0].start}-{region[0].stop}_{region[1].start}-{region[1].stop}'
+    return f'.growth_model_checkpoint{suffix}.npz'
+
+
+def _run_region(input_data, lat, lon, depth, max_age, first_year, final_year, cohort_mode,
+                temp_cache_mb, compact_wet_points, parameter_engine, lut_step, integrator, propagator_steps,
+                writer_settings, cohorts=None, checkpoint_settings=None, time_chunk_steps=0, prepared_file=None,
+                kernel_backend='numpy', region=None, lock=None, shared_input=None):
+    """
+    Run the model for the whole grid or a (lat, lon) region of it
+
+    @param cohorts: birth years to compute, None for all
+    @param checkpoint_settings: dict with directory, fingerprint, interval and resume (see Checkpoint)
+    @param time_chunk_steps: maximum number of time steps held in memory (see TemperatureCache)
+    @param prepared_file: header file of a prepared cache covering the run (see prepared.open_prepared()),
+                          None reads the netCDF files
+    @param kernel_backend: compute backend of the kernels (see backends.get_backend())
+    @param region: (lat slice, lon slice) of the region, None for the whole grid
+    @param lock: lock shared by the writers of all regions
+    @param shared_input: temperature.SharedInput holding the input data, None opens input_data
+    @return: TemperatureCache or None if the region was completed before
+    """
+    checkpoint, state = None, None
+    if checkpoint_settings is not None:
+        checkpoint = Checkpoint(checkpoint_settings['directory'].joinpath(_checkpoint_name(region)),
+                                checkpoint_settings['fingerprint'], checkpoint_settings['interval'])
+        if checkpoint_settings['resume']:
+            state = checkpoint.load()
+        if state is not None and state.get('complete'):
+            logging.info(f'Region {region} was completed before')
+            return None
+    if cohorts is not None and cohort_mode == 'stacked':
+        # Stacked cohorts are consecutive, cohorts in between are computed again
+        first_year = min(cohorts)
+
+    if region is not None:
+        lat = lat[region[0]]
+        lon = lon[region[1]]
+
+    prepared = PreparedInput(prepared_file) if prepared_file is not None and shared_input is None else None
+    if shared_input is not None:
+        input_files = shared_input.input_files
+    elif prepared is not None:
+        input_files = prepared
+    else:
+        input_files = open_input(input_data, first_year, final_year)
+    points = None
+    if compact_wet_points:
+        # Index of the points that are wet in any year, all other points stay NaN
+        if shared_input is not None:
+            points = shared_input.wet_points(first_year, final_year, depth, lat, lon)
+        elif prepared is not None:
+            points = prepared.wet_points(first_year, final_year, depth, lat, lon)
+        else:
+            points = load_wet_points(input_files, first_year, final_year, depth, lat, lon)
+        logging.info(f'Integrating {len(points)} of {len(depth) * len(lat) * len(lon)} wet points')
+    loader = shared_input.load if shared_input is not None else prepared.load if prepared is not None else None
+    temperature = TemperatureCache(input_files, max_mb=temp_cache_mb, points=points, loader=loader,
+                                   chunk_steps=time_chunk_steps,
+                                   step_loader=prepared.load_step_days if prepared is not None else None,
+                                   point_loader=prepared.load_points if prepared is not None else None)
+    backend = get_backend(kernel_backend)
+    parameters = parameter_functions(parameter_engine, lut_step, backend)
+    variables = _required_variables(writer_settings.get('variables'), writer_settings.get('reductions'))
+    writer = create_writer(**writer_settings, region=region, lock=lock)
+    try:
+        if state is not None:
+            # Output that was still being written when the checkpoint was saved
+            for year, age, fields in state['pending']:
+                writer.write(year, age, fields)
+        if cohort_mode == 'stacked':
+            _run_stacked(temperature, lat, lon, depth, max_age, first_year, final_year, writer, points, parameters,
+                         integrator, propagator_steps, checkpoint=checkpoint, state=state, variables=variables,
+                         backend=backend)
+        else:
+            _run_sequential(temperature, lat, lon, depth, max_age, first_year, final_year, writer, points,
+                            parameters, integrator, propagator_steps, checkpoint=checkpoint, state=state,
+                            cohorts=cohorts, variables=variables, backend=backend)
+    finally:
+        writer.close()
+    if checkpoint is not None and checkpoint.interval:
+        # All output of the region is written
+        checkpoint.save(None, force=True, complete=True)
+    return temperature
+
+
+def _required_variables(variables=None, reductions=None):
+    """
+    Output variables needed by the writer: the written variables and the variables of the reductions
+
+    @param variables: written output variables, None for all
+    @param reductions: settings of the reductions
+    @return: tuple of variable names, None for all
+    """
+    if variables is None:
+        return None
+    reduced = {reduction['variable'] for reduction in reductions or ()}
+    return tuple(var_name for var_name in OUTPUT_VARIABLES if var_name in variables or var_name in reduced)
+
+
+def _run_tile(run_settings: dict, region: tuple, lock, instrument: bool = False):
+    """
+    Run the model for one tile in a worker process
+
+    @param instrument: record metrics of the tile (see metrics.enable())
+    @return: tuple of (description of the temperature cache of the tile, metrics.snapshot() or None)
+    """
+    # A forked worker inherits the records of the main process, start from scratch
+    if instrument:
+        metrics.enable()
+    else:
+        metrics.disable()
+    # Tiles already run in parallel, do not start dask threads within a worker
+    with dask.config.set(scheduler='synchronous'):
+        temperature = _run_region(**run_settings, region=region, lock=lock)
+    return repr(temperature), metrics.snapshot()
+
+
+def _run_tiled(run_settings: dict, tile_memory_mb: float, workers: int):
+    """
+    Split the (lat, lon) grid into tiles that fit into the memory budget and run them one by one
+    (workers = 1) or on a pool of worker processes. Every tile reads only its own region of the input
+    and writes its region of the output, so peak memory does not depend on the size of the grid.
+
+    @param run_settings: arguments of _run_region()
+    @param tile_memory_mb: memory budget (MB) of one worker
+    @param workers: number of worker processes
+    @return: None
+    """
+    n_depth = len(run_settings['depth'])
+    n_lat = len(run_settings['lat'])
+    n_lon = len(run_settings['lon'])
+    max_age = run_settings['max_age']
+    cohort_mode = run_settings['cohort_mode']
+    _, years, _, _ = select_files(run_settings['input_data'], run_settings['first_year'], run_settings['final_year'])
+    year_steps = max(Counter(years).values())
+    chunk_steps = run_settings['time_chunk_steps']
+    column_bytes = _column_bytes(n_depth, max_age, cohort_mode, run_settings['writer_settings']['queue_size'],
+                                 year_steps, chunk_steps)
+    max_columns = int(tile_memory_mb * 1024 ** 2 // column_bytes)
+    if max_columns < 1:
+        raise ValueError(f'tile_memory_mb = {tile_memory_mb} is too small, '
+                         f'one (lat, lon) column needs {column_bytes / 1024 ** 2:.3f} MB')
+    tiles = _plan_tiles(n_lat, n_lon, max_columns)
+    logging.info(f'Running {len(tiles)} tiles of at most {max_columns} (lat, lon) columns on {workers} worker(s)')
+
+    # The temperature cache of a tile holds at most the years needed by the cohort loop
+    cached_years = 1 if cohort_mode == 'stacked' else max_age
+    cache_mb = cached_years * year_steps * 4 * n_depth * max_columns / 1024 ** 2
+    run_settings = dict(run_settings, temp_cache_mb=min(run_settings['temp_cache_mb'], cache_mb))
+
+    # Create the output of the whole grid, tiles fill their regions. Files of the netCDF output are replaced
+    # (like the output store) unless a killed run is resumed, whose tiles already filled some regions
+    writer_settings = run_settings['writer_settings']
+    writer = create_writer(**dict(writer_settings, asynchronous=False))
+    if isinstance(writer, FileWriter) and not run_settings['checkpoint_settings']['resume']:
+        cohorts = run_settings['cohorts']
+        if cohorts is None:
+            cohorts = range(run_settings['first_year'], run_settings['final_year'] - max_age + 1)
+        writer.create_grids(cohorts, max_age)
+    writer.close()
+
+    if workers <= 1:
+        lock = threading.Lock()
+        for number, region in enumerate(tiles, start=1):
+            _run_region(**run_settings, region=region, lock=lock)
+            logging.info(f'Finished tile {number} / {len(tiles)}')
+        return
+
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=workers) as executor:
+        lock = manager.Lock()
+        futures = [executor.submit(_run_tile, run_settings, region, lock, metrics.enabled()) for region in tiles]
+        for number, future in enumerate(as_completed(futures), start=1):
+            temperature, tile_metrics = future.result()
+            metrics.merge(tile_metrics)
+            logging.debug(f'Input temperature: {temperature}')
+            logging.info(f'Finished tile {number} / {len(tiles)}')
+
+
+def _column_bytes(n_depth: int, max_age: int, cohort_mode: str, output_queue_size: int, year_steps: int = 12,
+                  chunk_steps: int = 0):
+    """
+    Estimate the memory needed per (lat, lon) column of a tile
+
+    @param year_steps: maximum number of time steps of a year
+    @param chunk_steps: maximum number of time steps read at once (0 for whole years)
+    @return: bytes
+    """
+    if chunk_steps and chunk_steps < year_steps:
+        # Temperature: the streamed chunk (float32 fields), years are not cached
+        temperature = chunk_steps * 4
+    else:
+        # Temperature: cached years plus the year being read (float32 fields)
+        cached_years = 1 if cohort_mode == 'stacked' else max_age
+        temperature = (cached_years + 1) * year_steps * 4
+    # State: weight, growth rate, scratch buffer (float32) and mask (bool) per cohort, a and b
+    cohorts = max_age if cohort_mode == 'stacked' else 1
+    state = cohorts * (3 * 4 + 1) + 2 * 4
+    # Output: five fields per cohort-year, copied for every item queued by the background writer
+    output = (output_queue_size + 1) * 5 * 4
+    return n_depth * (temperature + state + output)
+
+
+def _plan_tiles(n_lat: int, n_lon: int, max_columns: int):
+    """
+    Split the (lat, lon) grid into rectangular tiles of at most max_columns columns
+
+    @return: list of (lat slice, lon slice)
+    """
+    lon_size = min(n_lon, max_columns)
+    lat_size = max(1, min(n_lat, max_columns // lon_size))
+    return [(slice(i, min(i + lat_size, n_lat)), slice(j, min(j + lon_size, n_lon)))
+            for i in range(0, n_lat, lat_size) for j in range(0, n_lon, lon_size)]
+
+
+def _run_sequential(temperature, lat, lon, depth, max_age, first_year, final_year, writer, points=None,
+                    parameters=None, integrator='daily', propagator_steps=(), checkpoint=None, state=None,
+                    cohorts=None, variables=None, backend=None):
+    """
+    Integrate one cohort (birth year) after another
+
+    @param points: flat indices of the integrated (depth, cell) points, None for all points
+    @param parameters: functions (a(temp), b(temp)), see lookup.parameter_functions()
+    @param integrator: "daily" or "monthly"
+    @param propagator_steps: (temperature step, log weight step) of the propagator tables
+    @param checkpoint: Checkpoint saving the state after every year
+    @param state: state of the checkpoint to resume from
+    @param cohorts: birth years to compute, None for all
+    @param variables: output variables passed to the writer, None for all
+    @param backend: compute backend of the daily steps (see backends.get_backend()), None for NumPy
+    @return: None
+    """
     # Define time series
     years = np.arange(first_year, final_year + 1)
 
@@ -49,26 +664,24 @@ def multi_dim(lat: list, lon: list, depth: list,
 
     # Initial time step (by default = 1 day)
     dt = 1
-
-    # Get temperature files from input directory
-    my_files = input_data + '/*.nc'
-    input_files = xr.open_mfdataset(my_files, decode_times=False)
-    logging.debug(f'DATA SET: {input_files}')
-    # Create new_time for the dataset to change it from 360_d to standard calendar
-    # Check your netcdf files which calender they have
-    new_time = pd.date_range(str(first_year) + '-01-01', str(final_year + 1) + '-01-01', freq='M')
-
-    # You need new times in you dataset
-    # Only if you have other than standard calendar
-    input_files = input_files.assign_coords({'time': new_time})
+    propagators = monthly_propagators(integrator, dt, 30, *propagator_steps)
 
     # Define dimensionality of coords
-    length_depth = len(depth)
-    length_lat = len(lat)
-    length_lon = len(lon)
+    grid_shape = (len(depth), len(lat), len(lon))
+    field_shape = _field_shape(grid_shape, points)
+
+    # Preallocate fields of parameters a and b and scratch buffers of the integration kernel
+    a = np.zeros(shape=field_shape, dtype='f')
+    b = np.zeros(shape=field_shape, dtype='f')
+    workspace = allocate_workspace(field_shape)
 
     # Start calculations
     for each_year in years:
+        if cohorts is not None and each_year not in cohorts:
+            continue
+        if state is not None and each_year < state['cohort']:
+            # Completed before the checkpoint
+            continue
         initial_year = each_year
         logging.debug(f'INITIAL YEAR: {initial_year}')
         # Identifiyng the last year (death of cod)
@@ -76,86 +689,162 @@ def multi_dim(lat: list, lon: list, depth: list,
         logging.debug(f'LAST YEAR: {last_year}')
         # Beginning of life cycle
         age = 1
-        weight = np.ones(shape=(length_depth, length_lat * length_lon), dtype='f')
-        growth_rates = np.zeros(shape=(length_depth, length_lat * length_lon), dtype='f')
+        weight = np.ones(shape=field_shape, dtype='f')
+        growth_rates = np.zeros(shape=field_shape, dtype='f')
+        if state is not None:
+            # Continue the cohort of the checkpoint
+            initial_year, age = int(state['year']), int(state['age'])
+            weight[...] = state['weight']
+            growth_rates[...] = state['growth_rates']
+            state = None
         for year in range(initial_year, last_year):
             logging.debug(f'WORK ON YEAR: {year}')
             if last_year > years[-1]:
                 logging.debug('YEAR IS NOT IN DATA SET')
                 break
             else:
-                my_temp = input_files.thetao.sel(time=str(year), depth_coord=depth, latitude=lat, longitude=lon)
-                logging.debug(my_temp)
-                # Partly vectorize 4D temperature fields to accelerate the computations
-                temp_input_3d = my_temp.values.reshape(12, length_depth, length_lat * length_lon)
-                # Set NaN values
-                temp_input_3d[np.where(temp_input_3d[:, :, :] <= -998)] = np.nan
-                # Initialize necessary variable fields
-                a = np.zeros(shape=(length_depth, length_lat * length_lon), dtype='f')
-                b = np.zeros(shape=(length_depth, length_lat * length_lon), dtype='f')
-                for mon in np.arange(0, 12):
-                    for _ in np.arange(0, 30):
-                        for i in np.arange(0, length_depth):
-                            a[i, :] = equation2(temp_input_3d[mon, i, :])
-                            b[i, :] = equation3(temp_input_3d[mon, i, :]) * (-1.)
-                            growth_rates[i, :] = 0.01 * (a[i, :] * weight[i, :] ** b[i, :] - C_AVG)
-                            growth_rates[i, :] = np.where(growth_rates[i, :] < 0, 0, growth_rates[i, :])
-                            weight[i, :] = weight[i, :] * (1. + dt * growth_rates[i, :])
+                # Integrate daily growth for the whole (depth, cell) field at once, chunk by chunk of time steps
+                for temp_input_3d, durations, year_end in temperature.chunks(year, depth, lat, lon):
+                    integrate_year(temp_input_3d, weight, growth_rates, a, b, dt=dt, workspace=workspace,
+                                   parameters=parameters, propagators=propagators, durations=durations,
+                                   year_end=year_end, backend=backend)
                 new_year = int(year) + 1
-                # Reshape data to original shape
-                a_3d = a.reshape(length_depth, length_lat, length_lon)
-                b_3d = b.reshape(length_depth, length_lat, length_lon)
-                growth_rates_3d = growth_rates.reshape(length_depth, length_lat, length_lon)
-                # 3D field with asymptotic weight
-
-                weight_3d = 0.001 * weight.reshape((length_depth, length_lat, length_lon))
-                # Calculate maximum asymptotic weight at a given location ->  ("W*" in Butzin and Pörtner (2016))
-                with warnings.catch_warnings():
-                    warnings.simplefilter('ignore')
-                    weight_max = np.nanmax(weight_3d, axis=0)
-
-                # Create output directories if they do not exist
-                output_dir = output.joinpath(exp_name, region)
-                logging.debug(f'MY OUTPUT FOLDER: {output_dir}')
-                output_a_3d = output_dir.joinpath('a_3d')
-                output_b_3d = output_dir.joinpath('b_3d')
-                output_growth_rates_3d = output_dir.joinpath('growth_rates_3d')
-                output_weight_3d = output_dir.joinpath('weight_3d')
-                output_weight_max = output_dir.joinpath('weight_max')
-
-                output_pathlist = [
-                    output_a_3d,
-                    output_b_3d,
-                    output_growth_rates_3d,
-                    output_weight_3d,
-                    output_weight_max
-                ]
-                for f in output_pathlist:
-                    if not f.exists():
-                        f.mkdir(parents=True)
-
-                # Save netcdf (a_3d, b_3d, growth_rates_3d, weight_3d, weight_max)
-                save_netcdf(
-                    data=a_3d, var_name='a_3d', directory=output_a_3d,
-                    year=new_year, age=age, depths=depth, lat=lat, lon=lon
-                )
-                save_netcdf(
-                    data=b_3d, var_name='b_3d', directory=output_b_3d,
-                    year=new_year, age=age, depths=depth, lat=lat, lon=lon
-                )
-                save_netcdf(
-                    data=growth_rates_3d, var_name='growth_rates_3d', directory=output_growth_rates_3d,
-                    year=new_year, age=age, depths=depth, lat=lat, lon=lon
-                )
-                save_netcdf(
-                    data=weight_3d, var_name='weight_3d', directory=output_weight_3d,
-                    year=new_year, age=age, depths=depth, lat=lat, lon=lon
-                )
-                save_netcdf(
-                    data=weight_max, var_name='weight_max', directory=output_weight_max,
-                    year=new_year, age=age, depths=depth, lat=lat, lon=lon,
-                    dimension_labels=('latitude', 'longitude')
-                )
+                writer.write(new_year, age, _output_fields(a, b, growth_rates, weight, grid_shape, points,
+                                                           variables))
                 age = age + 1
-    logging.info(f'Saved results to folder {output.resolve()}')
-    return None
+                if checkpoint is not None:
+                    checkpoint.save(writer, cohort=each_year, year=new_year, age=age, weight=weight,
+                                    growth_rates=growth_rates)
+
+
+def _run_stacked(temperature, lat, lon, depth, max_age, first_year, final_year, writer, points=None,
+                 parameters=None, integrator='daily', propagator_steps=(), checkpoint=None, state=None,
+                 variables=None, backend=None):
+    """
+    Walk each calendar year once and advance all living cohorts in the same step
+
+    State arrays carry a leading age axis (index 0 holds the cohort born in the current year).
+    Cohorts are only integrated if their whole life cycle lies within the input dataset,
+    which gives the same outputs as _run_sequential().
+
+    @param points: flat indices of the integrated (depth, cell) points, None for all points
+    @param parameters: functions (a(temp), b(temp)), see lookup.parameter_functions()
+    @param integrator: "daily" or "monthly"
+    @param propagator_steps: (temperature step, log weight step) of the propagator tables
+    @param checkpoint: Checkpoint saving the state after every year
+    @param state: state of the checkpoint to resume from
+    @param variables: output variables passed to the writer, None for all
+    @param backend: compute backend of the daily steps (see backends.get_backend()), None for NumPy
+    @return: None
+    """
+    # Initial time step (by default = 1 day)
+    dt = 1
+    propagators = monthly_propagators(integrator, dt, 30, *propagator_steps)
+
+    # Last birth year of a cohort that completes its life cycle within the dataset
+    last_cohort = final_year - max_age
+    if last_cohort < first_year:
+        logging.debug('YEAR IS NOT IN DATA SET')
+        return
+
+    grid_shape = (len(depth), len(lat), len(lon))
+    field_shape = _field_shape(grid_shape, points)
+    a = np.zeros(shape=field_shape, dtype='f')
+    b = np.zeros(shape=field_shape, dtype='f')
+    weight = np.ones(shape=(max_age,) + field_shape, dtype='f')
+    growth_rates = np.zeros(shape=(max_age,) + field_shape, dtype='f')
+    step, negative = allocate_workspace((max_age,) + field_shape)
+    start_year = first_year
+    if state is not None:
+        start_year = int(state['year'])
+        weight[...] = state['weight']
+        growth_rates[...] = state['growth_rates']
+
+    for year in range(start_year, last_cohort + max_age):
+        logging.debug(f'WORK ON YEAR: {year}')
+        if year > first_year:
+            # Every cohort gets one year older, a new one is born
+            weight[1:] = weight[:-1]
+            growth_rates[1:] = growth_rates[:-1]
+            weight[0] = 1.
+            growth_rates[0] = 0.
+        # Living cohorts have consecutive ages (born in first_year..last_cohort)
+        youngest = max(1, year - last_cohort + 1)
+        oldest = min(max_age, year - first_year + 1)
+        alive = slice(youngest - 1, oldest)
+        logging.debug(f'COHORTS: {year - oldest + 1} - {year - youngest + 1}')
+
+        for temp_input_3d, durations, year_end in temperature.chunks(year, depth, lat, lon):
+            integrate_year(temp_input_3d, weight[alive], growth_rates[alive], a, b, dt=dt,
+                           workspace=(step[alive], negative[alive]), parameters=parameters, propagators=propagators,
+                           durations=durations, year_end=year_end, backend=backend)
+        new_year = int(year) + 1
+        for age in range(youngest, oldest + 1):
+            writer.write(new_year, age, _output_fields(a, b, growth_rates[age - 1], weight[age - 1],
+                                                       grid_shape, points, variables))
+        if checkpoint is not None:
+            checkpoint.save(writer, year=new_year, weight=weight, growth_rates=growth_rates)
+
+
+def _field_shape(grid_shape, points=None):
+    """
+    Shape of the integrated fields
+
+    @param grid_shape: (depth, lat, lon)
+    @param points: flat indices of the integrated (depth, cell) points, None for all points
+    @return: (point,) or (depth, cell)
+    """
+    if points is not None:
+        return (len(points),)
+    return (grid_shape[0], grid_shape[1] * grid_shape[2])
+
+
+def _to_grid(field, grid_shape, points=None):
+    """
+    Reshape an integrated field to the (depth, lat, lon) grid, points that were not integrated are NaN
+
+    @param field: field of shape _field_shape(grid_shape, points)
+    @param grid_shape: (depth, lat, lon)
+    @param points: flat indices of the integrated (depth, cell) points, None for all points
+    @return: numpy array of shape grid_shape
+    """
+    if points is None:
+        return field.reshape(grid_shape)
+    grid = np.full(grid_shape, np.nan, dtype=field.dtype)
+    grid.reshape(-1)[points] = field
+    return grid
+
+
+def _output_fields(a, b, growth_rates, weight, grid_shape, points=None, variables=None):
+    """
+    Reshape the yearly fields of one cohort to the gridded output variables
+
+    @param a: parameter a (depth, cell) or (point)
+    @param b: parameter b (depth, cell) or (point)
+    @param growth_rates: growth rates (depth, cell) or (point)
+    @param weight: weight in g (depth, cell) or (point)
+    @param grid_shape: (depth, lat, lon)
+    @param points: flat indices of the integrated (depth, cell) points, None for all points
+    @param variables: output variables to compute, None for all
+    @return: dict with a_3d, b_3d, growth_rates_3d, weight_3d (kg) and weight_max (kg) or the selected variables
+    """
+    if variables is None:
+        variables = OUTPUT_VARIABLES
+    fields = {}
+    # Reshape data to original shape (scatter the wet points back to the grid)
+    for var_name, field in (('a_3d', a), ('b_3d', b), ('growth_rates_3d', growth_rates)):
+        if var_name in variables:
+            fields[var_name] = _to_grid(field, grid_shape, points)
+    if 'weight_3d' not in variables and 'weight_max' not in variables:
+        return fields
+    # 3D field with asymptotic weight
+
+    weight_3d = 0.001 * _to_grid(weight, grid_shape, points)
+    if 'weight_3d' in variables:
+        fields['weight_3d'] = weight_3d
+    if 'weight_max' in variables:
+        # Calculate maximum asymptotic weight at a given location ->  ("W*" in Butzin and Pörtner (2016))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            fields['weight_max'] = np.nanmax(weight_3d, axis=0)
+    return fields
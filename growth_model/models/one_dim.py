@@ -13,10 +13,28 @@ import pathlib
 import logging
 
 from io import BytesIO
+from functools import lru_cache
+
+from growth_model import metrics
+
+
+@lru_cache(maxsize=None)
+def growth_parameters():
+    """
+    Load the fitted growth parameters once per process
+
+    @return: dict with read-only arrays a_fit, b_fit (0.1 K temperature increments) and c_avg
+    """
+    data = BytesIO(pkgutil.get_data(__name__, '../data/growth_parameters_multistep.npz'))
+    with np.load(data) as growth_params:
+        params = {name: growth_params[name] for name in ('a_fit', 'b_fit', 'c_avg')}
+    for values in params.values():
+        values.flags.writeable = False
+    return params
 
 
 def one_dim(min_temp: float, max_temp: float, temp_step: float,
-            weight: int, max_age: int, output: pathlib.Path):
+            weight: int, max_age: int, output: pathlib.Path, float32: bool = False):
     """
 
     @param min_temp: minimum temperature in an experiment temperature range (°C)
@@ -24,41 +42,56 @@ def one_dim(min_temp: float, max_temp: float, temp_step: float,
     @param temp_step: temperature step in an experiment (°C)
     @param weight: initial weight of individual (g)
     @param max_age: maximum age of individual (years)
-    @param output: output file (pathlib.Path)
+    @param output: output file (pathlib.Path), None skips writing
+    @param float32: compute and write single precision results
     @author: mbutzin 2015-2018
     @author: nsokolov 2018 - 2022
     @author: arohner 2021 - 2022
 
-    @return: None
+    @return: pandas.DataFrame with weight at age (g) by day and temperature
     """
 
-    data = BytesIO(pkgutil.get_data(__name__, '../data/growth_parameters_multistep.npz'))
-    growth_params = np.load(data)
-
-    ages = np.arange(1, max_age * 365)
-    a_fit = growth_params['a_fit']  # the original temperature increment
-    b_fit = growth_params['b_fit']  # underlying a_fit and b_fit is 0.1 K
-    c_avg = growth_params['c_avg']
+    growth_params = growth_parameters()
+    dtype = 'f' if float32 else 'd'
 
     temp_range = np.arange(float(min_temp), float(max_temp), float(temp_step))  # Temperature range in °C
 
-    weight_at_age = np.zeros((max_age * 365, len(temp_range)))  # weight at age (in g) for a given temperature range
+    # The i-th temperature uses the i-th fitted parameters
+    if len(temp_range) > len(growth_params['a_fit']):
+        raise ValueError(f'{len(temp_range)} temperatures exceed the {len(growth_params["a_fit"])} '
+                         f'fitted growth parameters')
+    a_fit = growth_params['a_fit'][:len(temp_range)].astype(dtype)  # the original temperature increment
+    b_fit = growth_params['b_fit'][:len(temp_range)].astype(dtype)  # underlying a_fit and b_fit is 0.1 K
+    c_avg = growth_params['c_avg'].astype(dtype)
+
+    weight_at_age = np.zeros((max_age * 365, len(temp_range)), dtype=dtype)  # weight at age (in g) for a given temperature range
     weight_at_age[0, :] = weight  # initial weight in g
     dt = 1  # time step in days
 
-    i_temp = 0  # temperature index, initial value
-
-    # loop over temperatures, increasing values by 0.5°C
-    for _ in temp_range:
-        for age in ages:
-            growth_rate = 0.01 * (a_fit[i_temp] * weight_at_age[age - 1, i_temp] ** b_fit[i_temp] - c_avg)
-            weight_at_age[age, i_temp] = weight_at_age[age - 1, i_temp] * (1. + dt * growth_rate)
-        i_temp = i_temp + 1
+    # Step all temperatures together, one day after another (in place, without temporary arrays)
+    # growth_rate = 0.01 * (a_fit * weight ** b_fit - c_avg), weight = weight * (1 + dt * growth_rate)
+    growth_rate = np.empty(len(temp_range), dtype=dtype)
+    metrics.count('cells_integrated', len(temp_range))
+    metrics.count('cell_days', len(temp_range) * (max_age * 365 - 1))
+    with metrics.span('kernel'):
+        for age in range(1, max_age * 365):
+            np.power(weight_at_age[age - 1], b_fit, out=growth_rate)
+            growth_rate *= a_fit
+            growth_rate -= c_avg
+            growth_rate *= 0.01
+            growth_rate *= dt
+            growth_rate += 1.
+            np.multiply(weight_at_age[age - 1], growth_rate, out=weight_at_age[age])
     df = pd.DataFrame(weight_at_age, columns=temp_range)
     df.index.name = 'day'
-    if not output.parent.exists():
-        output.parent.mkdir(parents=True)
-    df.to_csv(output)
-    logging.info(f'Saved results to {output.resolve()}')
-    logging.debug(f'{df}')
-    return None
+    if output is not None:
+        if not output.parent.exists():
+            output.parent.mkdir(parents=True)
+        with metrics.span('write_csv'):
+            df.to_csv(output)
+        metrics.count('bytes_written', output.stat().st_size)
+        logging.info(f'Saved results to {output.resolve()}')
+    # Formatting the whole table is slower than the computation, only do it for debug output
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f'{df}')
+    return df
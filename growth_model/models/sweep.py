@@ -0,0 +1,186 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides the sweep model setup: growth over one time step for every
+combination of temperature and initial weight
+"""
+
+import time
+import pathlib
+import logging
+
+import numpy as np
+
+from growth_model import metrics
+from growth_model.constants import C_AVG
+from growth_model.equations import equation2, equation3
+
+# Columns of the sweep result
+SWEEP_COLUMNS = ('temp', 'weight', 'a', 'b', 'growth_rate', 'final_weight')
+
+
+def sweep_values(values):
+    """
+    Values of a sweep dimension
+
+    @param values: single value, list or array, or range as dict with keys "min", "max" and "step"
+                   (the maximum is excluded as for model "one_dim")
+    @return: 1-D numpy array
+    """
+    if isinstance(values, dict):
+        try:
+            return np.arange(float(values['min']), float(values['max']), float(values['step']))
+        except KeyError as error:
+            raise ValueError(f'Range {values} needs the keys "min", "max" and "step"') from error
+    return np.atleast_1d(np.asarray(values))
+
+
+def growth_step(a, b, weight, dt=1, c_avg=C_AVG):
+    """
+    Relative growth rate and final weight over one time step
+
+    @param a: parameter a (Eq. 2 in Butzin and Poertner, 2016)
+    @param b: allometric exponent (-b of Eq. 3 for base, sweep and multi_dim)
+    @param weight: initial weights (g)
+    @param dt: time step (days)
+    @param c_avg: average cost of growth (see constants.C_AVG)
+    @return: tuple of (growth rate per day, final weight in g), broadcast against each other
+    """
+    growth_rate = 0.01 * (a * weight ** b - c_avg)
+    return growth_rate, weight * (1.0 + dt * growth_rate)
+
+
+def sweep_columns(temp, weight, dt=1, negative_b=True):
+    """
+    Evaluate growth over one time step for the Cartesian product of temperatures and initial weights
+
+    @param temp: temperatures (°C), see sweep_values()
+    @param weight: initial weights (g), see sweep_values()
+    @param dt: time step (e.g. if you calculate growth over 3 days -> dt = 3)
+    @param negative_b: use the negative allometric exponent -b like base and multi_dim,
+                       False uses b of Eq. 3 like one_temp and one_weight
+    @return: dict of 1-D numpy arrays by column name (SWEEP_COLUMNS), one row per (temperature, weight),
+             weights vary fastest
+    """
+    temps = sweep_values(temp)
+    weights = sweep_values(weight)
+    metrics.count('cells_integrated', len(temps) * len(weights))
+    metrics.count('cell_days', len(temps) * len(weights) * dt)
+
+    with metrics.span('kernel'):
+        # Parameters a and b only depend on temperature (Eq. 2 and 3 in Butzin and Poertner, 2016)
+        a = equation2(temps)
+        b = equation3(temps) * (-1.0 if negative_b else 1.0)
+
+        # Relative growth rate and weight (g) of every (temperature, weight) pair
+        growth_rate, final_weight = growth_step(a[:, np.newaxis], b[:, np.newaxis], weights[np.newaxis, :], dt)
+
+    return {'temp': temps.repeat(len(weights)),
+            'weight': np.tile(weights, len(temps)),
+            'a': a.repeat(len(weights)),
+            'b': b.repeat(len(weights)),
+            'growth_rate': growth_rate.ravel(),
+            'final_weight': final_weight.ravel()}
+
+
+def sweep_frame(temp, weight, dt=1, negative_b=True):
+    """
+    Evaluate growth over one time step for the Cartesian product of temperatures and initial weights
+
+    @param temp: temperatures (°C), see sweep_values()
+    @param weight: initial weights (g), see sweep_values()
+    @param dt: time step (e.g. if you calculate growth over 3 days -> dt = 3)
+    @param negative_b: use the exponent -b, see sweep_columns()
+    @return: pandas.DataFrame with columns SWEEP_COLUMNS (see sweep_columns())
+    """
+    # pandas is only imported by the models writing tables, single-point runs start faster without it
+    import pandas as pd
+
+    return pd.DataFrame(sweep_columns(temp, weight, dt, negative_b))
+
+
+def sweep(temp, weight, output: pathlib.Path, dt=1, chunk_rows: int = 1000000):
+    """
+    Compute growth rate and final weight for every combination of temperature and initial weight
+
+    Large sweeps are computed and written in chunks of whole temperatures, so memory does not depend
+    on the number of combinations. The output format follows the file suffix: ".parquet" (requires
+    pyarrow) or CSV.
+
+    @param temp: temperatures (°C), see sweep_values()
+    @param weight: initial weights (g), see sweep_values()
+    @param output: output file
+    @param dt: time step (e.g. if you calculate growth over 3 days -> dt = 3)
+    @param chunk_rows: maximum number of rows computed and written at once
+    @return: None
+    """
+    temps = sweep_values(temp)
+    weights = sweep_values(weight)
+    logging.info(f'Sweeping {len(temps)} temperatures x {len(weights)} weights')
+
+    begin_time = time.time()
+    if not output.parent.exists():
+        output.parent.mkdir(parents=True)
+
+    chunk_temps = max(1, chunk_rows // max(1, len(weights)))
+    sink = _ParquetSink(output) if output.suffix == '.parquet' else _CsvSink(output)
+    try:
+        for start in range(0, len(temps), chunk_temps):
+            sink.write(sweep_frame(temps[start:start + chunk_temps], weights, dt))
+    finally:
+        sink.close()
+
+    calc_time = time.time() - begin_time
+    logging.info(f'Calculated {len(temps) * len(weights)} rows over time: {round(calc_time, 3)} seconds')
+    logging.info(f'Saved results to {output.resolve()}')
+    return None
+
+
+class _CsvSink:
+    """
+    Append data frames to a CSV file
+    """
+
+    def __init__(self, output: pathlib.Path):
+        self.output = output
+        self.header = True
+
+    def write(self, df):
+        with metrics.span('write_csv'):
+            df.to_csv(self.output, mode='w' if self.header else 'a', header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        if not self.header:
+            metrics.count('bytes_written', self.output.stat().st_size)
+
+
+class _ParquetSink:
+    """
+    Append data frames as row groups to a Parquet file
+    """
+
+    def __init__(self, output: pathlib.Path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError('Writing Parquet files requires the package "pyarrow"') from error
+        self.output = output
+        self.pyarrow = pyarrow
+        self.writer = None
+
+    def write(self, df):
+        with metrics.span('write_parquet'):
+            table = self.pyarrow.Table.from_pandas(df, preserve_index=False)
+            if self.writer is None:
+                self.writer = self.pyarrow.parquet.ParquetWriter(self.output, table.schema)
+            self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            with metrics.span('write_parquet'):
+                self.writer.close()
+            metrics.count('bytes_written', self.output.stat().st_size)
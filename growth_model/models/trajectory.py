@@ -0,0 +1,454 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides the trajectory model setup: individuals moving through the 4-D temperature field
+- every individual has a daily position (depth, lat, lon), read from a file of tracks or advanced by a
+  built-in movement rule ("random_walk" or "stay")
+- the temperature of every individual and day is gathered from the monthly fields of the multi_dim input
+  data by trilinear interpolation, then the weight grows by one daily step as in model multi_dim
+- the population is stored as structure of arrays (one float32 array per property) and processed in
+  batches of individuals, memory of the temporary arrays depends on the batch size only
+
+A model year has 12 months of 30 days as in model multi_dim, day 0 of the tracks is January 1 of first_year.
+"""
+
+import time
+import pathlib
+import logging
+import itertools
+
+import netCDF4
+import numpy as np
+
+from growth_model import metrics
+from growth_model.backends import get_backend
+from growth_model.kernels import allocate_workspace, grow_day
+from growth_model.lookup import LUT_STEP, parameter_functions
+from growth_model.temperature import load_temperature, load_wet_points, open_input, require_monthly
+
+# Built-in movement rules
+MOVEMENTS = ('random_walk', 'stay')
+
+# Variables of the trajectory output, one value per year and individual
+TRAJECTORY_VARIABLES = ('weight', 'growth_rate', 'temp_mean', 'depth', 'lat', 'lon')
+
+DAYS_PER_MONTH = 30
+DAYS_PER_YEAR = 12 * DAYS_PER_MONTH
+KM_PER_DEGREE = 111.2
+
+
+class Population:
+    """
+    State of the individuals as structure of arrays: position, weight and growth rate (float32)
+    """
+
+    def __init__(self, depth, lat, lon, weight):
+        """
+        @param depth: depths of the individuals
+        @param lat: latitudes of the individuals
+        @param lon: longitudes of the individuals
+        @param weight: initial weights (g), a single value or one per individual
+        """
+        self.depth = np.array(depth, dtype='f')
+        self.lat = np.array(lat, dtype='f')
+        self.lon = np.array(lon, dtype='f')
+        self.weight = np.empty(len(self.depth), dtype='f')
+        self.weight[...] = weight
+        self.growth_rate = np.zeros(len(self.depth), dtype='f')
+
+    def __len__(self):
+        return len(self.weight)
+
+
+class Grid:
+    """
+    Coordinates of the temperature fields and trilinear interpolation within them
+    """
+
+    def __init__(self, depth: list, lat: list, lon: list):
+        """
+        @param depth: depth levels (ascending)
+        @param lat: latitudes (ascending)
+        @param lon: longitudes (ascending)
+        """
+        self.axes = [np.asarray(values, dtype='d') for values in (depth, lat, lon)]
+        for name, values in zip(('depth', 'lat', 'lon'), self.axes):
+            if len(values) > 1 and (np.diff(values) <= 0).any():
+                raise ValueError(f'Coordinates "{name}" must be ascending')
+        self.shape = tuple(len(values) for values in self.axes)
+
+    def clip(self, depth, lat, lon):
+        """
+        Limit positions to the grid (in place)
+
+        @return: None
+        """
+        for values, axis in zip((depth, lat, lon), self.axes):
+            np.clip(values, axis[0], axis[-1], out=values)
+
+    def corners(self, depth, lat, lon):
+        """
+        Flat indices and weights of the eight grid points around every position
+
+        Positions outside of the grid are moved to its boundary.
+
+        @return: list of (flat indices, weights) of the eight corners
+        """
+        lower, upper, fraction = [], [], []
+        for values, axis in zip((depth, lat, lon), self.axes):
+            values = np.asarray(values, dtype='d')
+            if len(axis) == 1:
+                index = np.zeros(values.shape, dtype=np.intp)
+                lower.append(index)
+                upper.append(index)
+                fraction.append(np.zeros(values.shape))
+                continue
+            index = np.clip(np.searchsorted(axis, values, side='right') - 1, 0, len(axis) - 2)
+            lower.append(index)
+            upper.append(index + 1)
+            fraction.append(np.clip((values - axis[index]) / (axis[index + 1] - axis[index]), 0., 1.))
+
+        corners = []
+        for corner in itertools.product((0, 1), repeat=3):
+            indices = [upper[axis] if side else lower[axis] for axis, side in enumerate(corner)]
+            weights = [fraction[axis] if side else 1. - fraction[axis] for axis, side in enumerate(corner)]
+            corners.append((np.ravel_multi_index(indices, self.shape), weights[0] * weights[1] * weights[2]))
+        return corners
+
+    def interpolate(self, field, depth, lat, lon):
+        """
+        Trilinear interpolation of a field at the positions, points without data (NaN) are left out
+
+        At grid points the result is the value of the field.
+
+        @param field: field (depth, lat, lon) with NaN on land
+        @param depth: depths
+        @param lat: latitudes
+        @param lon: longitudes
+        @return: float32 values, NaN where all eight surrounding points are NaN
+        """
+        flat = field.reshape(-1)
+        total = np.zeros(np.shape(depth))
+        weight_sum = np.zeros(np.shape(depth))
+        for indices, weights in self.corners(depth, lat, lon):
+            values = flat[indices]
+            valid = ~np.isnan(values)
+            total += np.where(valid, weights * values, 0.)
+            weight_sum += np.where(valid, weights, 0.)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (total / weight_sum).astype('f')
+
+
+class Tracks:
+    """
+    Daily positions of the individuals from a netCDF or CSV file
+
+    netCDF: variables "depth", "lat" and "lon" with dimensions (individual, day), read batch by batch.
+    CSV: columns individual, day, depth, lat and lon, loaded into memory (for small populations).
+    """
+
+    def __init__(self, filename: pathlib.Path):
+        """
+        @param filename: tracks file (.nc or .csv)
+        """
+        self.filename = pathlib.Path(filename)
+        self._dataset = None
+        self._positions = None
+        if self.filename.suffix == '.nc':
+            self._dataset = netCDF4.Dataset(self.filename)
+            missing = [name for name in ('depth', 'lat', 'lon') if name not in self._dataset.variables]
+            if missing:
+                raise ValueError(f'Tracks file {self.filename} misses the variables {missing}')
+            self.individuals, self.days = self._dataset['lat'].shape
+        else:
+            import pandas as pd
+
+            tracks = pd.read_csv(self.filename)
+            missing = [name for name in ('individual', 'day', 'depth', 'lat', 'lon') if name not in tracks]
+            if missing:
+                raise ValueError(f'Tracks file {self.filename} misses the columns {missing}')
+            ids, individual = np.unique(tracks['individual'].values, return_inverse=True)
+            day = tracks['day'].values.astype(int)
+            self.individuals, self.days = len(ids), int(day.max()) + 1
+            self._positions = np.full((3, self.individuals, self.days), np.nan, dtype='f')
+            for axis, name in enumerate(('depth', 'lat', 'lon')):
+                self._positions[axis, individual, day] = tracks[name].values
+        logging.info(f'Tracks of {self.individuals} individuals over {self.days} days in {self.filename}')
+
+    def read(self, start: int, stop: int, first_day: int, days: int):
+        """
+        Positions of the individuals start..stop-1 on the days first_day..first_day+days-1
+
+        @return: float32 array (3, individual, day) of depth, lat and lon
+        """
+        if first_day + days > self.days:
+            raise ValueError(f'Tracks in {self.filename} end on day {self.days - 1}, '
+                             f'the run needs day {first_day + days - 1}')
+        if self._positions is not None:
+            positions = self._positions[:, start:stop, first_day:first_day + days]
+        else:
+            positions = np.stack([np.ma.filled(self._dataset[name][start:stop, first_day:first_day + days]
+                                               .astype('f'), np.nan) for name in ('depth', 'lat', 'lon')])
+        if np.isnan(positions).any():
+            raise ValueError(f'Tracks in {self.filename} have no position for some individuals and days')
+        return positions
+
+    def close(self):
+        if self._dataset is not None:
+            self._dataset.close()
+
+
+class TrajectoryWriter:
+    """
+    Write the state of the individuals at the end of every year to a netCDF4 file with dimensions
+    (year, individual), batch by batch
+    """
+
+    def __init__(self, filename: pathlib.Path, individuals: int, complevel: int = 4, chunk_size: int = 100000):
+        """
+        @param filename: output file (.nc)
+        @param individuals: number of individuals
+        @param complevel: zlib compression level (0 disables compression)
+        @param chunk_size: number of individuals per chunk
+        """
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        self.filename = filename
+        self._dataset = netCDF4.Dataset(filename, mode='w', format='NETCDF4')
+        ds = self._dataset
+        ds.createDimension('year', None)
+        ds.createDimension('individual', individuals)
+        ds.createVariable('year', 'i4', ('year',))
+        ds['year'].long_name = 'state on January 1 of the year'
+        ds.createVariable('age', 'i4', ('year',))
+        ds['age'].units = 'years'
+        ds.createVariable('individual', 'i4', ('individual',))
+        ds['individual'][:] = np.arange(individuals)
+        compression = {'compression': 'zlib', 'complevel': complevel} if complevel else {}
+        for name in TRAJECTORY_VARIABLES:
+            ds.createVariable(name, 'f4', ('year', 'individual'), fill_value=np.float32(np.nan),
+                              chunksizes=(1, max(1, min(individuals, chunk_size))), **compression)
+        ds['weight'].units = 'g'
+        ds['temp_mean'].units = 'degC'
+        ds['temp_mean'].long_name = 'mean temperature of the year along the track'
+        for name in ('depth', 'lat', 'lon'):
+            ds[name].long_name = f'{name} at the end of the year'
+
+    def write(self, index: int, year: int, age: int, start: int, fields: dict):
+        """
+        Write the state of the individuals start.. at the end of a year
+
+        @param index: index of the year in the file
+        @param year: calendar year
+        @param age: age of the individuals at the end of the year
+        @param start: index of the first individual
+        @param fields: arrays of the individuals by variable name (TRAJECTORY_VARIABLES)
+        @return: None
+        """
+        with metrics.span('store_write'):
+            ds = self._dataset
+            ds['year'][index] = year
+            ds['age'][index] = age
+            for name, values in fields.items():
+                ds[name][index, start:start + len(values)] = values
+        metrics.count('bytes_written', sum(values.nbytes for values in fields.values()))
+
+    def close(self):
+        self._dataset.close()
+
+
+def initial_positions(input_files, grid: Grid, depth: list, lat: list, lon: list, first_year: int,
+                      final_year: int, individuals: int, rng):
+    """
+    Random positions at the wet grid points of the input data
+
+    @param input_files: input dataset with variable "thetao"
+    @param grid: Grid of the input selection
+    @param individuals: number of individuals
+    @param rng: numpy.random.Generator
+    @return: tuple of arrays (depth, lat, lon)
+    """
+    points = load_wet_points(input_files, first_year, final_year, depth, lat, lon)
+    if not len(points):
+        raise ValueError('The selected region has no wet points')
+    indices = np.unravel_index(rng.choice(points, size=individuals), grid.shape)
+    return tuple(axis[index] for axis, index in zip(grid.axes, indices))
+
+
+def trajectory(input_data: str, first_year: int, final_year: int, max_age: int, depth: list, lat: list,
+               lon: list, output: pathlib.Path, weight: float = 1., individuals: int = 1000,
+               movement: str = 'random_walk', tracks: str = None, start_positions: str = None,
+               step_km: float = 5., step_depth: float = 2., seed: int = None, batch_size: int = 50000,
+               parameter_engine: str = 'exact', lut_step: float = LUT_STEP, output_complevel: int = 4,
+               kernel_backend: str = 'numpy'):
+    """
+    Grow individuals moving through the temperature field of the input data
+
+    Individuals are born on January 1 of first_year and followed for max_age years (at most until
+    final_year). Days on land (no temperature around the position) leave the weight unchanged.
+
+    @param input_data: input folder (reads *.nc - files, see model multi_dim)
+    @param first_year: first year
+    @param final_year: last year
+    @param max_age: maximum age of individual (years)
+    @param depth: depth levels of the temperature fields the individuals move in
+    @param lat: latitudes of the temperature fields
+    @param lon: longitudes of the temperature fields
+    @param output: output file (.nc) with the state of every individual at the end of every year
+    @param weight: initial weight (g)
+    @param individuals: number of individuals (without tracks and start_positions)
+    @param movement: built-in movement rule (without tracks): "random_walk" (normally distributed daily
+                     steps, moves onto land are rejected) or "stay"
+    @param tracks: file of daily positions (see Tracks), replaces movement, individuals and start_positions
+    @param start_positions: CSV file with columns depth, lat, lon (and optionally weight) of every individual,
+                            by default the individuals start at random wet grid points
+    @param step_km: standard deviation of the daily horizontal steps of "random_walk" (km)
+    @param step_depth: standard deviation of the daily vertical steps of "random_walk" (m)
+    @param seed: seed of the random numbers, None draws a seed (logged)
+    @param batch_size: number of individuals processed at once
+    @param parameter_engine: "exact" or "lut" (see lookup.parameter_functions())
+    @param lut_step: temperature step (K) of the lookup tables
+    @param output_complevel: zlib compression level of the output (0 disables compression)
+    @param kernel_backend: compute backend of a, b and the daily steps, "numpy", "numexpr", "numba" or "auto"
+                           (see backends.py)
+    @return: None
+    """
+    if movement not in MOVEMENTS:
+        raise ValueError(f'movement must be one of {MOVEMENTS}, got "{movement}"')
+    last_year = min(final_year, first_year + max_age - 1)
+    if last_year < first_year:
+        raise ValueError(f'No year to simulate: first_year {first_year}, final_year {final_year}')
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+        logging.info(f'Random seed: {seed}')
+    rng = np.random.default_rng(seed)
+    grid = Grid(depth, lat, lon)
+    backend = get_backend(kernel_backend)
+    a_function, b_function = parameter_functions(parameter_engine, lut_step, backend)
+
+    begin_time = time.time()
+    input_files = open_input(input_data, first_year, final_year)
+    require_monthly(input_files, first_year, final_year, 'Model "trajectory"')
+    track_file = Tracks(tracks) if tracks else None
+    if track_file is not None:
+        population = Population(*track_file.read(0, track_file.individuals, 0, 1)[:, :, 0], weight)
+    elif start_positions:
+        import pandas as pd
+
+        starts = pd.read_csv(start_positions)
+        population = Population(starts['depth'].values, starts['lat'].values, starts['lon'].values,
+                                starts['weight'].values if 'weight' in starts else weight)
+    else:
+        population = Population(*initial_positions(input_files, grid, depth, lat, lon, first_year, final_year,
+                                                   individuals, rng), weight)
+    logging.info(f'Following {len(population)} individuals from {first_year} to {last_year} '
+                 f'({"tracks " + str(tracks) if track_file is not None else movement}), batches of {batch_size}')
+
+    writer = TrajectoryWriter(output, len(population), output_complevel)
+    batch_size = max(1, batch_size)
+    try:
+        for index, year in enumerate(range(first_year, last_year + 1)):
+            # Monthly temperature fields of the year (month, depth, lat, lon), shared by all batches
+            fields = load_temperature(input_files, year, depth, lat, lon).reshape((12,) + grid.shape)
+            for start in range(0, len(population), batch_size):
+                stop = min(start + batch_size, len(population))
+                positions = track_file.read(start, stop, index * DAYS_PER_YEAR, DAYS_PER_YEAR) \
+                    if track_file is not None else None
+                batch_rng = np.random.default_rng([seed, year, start])
+                temp_mean = _run_batch(population, slice(start, stop), fields, grid, a_function, b_function,
+                                       positions, movement, step_km, step_depth, batch_rng, backend.grow_day)
+                writer.write(index, year + 1, index + 1, start, {
+                    'weight': population.weight[start:stop], 'growth_rate': population.growth_rate[start:stop],
+                    'temp_mean': temp_mean, 'depth': population.depth[start:stop],
+                    'lat': population.lat[start:stop], 'lon': population.lon[start:stop]})
+            logging.debug(f'Completed year {year}')
+    finally:
+        writer.close()
+        if track_file is not None:
+            track_file.close()
+
+    calc_time = time.time() - begin_time
+    individual_days = len(population) * (last_year - first_year + 1) * DAYS_PER_YEAR
+    logging.info(f'Calculated {individual_days} individual-days over time: {round(calc_time, 3)} seconds')
+    logging.info(f'Saved results to {output.resolve()}')
+    return None
+
+
+def _run_batch(population: Population, batch: slice, fields, grid: Grid, a_function, b_function, positions,
+               movement: str, step_km: float, step_depth: float, rng, grow=grow_day):
+    """
+    Advance a batch of individuals by one year of daily steps (in place)
+
+    @param population: Population
+    @param batch: slice of the individuals
+    @param fields: monthly temperature fields (month, depth, lat, lon)
+    @param grid: Grid of the fields
+    @param a_function: function of parameter "a"
+    @param b_function: function of exponent "b"
+    @param positions: tracks (3, individual, day) or None for the movement rule
+    @param movement: movement rule (without tracks)
+    @param step_km: standard deviation of the horizontal steps of "random_walk" (km)
+    @param step_depth: standard deviation of the vertical steps of "random_walk" (m)
+    @param rng: numpy.random.Generator
+    @param grow: function of the daily step, see kernels.grow_day()
+    @return: mean temperature of every individual over the days with temperature data
+    """
+    depth, lat, lon = population.depth[batch], population.lat[batch], population.lon[batch]
+    weight, growth_rates = population.weight[batch], population.growth_rate[batch]
+    size = len(weight)
+    a = np.zeros(size, dtype='f')
+    b = np.zeros(size, dtype='f')
+    workspace = allocate_workspace(size)
+    temp_sum = np.zeros(size)
+    temp_days = np.zeros(size, dtype=int)
+    metrics.count('cells_integrated', size)
+    metrics.count('cell_days', size * DAYS_PER_YEAR)
+
+    with metrics.span('kernel'):
+        for day in range(DAYS_PER_YEAR):
+            field = fields[day // DAYS_PER_MONTH]
+            if positions is not None:
+                depth[...], lat[...], lon[...] = positions[:, :, day]
+                temp = grid.interpolate(field, depth, lat, lon)
+            elif movement == 'random_walk':
+                temp = _random_walk(field, grid, depth, lat, lon, step_km, step_depth, rng)
+            elif day % DAYS_PER_MONTH == 0:
+                # Individuals stay: temperature, a and b only change with the month
+                temp = grid.interpolate(field, depth, lat, lon)
+            else:
+                temp = None
+            if temp is not None:
+                valid = ~np.isnan(temp)
+                a[...] = a_function(temp)
+                b[...] = b_function(temp) * (-1.)
+                # No temperature data: no growth (a = 0, b = 0 give a negative growth rate, which is set to 0)
+                a[~valid] = 0.
+                b[~valid] = 0.
+                valid_temp = np.where(valid, temp, 0.)
+            grow(weight, growth_rates, a, b, 1, workspace)
+            temp_sum += valid_temp
+            temp_days += valid
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (temp_sum / temp_days).astype('f')
+
+
+def _random_walk(field, grid: Grid, depth, lat, lon, step_km: float, step_depth: float, rng):
+    """
+    Move the individuals by one normally distributed daily step (in place), moves to positions without
+    temperature data are rejected
+
+    @return: temperatures at the new positions
+    """
+    new_lat = lat + rng.normal(0., step_km / KM_PER_DEGREE, size=len(lat)).astype('f')
+    new_lon = lon + (rng.normal(0., step_km / KM_PER_DEGREE, size=len(lon))
+                     / np.cos(np.radians(lat))).astype('f')
+    new_depth = depth + rng.normal(0., step_depth, size=len(depth)).astype('f')
+    grid.clip(new_depth, new_lat, new_lon)
+    temp = grid.interpolate(field, new_depth, new_lat, new_lon)
+    moved = ~np.isnan(temp)
+    depth[moved], lat[moved], lon[moved] = new_depth[moved], new_lat[moved], new_lon[moved]
+    if not moved.all():
+        stayed = ~moved
+        temp[stayed] = grid.interpolate(field, depth[stayed], lat[stayed], lon[stayed])
+    return temp
@@ -0,0 +1,657 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides writers for the multi_dim model output:
+- "netcdf": one netCDF file per variable, year and age (see utils.save_netcdf())
+- "store": one chunked and compressed netCDF4 file per run with cohort and age dimensions
+- an in-memory writer assembling an xarray Dataset with cohort and age dimensions
+- a background writer that overlaps writing with the computation
+- summaries reduced from the fields while they are written (see reductions.ReductionWriter)
+"""
+
+import time
+import queue
+import collections
+import pathlib
+import logging
+import threading
+
+import netCDF4
+import numpy as np
+import xarray as xr
+
+from growth_model import metrics
+from growth_model.utils import NETCDF_LOCK, netcdf_filename, save_netcdf
+
+# Output variables, each is stored in a sub folder of the same name (output format "netcdf")
+OUTPUT_VARIABLES = ('a_3d', 'b_3d', 'growth_rates_3d', 'weight_3d', 'weight_max')
+
+OUTPUT_FORMATS = ('netcdf', 'store')
+
+# Variables without depth dimension
+SURFACE_VARIABLES = ('weight_max',)
+
+
+def select_variables(variables=None):
+    """
+    Check a selection of output variables
+
+    @param variables: names of output variables, None for all
+    @return: tuple of the selected variables in the order of OUTPUT_VARIABLES
+    """
+    if variables is None:
+        return OUTPUT_VARIABLES
+    unknown = [var_name for var_name in variables if var_name not in OUTPUT_VARIABLES]
+    if unknown:
+        raise ValueError(f'Unknown output variables {unknown}, expected some of {OUTPUT_VARIABLES}')
+    return tuple(var_name for var_name in OUTPUT_VARIABLES if var_name in variables)
+
+
+def _dimension_labels(var_name: str):
+    """
+    @param var_name: output variable
+    @return: tuple of the grid dimensions of the variable
+    """
+    if var_name in SURFACE_VARIABLES:
+        return 'latitude', 'longitude'
+    return 'depth_coord', 'latitude', 'longitude'
+
+
+class FileWriter:
+    """
+    Write every variable, year and age to a separate netCDF file
+
+    If a region is given, the fields only cover the (lat, lon) sub grid region of the output grid.
+    The files of the whole grid are created before the regions are written (see create_grids(), otherwise
+    by the first writer of a file), every writer fills its own region of files with the same grid.
+    """
+
+    def __init__(self, output_dir: pathlib.Path, depth: list, lat: list, lon: list,
+                 region: tuple = None, lock=None, variables=None):
+        """
+        @param output_dir: output folder of the experiment and region
+        @param depth: depth levels
+        @param lat: latitudes
+        @param lon: longitudes
+        @param region: (lat slice, lon slice) of the fields within the output grid
+        @param lock: lock shared by all writers of a region (e.g. multiprocessing.Manager().Lock())
+        @param variables: written output variables, None for all (other fields are skipped)
+        """
+        self.output_dir = output_dir
+        self.depth = depth
+        self.lat = lat
+        self.lon = lon
+        self.region = region
+        self.lock = lock if lock is not None else threading.Lock()
+        self.variables = select_variables(variables)
+        for var_name in self.variables:
+            output_dir.joinpath(var_name).mkdir(parents=True, exist_ok=True)
+
+    def write(self, year: int, age: int, fields: dict):
+        """
+        Write the output fields of one cohort and year
+
+        @param year: year of the output
+        @param age: age of the cohort (years)
+        @param fields: gridded fields by variable name
+        @return: None
+        """
+        for var_name, data in fields.items():
+            if var_name not in self.variables:
+                continue
+            directory = self.output_dir.joinpath(var_name)
+            if self.region is None:
+                save_netcdf(data=data, var_name=var_name, directory=directory,
+                            year=year, age=age, depths=self.depth, lat=self.lat, lon=self.lon,
+                            dimension_labels=_dimension_labels(var_name))
+                continue
+
+            filename = netcdf_filename(directory, var_name, year, age)
+            with self.lock:
+                if not filename.exists():
+                    self._create_grid(var_name, year, age)
+                with metrics.span('save_netcdf'), netCDF4.Dataset(filename, mode='a') as ds:
+                    self._check_grid(ds, var_name, filename)
+                    ds[var_name][(Ellipsis,) + self.region] = data
+                metrics.count('bytes_written', data.nbytes)
+
+    def create_grids(self, cohorts, max_age: int):
+        """
+        Create the files of the whole grid (NaN) of all ages of cohorts, which the writers of the regions fill
+
+        Existing files of the same name (e.g. of an earlier run on another grid) are replaced.
+
+        @param cohorts: birth years of the cohorts
+        @param max_age: maximum age of fish (in years)
+        @return: None
+        """
+        with self.lock:
+            for cohort in cohorts:
+                for age in range(1, max_age + 1):
+                    for var_name in self.variables:
+                        self._create_grid(var_name, cohort + age, age)
+
+    def _create_grid(self, var_name: str, year: int, age: int):
+        """
+        Write the file of a variable, year and age for the whole grid filled with NaN
+        """
+        dimension_labels = _dimension_labels(var_name)
+        shape = (len(self.depth), len(self.lat), len(self.lon))[-len(dimension_labels):]
+        save_netcdf(data=np.full(shape, np.nan, dtype='f'), var_name=var_name,
+                    directory=self.output_dir.joinpath(var_name), year=year, age=age, depths=self.depth,
+                    lat=self.lat, lon=self.lon, dimension_labels=dimension_labels)
+
+    def _check_grid(self, ds, var_name: str, filename: pathlib.Path):
+        """
+        Check that an existing file covers the grid of the writer, regions of another grid would mix with
+        stale data
+
+        @param ds: netCDF4.Dataset of the file
+        @return: None
+        """
+        coords = {'depth_coord': self.depth, 'latitude': self.lat, 'longitude': self.lon}
+        for dim in _dimension_labels(var_name):
+            if dim not in ds.variables or not np.array_equal(np.asarray(ds[dim][:], dtype='d'),
+                                                             np.asarray(coords[dim], dtype='d')):
+                raise ValueError(f'The output file {filename} has another {dim} grid than the run, '
+                                 f'remove it or write to a new output folder')
+
+    def flush(self):
+        """
+        Nothing to do, every file is closed after writing
+
+        @return: None
+        """
+        return None
+
+    def pending(self):
+        """
+        Nothing pending, every file is written when write() returns
+
+        @return: empty list
+        """
+        return []
+
+    def close(self):
+        """
+        Nothing to do, every file is closed after writing
+
+        @return: None
+        """
+        return None
+
+
+class StoreWriter:
+    """
+    Append all output fields to a single chunked and compressed netCDF4 file
+
+    Variables have the dimensions (cohort, age, depth_coord, latitude, longitude), where cohort is the
+    birth year of the individuals; the output of a cohort at a given age belongs to year cohort + age.
+    Without region the writer creates the file (or opens it to append) and keeps it open. With region
+    the file must exist, it is opened for every write and only the (lat, lon) region is filled.
+    """
+
+    def __init__(self, filename: pathlib.Path, depth: list, lat: list, lon: list, max_age: int,
+                 first_cohort: int, complevel: int = 4, chunks: dict = None, region: tuple = None, lock=None,
+                 append: bool = False, variables=None):
+        """
+        @param filename: output file
+        @param depth: depth levels
+        @param lat: latitudes
+        @param lon: longitudes
+        @param max_age: maximum age of fish (in years)
+        @param first_cohort: birth year of the first cohort (index 0 of the cohort dimension)
+        @param complevel: zlib compression level (0 disables compression)
+        @param chunks: chunk sizes by dimension name, missing dimensions are stored as
+                       one chunk (depth_coord, latitude, longitude) or chunk size 1 (cohort, age)
+        @param region: (lat slice, lon slice) of the fields within the output grid
+        @param lock: lock shared by all writers of a region (e.g. multiprocessing.Manager().Lock())
+        @param append: keep an existing file and its first cohort (resumed and incremental runs)
+        @param variables: written output variables, None for all (other fields are skipped)
+        """
+        self.filename = filename
+        self.first_cohort = first_cohort
+        self.region = region
+        self.lock = lock if lock is not None else threading.Lock()
+        self.variables = select_variables(variables)
+        self._dataset = None
+        if append and filename.exists():
+            with self.lock, netCDF4.Dataset(filename, mode='r') as ds:
+                self.first_cohort = int(ds.first_cohort)
+                missing = [var_name for var_name in self.variables if var_name not in ds.variables]
+            if missing:
+                raise ValueError(f'The output store {filename} has no variables {missing}, '
+                                 f'write the selected variables to a new output folder')
+            if region is None:
+                self._dataset = netCDF4.Dataset(filename, mode='a')
+            return
+        if region is not None:
+            return
+
+        # Dimension sizes (cohort is unlimited) and default chunk sizes
+        limits = {'cohort': None, 'age': max_age, 'depth_coord': len(depth), 'latitude': len(lat), 'longitude': len(lon)}
+        chunk_sizes = {'cohort': 1, 'age': 1, 'depth_coord': len(depth), 'latitude': len(lat), 'longitude': len(lon)}
+        for dim, size in (chunks or {}).items():
+            if dim not in limits:
+                raise ValueError(f'Unknown output chunk dimension "{dim}", expected one of {list(limits)}')
+            chunk_sizes[dim] = max(1, int(size) if limits[dim] is None else min(int(size), limits[dim]))
+
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        self._dataset = netCDF4.Dataset(filename, mode='w', format='NETCDF4')
+        ds = self._dataset
+        ds.first_cohort = first_cohort
+        ds.createDimension('cohort', None)
+        ds.createDimension('age', max_age)
+        ds.createDimension('depth_coord', len(depth))
+        ds.createDimension('latitude', len(lat))
+        ds.createDimension('longitude', len(lon))
+
+        ds.createVariable('cohort', 'i4', ('cohort',))
+        ds['cohort'].long_name = 'birth year'
+        ds.createVariable('age', 'i4', ('age',))
+        ds['age'][:] = np.arange(1, max_age + 1)
+        ds['age'].units = 'years'
+        for name, values in (('depth_coord', depth), ('latitude', lat), ('longitude', lon)):
+            ds.createVariable(name, 'f8', (name,))
+            ds[name][:] = values
+
+        compression = {'compression': 'zlib', 'complevel': complevel} if complevel else {}
+        for var_name in self.variables:
+            if var_name in SURFACE_VARIABLES:
+                dims = ('cohort', 'age', 'latitude', 'longitude')
+            else:
+                dims = ('cohort', 'age', 'depth_coord', 'latitude', 'longitude')
+            ds.createVariable(var_name, 'f4', dims, fill_value=np.float32(np.nan),
+                              chunksizes=[chunk_sizes[dim] for dim in dims], **compression)
+
+    def write(self, year: int, age: int, fields: dict):
+        """
+        Write the output fields of one cohort and year
+
+        @param year: year of the output
+        @param age: age of the cohort (years)
+        @param fields: gridded fields by variable name
+        @return: None
+        """
+        cohort = year - age
+        index = cohort - self.first_cohort
+        if index < 0:
+            raise ValueError(f'Cohort {cohort} is older than the first cohort {self.first_cohort} of the output '
+                             f'store {self.filename}, write to a new output folder')
+        fields = {var_name: data for var_name, data in fields.items() if var_name in self.variables}
+        with metrics.span('store_write'):
+            if self.region is None:
+                self._write(self._dataset, index, cohort, age, fields, ())
+                self._dataset.sync()
+            else:
+                with self.lock, netCDF4.Dataset(self.filename, mode='a') as ds:
+                    self._write(ds, index, cohort, age, fields, self.region)
+        metrics.count('bytes_written', sum(data.nbytes for data in fields.values()))
+
+    @staticmethod
+    def _write(ds, index, cohort, age, fields, region):
+        ds['cohort'][index] = cohort
+        for var_name, data in fields.items():
+            ds[var_name][(index, age - 1, Ellipsis) + region] = data
+
+    def flush(self):
+        """
+        Nothing to do, every write is synced
+
+        @return: None
+        """
+        return None
+
+    def pending(self):
+        """
+        Nothing pending, every write is synced when write() returns
+
+        @return: empty list
+        """
+        return []
+
+    def close(self):
+        """
+        Close the output file
+
+        @return: None
+        """
+        if self._dataset is not None:
+            self._dataset.close()
+        logging.debug(f'Closed output store {self.filename}')
+
+
+def cohort_stored(filename: pathlib.Path, cohort: int, max_age: int, variables=OUTPUT_VARIABLES):
+    """
+    Check that the output store holds all ages of a cohort
+
+    @param filename: output store (see StoreWriter)
+    @param cohort: birth year
+    @param max_age: maximum age of fish (in years)
+    @param variables: output variables
+    @return: bool
+    """
+    if not filename.exists():
+        return False
+    with netCDF4.Dataset(filename, mode='r') as ds:
+        index = cohort - int(ds.first_cohort)
+        if not 0 <= index < len(ds.dimensions['cohort']) or ds['cohort'][index] is np.ma.masked:
+            return False
+        if int(ds['cohort'][index]) != cohort or len(ds.dimensions['age']) != max_age:
+            return False
+        # The last age of a cohort is written last, fields that were not written are NaN
+        return all(var_name in ds.variables
+                   and not np.isnan(np.ma.filled(ds[var_name][index, max_age - 1], np.nan)).all()
+                   for var_name in variables)
+
+
+class MemoryWriter:
+    """
+    Keep all output fields in memory, arranged like the output store
+
+    Every variable is one preallocated array with the dimensions (cohort, age, depth_coord, latitude,
+    longitude); cohort-years that were not written stay NaN. dataset() wraps the arrays without copying.
+    multi_dim_dataset() uses one writer per cohort for the chunks of its lazy Dataset.
+    """
+
+    def __init__(self, depth: list, lat: list, lon: list, max_age: int, cohorts: list):
+        """
+        @param depth: depth levels
+        @param lat: latitudes
+        @param lon: longitudes
+        @param max_age: maximum age of fish (in years)
+        @param cohorts: consecutive birth years of the cohorts
+        """
+        self.depth = depth
+        self.lat = lat
+        self.lon = lon
+        self.cohorts = list(cohorts)
+        self.ages = list(range(1, max_age + 1))
+        self.arrays = {}
+        for var_name in OUTPUT_VARIABLES:
+            shape = (len(self.cohorts), max_age, len(depth), len(lat), len(lon))
+            if var_name in SURFACE_VARIABLES:
+                shape = shape[:2] + shape[3:]
+            self.arrays[var_name] = np.full(shape, np.nan, dtype='f')
+
+    def write(self, year: int, age: int, fields: dict):
+        """
+        Copy the output fields of one cohort and year
+
+        @param year: year of the output
+        @param age: age of the cohort (years)
+        @param fields: gridded fields by variable name
+        @return: None
+        """
+        index = year - age - self.cohorts[0]
+        for var_name, data in fields.items():
+            self.arrays[var_name][index, age - 1] = data
+
+    def flush(self):
+        """
+        Nothing to do, fields are copied when written
+
+        @return: None
+        """
+        return None
+
+    def pending(self):
+        """
+        Nothing pending, fields are copied when written
+
+        @return: empty list
+        """
+        return []
+
+    def close(self):
+        """
+        Nothing to do, the arrays are kept for dataset()
+
+        @return: None
+        """
+        return None
+
+    def dataset(self):
+        """
+        Output fields as Dataset (the arrays are not copied)
+
+        @return: xarray.Dataset, see cohort_dataset()
+        """
+        return cohort_dataset(self.arrays, self.cohorts, self.ages, self.depth, self.lat, self.lon)
+
+
+def cohort_dataset(arrays: dict, cohorts: list, ages: list, depth: list, lat: list, lon: list):
+    """
+    Dataset of output fields arranged like the output store
+
+    @param arrays: numpy or dask arrays (cohort, age, depth, lat, lon) or (cohort, age, lat, lon) by variable name
+    @param cohorts: birth years of the cohorts
+    @param ages: ages of the cohorts (years)
+    @param depth: depth levels
+    @param lat: latitudes
+    @param lon: longitudes
+    @return: xarray.Dataset with coordinates cohort (birth year), age, depth_coord, latitude, longitude
+             and year (cohort + age)
+    """
+    data_vars = {}
+    for var_name, values in arrays.items():
+        if var_name in SURFACE_VARIABLES:
+            dims = ('cohort', 'age', 'latitude', 'longitude')
+        else:
+            dims = ('cohort', 'age', 'depth_coord', 'latitude', 'longitude')
+        data_vars[var_name] = (dims, values)
+    cohorts = np.array(cohorts, dtype=int)
+    ages = np.array(ages, dtype=int)
+    ds = xr.Dataset(data_vars, coords={'cohort': cohorts, 'age': ages, 'depth_coord': depth, 'latitude': lat,
+                                       'longitude': lon, 'year': (('cohort', 'age'), cohorts[:, np.newaxis] + ages)})
+    ds['cohort'].attrs['long_name'] = 'birth year'
+    ds['age'].attrs['units'] = 'years'
+    return ds
+
+
+class TeeWriter:
+    """
+    Pass the output to several writers, e.g. keep it in memory and write it to files
+    """
+
+    def __init__(self, *writers):
+        """
+        @param writers: writers with methods write(year, age, fields), flush(), pending() and close()
+        """
+        self.writers = writers
+
+    def write(self, year: int, age: int, fields: dict):
+        for writer in self.writers:
+            writer.write(year, age, fields)
+
+    def flush(self):
+        for writer in self.writers:
+            writer.flush()
+
+    def pending(self):
+        # Items pending in any of the writers, in the order of the writers
+        return [item for writer in self.writers for item in writer.pending()]
+
+    def close(self):
+        # Close every writer, even if one of them fails
+        errors = []
+        for writer in self.writers:
+            try:
+                writer.close()
+            except BaseException as error:
+                errors.append(error)
+        if errors:
+            raise errors[0]
+
+
+class AsyncWriter:
+    """
+    Write output in a background thread while the model continues computing
+
+    Fields are copied when submitted, so the caller may reuse its buffers. The queue is bounded:
+    write() blocks if queue_size items are pending. An error in the background thread is raised
+    by the next call of write() or close(). flush() does not wait for the pending items, pending()
+    returns them (e.g. to save them with a checkpoint, see checkpoint.Checkpoint.save()).
+    The netCDF/HDF5 libraries are not thread-safe, writes hold utils.NETCDF_LOCK, which is also
+    held while reading input data.
+    """
+
+    def __init__(self, writer, queue_size: int = 4):
+        """
+        @param writer: writer with methods write(year, age, fields), flush() and close()
+        @param queue_size: maximum number of pending items
+        """
+        self.writer = writer
+        self.items = 0
+        self.write_time = 0.
+        self.wait_time = 0.
+        self._error = None
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        # Items submitted and not yet written (queued or being written), in the order of submission
+        self._pending = collections.deque()
+        self._pending_lock = threading.Lock()
+        self._flush = threading.Event()
+        self._thread = threading.Thread(target=self._work, name='growth_model-writer', daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            # Keep draining the queue after an error, so the producer never blocks
+            if self._error is None:
+                begin_time = time.perf_counter()
+                try:
+                    with NETCDF_LOCK:
+                        self.writer.write(*item)
+                        if self._flush.is_set():
+                            self._flush.clear()
+                            self.writer.flush()
+                except BaseException as error:
+                    self._error = error
+                self.write_time += time.perf_counter() - begin_time
+                self.items += 1
+            with self._pending_lock:
+                self._pending.popleft()
+            self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, year: int, age: int, fields: dict):
+        """
+        Submit the output fields of one cohort and year
+
+        @param year: year of the output
+        @param age: age of the cohort (years)
+        @param fields: gridded fields by variable name
+        @return: None
+        """
+        self._raise_error()
+        item = (year, age, {var_name: np.array(data) for var_name, data in fields.items()})
+        with self._pending_lock:
+            self._pending.append(item)
+        begin_time = time.perf_counter()
+        self._queue.put(item)
+        self.wait_time += time.perf_counter() - begin_time
+
+    def flush(self):
+        """
+        Flush the underlying writer in the background after the next written item (or when it is closed),
+        without waiting for the pending items
+
+        @return: None
+        """
+        self._raise_error()
+        self._flush.set()
+
+    def pending(self):
+        """
+        Items submitted and not yet written
+
+        @return: list of (year, age, fields) in the order of submission
+        """
+        with self._pending_lock:
+            return list(self._pending)
+
+    def close(self):
+        """
+        Wait for all pending items, then close the underlying writer
+
+        @return: None
+        """
+        begin_time = time.perf_counter()
+        self._queue.put(None)
+        self._thread.join()
+        self.wait_time += time.perf_counter() - begin_time
+        try:
+            self._raise_error()
+        finally:
+            self.writer.close()
+        logging.info(f'Output: {self.items} writes took {round(self.write_time, 3)} seconds, '
+                     f'{round(self.hidden_time, 3)} seconds hidden behind computation')
+
+    @property
+    def hidden_time(self):
+        """
+        Time spent writing while the model was computing (seconds)
+        """
+        return max(0., self.write_time - self.wait_time)
+
+
+def create_writer(output_format: str, output_dir: pathlib.Path, depth: list, lat: list, lon: list,
+                  max_age: int, first_cohort: int, name: str = 'growth_model', complevel: int = 4,
+                  chunks: dict = None, asynchronous: bool = False, queue_size: int = 4,
+                  region: tuple = None, lock=None, append: bool = False, variables=None, reductions=None):
+    """
+    Create the writer for the multi_dim model output
+
+    @param output_format: "netcdf" (one file per variable, year and age) or "store" (one file per run)
+    @param output_dir: output folder of the experiment and region
+    @param depth: depth levels
+    @param lat: latitudes
+    @param lon: longitudes
+    @param max_age: maximum age of fish (in years)
+    @param first_cohort: birth year of the first cohort
+    @param name: file name (without suffix) of the output store
+    @param complevel: compression level of the output store
+    @param chunks: chunk sizes of the output store by dimension name
+    @param asynchronous: write in a background thread (see AsyncWriter), reductions are computed while writing
+    @param queue_size: maximum number of pending items of the background writer
+    @param region: (lat slice, lon slice) of the fields within the output grid, the output store must exist
+    @param lock: lock shared by all writers of a region
+    @param append: keep an existing output store (resumed and incremental runs)
+    @param variables: output variables written in output_format, None for all, empty writes only the summaries
+    @param reductions: settings of the summaries reduced from the output (see reductions.parse_reductions()),
+                       written to "<name>_summary.nc" in output_dir when the writer is closed
+    @return: writer with methods write(year, age, fields), flush(), pending() and close()
+    """
+    from growth_model.reductions import STATE_NAME, SUMMARY_SUFFIX, ReductionWriter, parse_reductions
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output_format "{output_format}", expected one of {OUTPUT_FORMATS}')
+    variables = select_variables(variables)
+    if not variables and not reductions:
+        raise ValueError('No output: select output variables or add reductions')
+    if reductions and region is not None:
+        raise ValueError('Reductions summarize the whole grid, they cannot be computed by regions (tiles)')
+    writers = []
+    if variables and output_format == 'netcdf':
+        writers.append(FileWriter(output_dir, depth, lat, lon, region=region, lock=lock, variables=variables))
+    elif variables:
+        writers.append(StoreWriter(output_dir.joinpath(name + '.nc'), depth, lat, lon, max_age, first_cohort,
+                                   complevel=complevel, chunks=chunks, region=region, lock=lock, append=append,
+                                   variables=variables))
+    if writers and asynchronous:
+        writers[0] = AsyncWriter(writers[0], queue_size=queue_size)
+    if reductions:
+        # Reduced in the calling thread, so the running summaries cover every submitted cohort-year
+        # when a checkpoint is saved
+        writers.append(ReductionWriter(parse_reductions(reductions, depth, lat, lon, max_age),
+                                       output_dir.joinpath(name + SUMMARY_SUFFIX + '.nc'), max_age,
+                                       state_file=output_dir.joinpath(STATE_NAME), append=append))
+    return writers[0] if len(writers) == 1 else TeeWriter(*writers)
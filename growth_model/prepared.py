@@ -0,0 +1,373 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides prepared input of the multi_dim model: the temperatures selected by a config file
+(years, depth, lat, lon) are extracted once from the netCDF input into an uncompressed binary cache
+- float32 array (time step, depth, cell) with NaN on masked points in a .npy file, memory-mapped read-only
+  by later runs (no decoding, no selection, no copy for runs of the same selection with compact_wet_points = false)
+- wet points of every year in a second .npy file
+- float32 array (time step, point) of the points that are wet in any year of the cache in a third .npy file,
+  runs of the same selection with compact_wet_points = true read it without a copy
+- a JSON header with the selection, the time axis and the content hashes of the input of every year
+
+Runs use a prepared cache whose selection and years cover theirs. The cache is keyed by a hash of the
+selection and the input files, it is ignored as soon as an input file of its years changes
+(see manifest.load_manifest()) and removed by the next prepare of the same selection.
+
+Usage: cod-growth-model prepare CONFIG [CONFIG ...] [--directory DIR] [--time-chunk-steps N]
+"""
+
+import os
+import sys
+import json
+import time
+import pathlib
+import logging
+import argparse
+
+import numpy as np
+
+from growth_model import metrics
+from growth_model.checkpoint import fingerprint
+from growth_model.manifest import select_files, year_hashes
+
+# Folder of the prepared caches in the input folder (unless another directory is given)
+PREPARED_DIR = '.growth_model_prepared'
+PREPARED_VERSION = 2
+
+
+def prepared_directory(input_data: str, directory: str = None):
+    """
+    @param input_data: input folder
+    @param directory: folder of the prepared caches, None for PREPARED_DIR in the input folder
+    @return: pathlib.Path
+    """
+    return pathlib.Path(directory) if directory else pathlib.Path(input_data).joinpath(PREPARED_DIR)
+
+
+def prepare(input_data: str, first_year: int, final_year: int, depth: list, lat: list, lon: list,
+            directory: str = None, chunk_steps: int = 0):
+    """
+    Extract the temperatures of a selection into a prepared cache, an up-to-date cache is kept
+
+    Out-of-date caches of the same selection are removed.
+
+    @param input_data: input folder (reads *.nc - files)
+    @param first_year: first year
+    @param final_year: last year
+    @param depth: depth levels
+    @param lat: latitudes
+    @param lon: longitudes
+    @param directory: folder of the prepared caches, None for PREPARED_DIR in the input folder
+    @param chunk_steps: maximum number of time steps read at once (0 reads whole years)
+    @return: header file (.json) of the cache
+    """
+    from growth_model.temperature import load_step_days, load_temperature, open_input
+
+    folder = prepared_directory(input_data, directory)
+    hashes = year_hashes(input_data, first_year, final_year)
+    selection = _selection(depth, lat, lon)
+    key = fingerprint(version=PREPARED_VERSION, selection=selection, hashes=hashes)
+    header_file = folder.joinpath(f'{key}.json')
+    if header_file.exists():
+        logging.info(f'Prepared input {header_file} is up to date')
+        return header_file
+    for other in folder.glob('*.json'):
+        header = _read_header(other)
+        if header is not None and header['selection'] == selection and header['key'] != key:
+            logging.info(f'Removing out-of-date prepared input {other}')
+            _remove(other, header)
+
+    folder.mkdir(parents=True, exist_ok=True)
+    begin_time = time.time()
+    _, _, _, calendar = select_files(input_data, first_year, final_year)
+    input_files = open_input(input_data, first_year, final_year)
+    years = range(first_year, final_year + 1)
+    step_days = {year: load_step_days(input_files, year) for year in years}
+    shape = (sum(len(durations) for durations in step_days.values()), len(depth), len(lat) * len(lon))
+    temporary = f'.{os.getpid()}'
+    data_file = folder.joinpath(f'{key}.npy')
+    wet_file = folder.joinpath(f'{key}.wet.npy')
+    compact_file = folder.joinpath(f'{key}.compact.npy')
+    values = np.lib.format.open_memmap(str(data_file) + temporary, mode='w+', dtype='f', shape=shape)
+    wet = np.zeros((len(years),) + shape[1:], dtype=bool)
+    row = 0
+    for number, year in enumerate(years):
+        size = len(step_days[year])
+        step = chunk_steps if chunk_steps else size
+        for start in range(0, size, step):
+            steps = slice(start, min(start + step, size))
+            block = load_temperature(input_files, year, depth, lat, lon, steps if step < size else None)
+            values[row + start:row + steps.stop] = block
+            wet[number] |= ~np.isnan(block).all(axis=0)
+        row += size
+        logging.debug(f'Prepared {year}')
+    values.flush()
+
+    # Wet points of the compact layout, in the order of the flat (depth, cell) field
+    points = np.flatnonzero(wet.any(axis=0))
+    compact = np.lib.format.open_memmap(str(compact_file) + temporary, mode='w+', dtype='f',
+                                        shape=(shape[0], len(points)))
+    step = chunk_steps if chunk_steps else max(len(durations) for durations in step_days.values())
+    for start in range(0, shape[0], step):
+        rows = slice(start, min(start + step, shape[0]))
+        compact[rows] = values[rows].reshape(rows.stop - rows.start, -1)[:, points]
+    compact.flush()
+    del values, compact
+    with open(str(wet_file) + temporary, 'wb') as f:
+        np.save(f, wet, allow_pickle=False)
+    os.replace(str(data_file) + temporary, data_file)
+    os.replace(str(wet_file) + temporary, wet_file)
+    os.replace(str(compact_file) + temporary, compact_file)
+
+    header = {'version': PREPARED_VERSION, 'key': key, 'selection': selection,
+              'first_year': first_year, 'final_year': final_year, 'calendar': calendar,
+              'years': [year for year in years for _ in step_days[year]],
+              'step_days': [float(duration) for year in years for duration in step_days[year]],
+              'hashes': {str(year): hashes[year] for year in years}, 'shape': list(shape),
+              'data': data_file.name, 'wet': wet_file.name, 'compact': compact_file.name}
+    with open(str(header_file) + temporary, 'w') as f:
+        json.dump(header, f)
+    # The header is written last, a cache without header is incomplete
+    os.replace(str(header_file) + temporary, header_file)
+    logging.info(f'Prepared input {header_file}: {shape[0]} time steps x {shape[1]} depth levels x {shape[2]} '
+                 f'cells ({data_file.stat().st_size / 1024 ** 2:.1f} MB, {len(points)} wet points '
+                 f'{compact_file.stat().st_size / 1024 ** 2:.1f} MB) in {round(time.time() - begin_time, 3)} '
+                 f'seconds')
+    return header_file
+
+
+def open_prepared(input_data: str, first_year: int, final_year: int, depth: list, lat: list, lon: list,
+                  directory: str = None):
+    """
+    Open an up-to-date prepared cache covering the years and the selection of a run
+
+    @param input_data: input folder
+    @param first_year: first year of the run
+    @param final_year: last year of the run
+    @param depth: depth levels of the run
+    @param lat: latitudes of the run
+    @param lon: longitudes of the run
+    @param directory: folder of the prepared caches, None for PREPARED_DIR in the input folder
+    @return: PreparedInput or None if no cache covers the run
+    """
+    folder = prepared_directory(input_data, directory)
+    if not folder.is_dir():
+        return None
+    hashes = None
+    for header_file in sorted(folder.glob('*.json')):
+        header = _read_header(header_file)
+        if header is None or not _covers(header, first_year, final_year, depth, lat, lon):
+            continue
+        if hashes is None:
+            hashes = year_hashes(input_data, first_year, final_year)
+        if any(header['hashes'].get(str(year)) != hashes.get(year) for year in range(first_year, final_year + 1)):
+            logging.warning(f'Prepared input {header_file} is out of date (input files changed), '
+                            f'run "cod-growth-model prepare" again')
+            continue
+        return PreparedInput(header_file, header)
+    return None
+
+
+class PreparedInput:
+    """
+    Prepared cache of the input temperatures, memory-mapped read-only
+
+    Provides the loaders of temperature.TemperatureCache. Blocks of the prepared selection are views
+    of the memory maps: load() of the (step, depth, cell) layout and load_points() of the compact (step, point)
+    layout if the points are the wet points of the cache. Subsets of the selection (e.g. tiles) and other points
+    are copied.
+    """
+
+    def __init__(self, header_file: pathlib.Path, header: dict = None):
+        """
+        @param header_file: header file (.json) of the cache
+        @param header: content of the header file (read if not given)
+        """
+        self.header_file = header_file
+        self.header = header if header is not None else _read_header(header_file)
+        if self.header is None:
+            raise ValueError(f'{header_file} is not a prepared input')
+        with metrics.span('input_open'):
+            self.values = np.load(header_file.with_name(self.header['data']), mmap_mode='r', allow_pickle=False)
+            self.wet = np.load(header_file.with_name(self.header['wet']), mmap_mode='r', allow_pickle=False)
+            self.compact = np.load(header_file.with_name(self.header['compact']), mmap_mode='r',
+                                   allow_pickle=False)
+        # Points of the compact layout: wet in any year of the cache
+        self.points = np.flatnonzero(self.wet.any(axis=0))
+        self.selection = self.header['selection']
+        years = np.asarray(self.header['years'])
+        self._rows = {int(year): slice(int(np.searchsorted(years, year)), int(np.searchsorted(years, year, 'right')))
+                      for year in np.unique(years)}
+        self.step_days = np.asarray(self.header['step_days'], dtype='d')
+
+    def load(self, input_files, year: int, depth: list, lat: list, lon: list, steps: slice = None):
+        """
+        Temperature fields of one year (see temperature.load_temperature())
+
+        @param input_files: ignored, the prepared cache is read
+        @return: read-only float32 temperature (step, depth, cell) in °C with NaN on masked points
+        """
+        block = self.values[self._rows[year]]
+        if steps is not None:
+            block = block[steps]
+        metrics.count('bytes_read', block.nbytes)
+        index = self._index(depth, lat, lon)
+        if index is None:
+            return block
+        block = block.reshape((len(block), len(self.selection['depth']), len(self.selection['lat']),
+                               len(self.selection['lon'])))
+        return block[(slice(None),) + index].reshape(len(block), len(depth), len(lat) * len(lon))
+
+    def load_points(self, input_files, year: int, depth: list, lat: list, lon: list, points, steps: slice = None):
+        """
+        Temperature of some points of one year
+
+        A view of the compact layout if the selection is the prepared selection and the points are the wet
+        points of the cache (e.g. from wet_points() for the years of the cache), otherwise a copy.
+
+        @param input_files: ignored, the prepared cache is read
+        @param points: flat indices into the (depth, cell) field of the selection
+        @return: read-only float32 temperature (step, point) in °C with NaN on masked points
+        """
+        if self._index(depth, lat, lon) is not None or not np.array_equal(points, self.points):
+            block = self.load(input_files, year, depth, lat, lon, steps)
+            return block.reshape(len(block), -1)[:, points]
+        block = self.compact[self._rows[year]]
+        if steps is not None:
+            block = block[steps]
+        metrics.count('bytes_read', block.nbytes)
+        return block
+
+    def load_step_days(self, input_files, year: int):
+        """
+        Durations of the time steps of one year (see temperature.load_step_days())
+
+        @param input_files: ignored, the prepared cache is read
+        @return: numpy array of durations (days)
+        """
+        return self.step_days[self._rows[year]].copy()
+
+    def wet_points(self, first_year: int, final_year: int, depth: list, lat: list, lon: list):
+        """
+        Points that hold valid temperature data in any time step of the years (see temperature.load_wet_points())
+
+        @return: sorted flat indices of the wet points into a (depth, cell) field
+        """
+        first = first_year - self.header['first_year']
+        wet = self.wet[first:first + final_year - first_year + 1].any(axis=0)
+        index = self._index(depth, lat, lon)
+        if index is not None:
+            wet = wet.reshape(len(self.selection['depth']), len(self.selection['lat']),
+                              len(self.selection['lon']))[index]
+        return np.flatnonzero(wet.reshape(len(depth), len(lat) * len(lon)))
+
+    def _index(self, depth: list, lat: list, lon: list):
+        """
+        Index of a selection within the prepared selection
+
+        @return: tuple for numpy indexing of a (depth, lat, lon) block or None for the prepared selection
+        """
+        labels = _selection(depth, lat, lon)
+        if labels == self.selection:
+            return None
+        return np.ix_(*[np.array([self.selection[name].index(label) for label in labels[name]])
+                        for name in ('depth', 'lat', 'lon')])
+
+    def __repr__(self):
+        return (f'PreparedInput({self.header_file.name}, {self.header["first_year"]} - {self.header["final_year"]}, '
+                f'{" x ".join(str(size) for size in self.values.shape)})')
+
+
+def _selection(depth: list, lat: list, lon: list):
+    return {'depth': [float(label) for label in depth], 'lat': [float(label) for label in lat],
+            'lon': [float(label) for label in lon]}
+
+
+def _covers(header: dict, first_year: int, final_year: int, depth: list, lat: list, lon: list):
+    """
+    Check that a cache holds the years and the selection of a run
+
+    @return: bool
+    """
+    if header['first_year'] > first_year or header['final_year'] < final_year:
+        return False
+    selection = _selection(depth, lat, lon)
+    return all(set(selection[name]) <= set(header['selection'][name]) for name in selection)
+
+
+def _read_header(header_file: pathlib.Path):
+    """
+    @return: content of a header file or None if it is not a header of this version
+    """
+    try:
+        with open(header_file) as f:
+            header = json.load(f)
+    except (OSError, ValueError) as error:
+        logging.debug(f'Ignoring {header_file}: {error}')
+        return None
+    return header if isinstance(header, dict) and header.get('version') == PREPARED_VERSION else None
+
+
+def _remove(header_file: pathlib.Path, header: dict):
+    """
+    Remove the files of a cache (the header first, so the cache is no longer used)
+
+    @return: None
+    """
+    for filename in [header_file] + [header_file.with_name(header[name]) for name in ('data', 'wet', 'compact')]:
+        try:
+            filename.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _parse_args(argv=None):
+    """
+    Parsing the commandline arguments
+
+    @param argv: arguments (default: sys.argv[1:])
+    @return: the parsed arguments (argparse.Namespace)
+    """
+    parser = argparse.ArgumentParser(prog='cod-growth-model prepare',
+                                     description='Extracts the temperatures selected by multi_dim config files into '
+                                                 'memory-mapped caches\nused by later runs of the same input and '
+                                                 'selection',
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('config_files', type=str, nargs='+', metavar='CONFIG',
+                        help='multi_dim config files (input_data, first_year, final_year, depth, lat, lon)')
+    parser.add_argument('--directory', type=str,
+                        help=f'Folder of the prepared caches (default: "prepared_dir" of the config file or\n'
+                             f'{PREPARED_DIR} in the input folder)')
+    parser.add_argument('--time-chunk-steps', type=int, default=0,
+                        help='Maximum number of time steps read at once (default: 0, whole years)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Entrypoint of the prepare step
+
+    @param argv: arguments (default: sys.argv[1:])
+    @return: None
+    """
+    from growth_model.utils import init_logger, load_config
+
+    init_logger(pathlib.Path.cwd().joinpath('logger.conf'))
+    args = _parse_args(argv)
+    for config_file in args.config_files:
+        try:
+            settings = load_config(config_file)
+            prepare(settings['input_data'], settings['first_year'], settings['final_year'], settings['depth'],
+                    settings['lat'], settings['lon'], args.directory or settings.get('prepared_dir'),
+                    args.time_chunk_steps or settings.get('time_chunk_steps', 0))
+        except KeyError as error:
+            sys.exit(f'Error: {config_file} misses the multi_dim setting {error}')
+        except (ValueError, OSError) as error:
+            sys.exit(f'Error: {error}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides summaries of the multi_dim output computed while the model runs:
+- a reduction selects an output variable (optionally within a depth, latitude and longitude box) and reduces
+  each written field over grid dimensions (mean, max or min, NaN points are ignored)
+- across cohorts, the reduced fields are kept per cohort and age or accumulated to running statistics per age
+  (mean, std, min, max and quantiles, see uncertainty.StreamingStats)
+The summaries of a run are written to one netCDF file "<name>_summary.nc" when the writer is closed,
+so the full fields never need to be written (see output.create_writer()).
+"""
+
+import os
+import pathlib
+import logging
+import warnings
+
+import numpy as np
+import xarray as xr
+
+from growth_model import metrics
+from growth_model.checkpoint import fingerprint
+from growth_model.uncertainty import StreamingStats, quantile_name
+
+# Reductions of a field over grid dimensions
+REDUCTION_METHODS = ('mean', 'max', 'min')
+
+# Grid dimensions of the output variables, variables without depth dimension
+GRID_DIMS = ('depth_coord', 'latitude', 'longitude')
+SURFACE_DIMS = ('latitude', 'longitude')
+
+# Statistics across cohorts besides quantiles, which are named q<percent> (e.g. "q5", "q50", "q97.5")
+STATISTICS = ('mean', 'std', 'min', 'max')
+
+# Summary file "<name>_summary.nc" in the output folder of the experiment and region
+SUMMARY_SUFFIX = '_summary'
+
+# State of the running reductions, saved with every checkpoint (see ReductionWriter.flush())
+STATE_NAME = '.growth_model_reductions.npz'
+
+# Grid dimension of the box keys of a reduction
+_BOX_KEYS = {'depth': 'depth_coord', 'lat': 'latitude', 'lon': 'longitude'}
+
+# Grid dimension of the names accepted in dims
+_DIM_NAMES = {'depth': 'depth_coord', 'depth_coord': 'depth_coord', 'lat': 'latitude', 'latitude': 'latitude',
+              'lon': 'longitude', 'longitude': 'longitude'}
+
+
+class Reduction:
+    """
+    One summary of an output variable
+
+    The fields of the variable are cut to the box and reduced over the dimensions dims as they are written.
+    Without statistics the reduced field of every cohort and age is kept, otherwise only the running
+    statistics across cohorts of every age.
+    """
+
+    def __init__(self, variable: str, grid: dict, max_age: int, name: str = None, dims=(), method: str = 'mean',
+                 statistics=(), depth=None, lat=None, lon=None):
+        """
+        @param variable: output variable (e.g. "weight_3d")
+        @param grid: coordinates of the output grid by dimension name (depth_coord, latitude, longitude)
+        @param max_age: maximum age of fish (in years)
+        @param name: name of the summary (default: "<variable>_<method>" or the variable if dims is empty)
+        @param dims: grid dimensions reduced within each field ("depth", "lat", "lon" or the dimension names)
+        @param method: reduction over dims, one of REDUCTION_METHODS
+        @param statistics: statistics across cohorts (STATISTICS and quantiles "q<percent>"),
+                           empty keeps the values of every cohort
+        @param depth: [min, max] depth range of the box, None for all depth levels
+        @param lat: [min, max] latitude range of the box, None for all latitudes
+        @param lon: [min, max] longitude range of the box, None for all longitudes
+        """
+        from growth_model.output import OUTPUT_VARIABLES, SURFACE_VARIABLES
+
+        if variable not in OUTPUT_VARIABLES:
+            raise ValueError(f'Unknown variable "{variable}" of reduction, expected one of {OUTPUT_VARIABLES}')
+        if method not in REDUCTION_METHODS:
+            raise ValueError(f'Unknown reduction method "{method}", expected one of {REDUCTION_METHODS}')
+        variable_dims = SURFACE_DIMS if variable in SURFACE_VARIABLES else GRID_DIMS
+        dims = [dims] if isinstance(dims, str) else list(dims)
+        unknown = [dim for dim in dims if _DIM_NAMES.get(dim) not in variable_dims]
+        if unknown:
+            raise ValueError(f'Variable "{variable}" has no dimensions {unknown} to reduce, '
+                             f'expected some of {list(variable_dims)}')
+        dims = [_DIM_NAMES[dim] for dim in dims]
+        self.variable = variable
+        self.method = method
+        self.name = name or (f'{variable}_{method}' if dims else variable)
+
+        # Index of the box along every dimension of the variable
+        self.index = []
+        self.coords = {}
+        for key, bounds in (('depth', depth), ('lat', lat), ('lon', lon)):
+            dim = _BOX_KEYS[key]
+            if dim not in variable_dims:
+                if bounds is not None:
+                    raise ValueError(f'Variable "{variable}" has no dimension {dim} for the box of {key}')
+                continue
+            values = np.asarray(grid[dim], dtype='d')
+            inside = np.ones(len(values), dtype=bool)
+            if bounds is not None:
+                if len(bounds) != 2:
+                    raise ValueError(f'Expected [min, max] for {key} of reduction "{self.name}", got {bounds}')
+                inside = (values >= min(bounds)) & (values <= max(bounds))
+                if not inside.any():
+                    raise ValueError(f'No {dim} within {list(bounds)} for reduction "{self.name}"')
+            self.index.append(np.flatnonzero(inside))
+            if dim not in dims:
+                self.coords[dim] = values[inside]
+        self.axes = tuple(variable_dims.index(dim) for dim in dims)
+        self.dims = tuple(self.coords)
+        self.box = {dim: bounds for dim, bounds in zip(GRID_DIMS, (depth, lat, lon)) if bounds is not None}
+        self.reduced_dims = tuple(dims)
+        shape = tuple(len(values) for values in self.coords.values())
+
+        # Running statistics per age or reduced fields by (cohort, age)
+        self.statistics = [statistics] if isinstance(statistics, str) else list(statistics)
+        # Key of every statistic in the result of StreamingStats
+        self._keys = {}
+        quantiles = []
+        for statistic in self.statistics:
+            if statistic in STATISTICS:
+                self._keys[statistic] = statistic
+                continue
+            try:
+                probability = float(statistic[1:]) / 100 if statistic.startswith('q') else None
+            except ValueError:
+                probability = None
+            if probability is None or not 0 < probability < 1:
+                raise ValueError(f'Unknown statistic "{statistic}" of reduction "{self.name}", expected '
+                                 f'{STATISTICS} or quantiles q<percent> (e.g. "q50")')
+            quantiles.append(probability)
+            self._keys[statistic] = quantile_name(probability)
+        self.stats = None
+        if self.statistics:
+            self.stats = [StreamingStats(shape, quantiles) for _ in range(max_age)]
+        self.values = {}
+
+    def reduce(self, field):
+        """
+        Cut a field to the box and reduce it over the dimensions of the reduction
+
+        @param field: gridded field of the variable
+        @return: numpy array (float64) over the remaining dimensions
+        """
+        values = np.asarray(field, dtype='d')[np.ix_(*self.index)]
+        if not self.axes:
+            return values
+        with warnings.catch_warnings():
+            # Cells without a valid point (e.g. land) are NaN
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            if self.method == 'mean':
+                return np.nanmean(values, axis=self.axes)
+            if self.method == 'max':
+                return np.nanmax(values, axis=self.axes)
+            return np.nanmin(values, axis=self.axes)
+
+    def add(self, cohort: int, age: int, field):
+        """
+        Add the field of one cohort and age
+
+        @param cohort: birth year
+        @param age: age of the cohort (years)
+        @param field: gridded field of the variable
+        @return: None
+        """
+        values = self.reduce(field)
+        if self.stats is not None:
+            self.stats[age - 1].update(values[np.newaxis])
+        else:
+            self.values[(cohort, age)] = values.astype('f')
+
+    def state(self):
+        """
+        @return: dict of numpy arrays holding the running summary, see restore()
+        """
+        state = {}
+        if self.stats is not None:
+            for age, stats in enumerate(self.stats):
+                state.update({f'{self.name}__{age}__{key}': values for key, values in stats.state().items()})
+        elif self.values:
+            keys = sorted(self.values)
+            state[f'{self.name}__keys'] = np.array(keys)
+            state[f'{self.name}__values'] = np.stack([self.values[key] for key in keys])
+        return state
+
+    def restore(self, state: dict):
+        """
+        Continue from the running summary of state()
+
+        @param state: dict of numpy arrays, may hold the states of other reductions
+        @return: None
+        """
+        if self.stats is not None:
+            for age, stats in enumerate(self.stats):
+                prefix = f'{self.name}__{age}__'
+                stats.restore({key[len(prefix):]: values for key, values in state.items() if key.startswith(prefix)})
+        elif f'{self.name}__keys' in state:
+            self.values = {(int(cohort), int(age)): values for (cohort, age), values
+                           in zip(state[f'{self.name}__keys'], state[f'{self.name}__values'])}
+
+    def dataset(self, ages: list):
+        """
+        Summary as Dataset
+
+        Kept dimensions that are cut by the box are named "<dimension>_<name>", so summaries of different
+        boxes fit into one file.
+
+        @param ages: ages of the age dimension
+        @return: xarray.Dataset with variable <name> (cohort, age, ...) without statistics or
+                 <name>_<statistic> (age, ...) and <name>_count (age) with statistics
+        """
+        dims = tuple(f'{dim}_{self.name}' if dim in self.box else dim for dim in self.dims)
+        coords = {name: values for name, values in zip(dims, self.coords.values())}
+        attrs = {'variable': self.variable, 'method': self.method, 'reduced_dims': ' '.join(self.reduced_dims)}
+        attrs.update({f'{dim}_range': list(bounds) for dim, bounds in self.box.items()})
+        data_vars = {}
+        if self.stats is not None:
+            results = [stats.result() for stats in self.stats]
+            for statistic, key in self._keys.items():
+                data_vars[f'{self.name}_{statistic}'] = (('age',) + dims, np.stack([result[key] for result in results]),
+                                                         dict(attrs, statistic=statistic))
+            data_vars[f'{self.name}_count'] = (('age',), np.array([stats.count for stats in self.stats]),
+                                               {'long_name': f'number of cohorts of {self.name}'})
+        else:
+            cohorts = sorted({cohort for cohort, _ in self.values})
+            shape = tuple(len(values) for values in self.coords.values())
+            values = np.full((len(cohorts), len(ages)) + shape, np.nan, dtype='f')
+            for (cohort, age), field in self.values.items():
+                values[cohorts.index(cohort), age - 1] = field
+            coords['cohort'] = np.array(cohorts, dtype='i4')
+            data_vars[self.name] = (('cohort', 'age') + dims, values, attrs)
+        return xr.Dataset(data_vars, coords=coords)
+
+
+def parse_reductions(specs: list, depth: list, lat: list, lon: list, max_age: int):
+    """
+    Reductions from their settings (tables [[model_settings.reductions]] of the config file)
+
+    @param specs: list of dicts with the arguments of Reduction (variable, name, dims, method, statistics,
+                  depth, lat, lon)
+    @param depth: depth levels of the output grid
+    @param lat: latitudes of the output grid
+    @param lon: longitudes of the output grid
+    @param max_age: maximum age of fish (in years)
+    @return: list of Reduction
+    """
+    grid = {'depth_coord': depth, 'latitude': lat, 'longitude': lon}
+    keys = ('variable', 'name', 'dims', 'method', 'statistics', 'depth', 'lat', 'lon')
+    reductions = []
+    for spec in specs or ():
+        unknown = sorted(set(spec) - set(keys))
+        if unknown or 'variable' not in spec:
+            raise ValueError(f'Invalid reduction {spec}: expected a variable and some of {keys}, got {unknown or spec}')
+        reductions.append(Reduction(grid=grid, max_age=max_age, **spec))
+    names = [reduction.name for reduction in reductions]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f'Reductions need unique names, got {duplicates} more than once')
+    return reductions
+
+
+class ReductionWriter:
+    """
+    Reduce the output fields while they are written and write the summaries when closed
+
+    flush() saves the running summaries next to the checkpoint, a resumed run (append) continues from
+    them and skips cohort-years that were reduced before. A run that fails still writes the summary of
+    the cohort-years written so far.
+    """
+
+    def __init__(self, reductions: list, filename: pathlib.Path, max_age: int, state_file: pathlib.Path = None,
+                 append: bool = False):
+        """
+        @param reductions: list of Reduction
+        @param filename: summary file (netCDF)
+        @param max_age: maximum age of fish (in years)
+        @param state_file: file of the running summaries (.npz), None does not save them
+        @param append: continue from the running summaries in state_file (resumed runs)
+        """
+        self.reductions = reductions
+        self.filename = filename
+        self.ages = list(range(1, max_age + 1))
+        self.state_file = state_file
+        self.fingerprint = fingerprint(reductions=[(reduction.name, reduction.variable, reduction.method,
+                                                    reduction.reduced_dims, reduction.box, reduction.statistics)
+                                                   for reduction in reductions])
+        # (year, age) of the reduced cohort-years
+        self.done = set()
+        if append and state_file is not None and state_file.exists():
+            self._restore()
+
+    def _restore(self):
+        with np.load(self.state_file) as saved:
+            state = {name: saved[name] for name in saved.files}
+        if str(state.pop('fingerprint')) != self.fingerprint:
+            logging.warning(f'Ignoring the summaries in {self.state_file} of other reductions')
+            return
+        self.done = {(int(year), int(age)) for year, age in state.pop('done')}
+        for reduction in self.reductions:
+            reduction.restore(state)
+        logging.info(f'Continuing the summaries of {len(self.done)} cohort-years from {self.state_file}')
+
+    def write(self, year: int, age: int, fields: dict):
+        """
+        Reduce the output fields of one cohort and year
+
+        @param year: year of the output
+        @param age: age of the cohort (years)
+        @param fields: gridded fields by variable name
+        @return: None
+        """
+        if (year, age) in self.done:
+            # Output repeated by a run resumed from a checkpoint
+            return
+        with metrics.span('reduce'):
+            for reduction in self.reductions:
+                reduction.add(year - age, age, fields[reduction.variable])
+        self.done.add((year, age))
+
+    def flush(self):
+        """
+        Save the running summaries to the state file
+
+        @return: None
+        """
+        if self.state_file is None:
+            return None
+        state = {'fingerprint': self.fingerprint, 'done': np.array(sorted(self.done), dtype='i4').reshape(-1, 2)}
+        for reduction in self.reductions:
+            state.update(reduction.state())
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.state_file.with_name(f'{self.state_file.stem}.{os.getpid()}.tmp')
+        with open(temporary, 'wb') as f:
+            np.savez_compressed(f, **state)
+        os.replace(temporary, self.state_file)
+        return None
+
+    def pending(self):
+        """
+        Nothing pending, fields are reduced when written
+
+        @return: empty list
+        """
+        return []
+
+    def close(self):
+        """
+        Write the summaries of all reductions to the summary file
+
+        @return: None
+        """
+        ds = xr.merge([reduction.dataset(self.ages) for reduction in self.reductions])
+        ds = ds.assign_coords(age=('age', np.array(self.ages, dtype='i4'), {'units': 'years'}))
+        if 'cohort' in ds.coords:
+            ds['cohort'].attrs['long_name'] = 'birth year'
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        with metrics.span('write_summary'):
+            ds.to_netcdf(self.filename)
+        logging.info(f'Saved {len(self.reductions)} summaries of {len(self.done)} cohort-years to {self.filename}')
@@ -0,0 +1,528 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides the growth query service:
+- a long-lived process answering batched growth queries on localhost HTTP or a Unix socket
+- the growth equations, the lookup tables, the fitted growth parameters (growth_parameters_multistep.npz)
+  and optionally the temperature data of a multi_dim config file are loaded once and kept in memory
+- JSON and binary (NumPy .npy) requests evaluated in one vectorized pass, latency and throughput statistics
+- a client for local processes (Client)
+
+Endpoints:
+    POST /growth  JSON {"temp": [...], "weight": [...], "dt": 1, "engine": "exact"}, the values are numbers
+                  or lists broadcast against each other; instead of "temp" the keys "year", "month", "depth",
+                  "lat" and "lon" select temperatures of the preloaded data (nearest coordinates).
+                  Answer: {"a": [...], "b": [...], "growth_rate": [...], "final_weight": [...]}, null on land.
+                  Binary: a .npy array (rows, 2 or 3) of temp, weight and optionally dt with Content-Type
+                  application/x-npy (engine in the query string, e.g. /growth?engine=lut).
+                  Answer: a .npy array (rows, 4) of a, b, growth_rate, final_weight.
+    GET /stats    number of requests, rows and errors, latency (mean, p50, p99) and throughput
+    GET /health   {"status": "ok"}
+
+Growth over one time step follows model "sweep": growth_rate = 0.01 * (a * weight ** -b - C_AVG) and
+final_weight = weight * (1 + dt * growth_rate).
+
+Usage: cod-growth-model serve [--host 127.0.0.1] [--port 8765] [--socket PATH] [--temperature CONFIG]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import pathlib
+import argparse
+import threading
+import http.client
+import socketserver
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from growth_model.constants import C_AVG
+from growth_model.lookup import LUT_STEP, PARAMETER_ENGINES, parameter_functions
+from growth_model.models.sweep import growth_step
+
+# Parameter engines of the service: equations, lookup tables and the fitted parameters of model "one_dim"
+ENGINES = PARAMETER_ENGINES + ('fitted',)
+
+# Temperature grid (°C) of the fitted growth parameters (a_fit and b_fit of growth_parameters_multistep.npz)
+FITTED_MIN_TEMP = -2.
+FITTED_TEMP_STEP = 0.1
+
+# Columns of the answers
+GROWTH_COLUMNS = ('a', 'b', 'growth_rate', 'final_weight')
+
+NPY_CONTENT_TYPE = 'application/x-npy'
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Number of recent requests the latency statistics are computed from
+LATENCY_WINDOW = 10000
+
+# Maximum size of a request body (bytes)
+MAX_REQUEST_BYTES = 256 * 1024 ** 2
+
+
+class RequestStats:
+    """
+    Request counts, latency of the recent requests and throughput of a service
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        """
+        @param window: number of recent requests the latency percentiles are computed from
+        """
+        self.begin_time = time.perf_counter()
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+        self.busy_seconds = 0.
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float, rows: int = 0, error: bool = False):
+        with self._lock:
+            self.requests += 1
+            self.rows += rows
+            self.errors += error
+            self.busy_seconds += seconds
+            self.latencies.append(seconds)
+
+    def summary(self):
+        """
+        @return: dict with uptime, requests, rows, errors, latency in ms (mean, p50, p99, max of the recent
+                 requests) and throughput (requests and rows per second of uptime and of busy time)
+        """
+        with self._lock:
+            latencies = np.array(self.latencies)
+            summary = {'uptime_s': time.perf_counter() - self.begin_time, 'requests': self.requests,
+                       'rows': self.rows, 'errors': self.errors, 'busy_s': self.busy_seconds}
+        if len(latencies):
+            summary['latency_ms'] = {'mean': latencies.mean() * 1e3, 'p50': np.percentile(latencies, 50) * 1e3,
+                                     'p99': np.percentile(latencies, 99) * 1e3, 'max': latencies.max() * 1e3}
+        summary['requests_per_s'] = summary['requests'] / summary['uptime_s']
+        summary['rows_per_s'] = summary['rows'] / summary['uptime_s']
+        summary['rows_per_busy_s'] = summary['rows'] / summary['busy_s'] if summary['busy_s'] else None
+        return summary
+
+
+class GrowthService:
+    """
+    Growth parameters and temperature data held in memory, evaluating batches of growth queries
+    """
+
+    def __init__(self, temperature_config: pathlib.Path = None, lut_step: float = LUT_STEP):
+        """
+        @param temperature_config: multi_dim config file, the temperatures of its input folder, years,
+                                   depths, latitudes and longitudes are loaded into memory (None skips it)
+        @param lut_step: temperature step (°C) of the lookup tables of engine "lut"
+        """
+        from growth_model.models.one_dim import growth_parameters
+
+        self.functions = {engine: parameter_functions(engine, lut_step) for engine in PARAMETER_ENGINES}
+        fitted = growth_parameters()
+        self.a_fit, self.b_fit, self.c_avg_fit = fitted['a_fit'], fitted['b_fit'], float(fitted['c_avg'])
+        self.fitted_temps = FITTED_MIN_TEMP + FITTED_TEMP_STEP * np.arange(len(self.a_fit))
+        self.temperature = None
+        if temperature_config is not None:
+            self.temperature = _load_temperature(temperature_config)
+        self.stats = RequestStats()
+
+    def growth(self, temp, weight, dt=1, engine: str = 'exact'):
+        """
+        Growth over one time step of every (temperature, weight, time step)
+
+        @param temp: temperatures (°C), NaN on land
+        @param weight: initial weights (g), ValueError if not positive
+        @param dt: time steps (days)
+        @param engine: "exact" (equations), "lut" (lookup tables, see lookup.py) or "fitted" (fitted
+                       parameters of model "one_dim", interpolated linearly, limited to their range)
+        @return: dict of arrays by column (GROWTH_COLUMNS), temp, weight and dt broadcast against each other,
+                 see models.sweep.growth_step()
+        """
+        temp, weight, dt = np.broadcast_arrays(np.asarray(temp, dtype='d'), np.asarray(weight, dtype='d'),
+                                               np.asarray(dt, dtype='d'))
+        if not (weight > 0).all():
+            raise ValueError('Weights must be positive numbers')
+        if engine == 'fitted':
+            a = np.interp(temp, self.fitted_temps, self.a_fit)
+            b = np.interp(temp, self.fitted_temps, self.b_fit)
+            c_avg = self.c_avg_fit
+        elif engine in self.functions:
+            a_function, b_function = self.functions[engine]
+            a = np.asarray(a_function(temp), dtype='d')
+            b = np.asarray(b_function(temp), dtype='d') * (-1.)
+            c_avg = C_AVG
+        else:
+            raise ValueError(f'Engine must be one of {ENGINES}, got "{engine}"')
+        growth_rate, final_weight = growth_step(a, b, weight, dt, c_avg)
+        return {'a': a, 'b': b, 'growth_rate': growth_rate, 'final_weight': final_weight}
+
+    def point_temperature(self, year, month, depth, lat, lon):
+        """
+        Temperatures of the preloaded data at the nearest coordinates
+
+        @param year: calendar years
+        @param month: months (1 - 12)
+        @param depth: depths
+        @param lat: latitudes
+        @param lon: longitudes
+        @return: array of temperatures (°C), NaN on land
+        """
+        if self.temperature is None:
+            raise ValueError('No temperature data loaded, start the service with --temperature CONFIG')
+        data = self.temperature
+        year, month, depth, lat, lon = np.broadcast_arrays(*(np.asarray(values) for values in
+                                                             (year, month, depth, lat, lon)))
+        year_index = year.astype(int) - data['first_year']
+        if ((year_index < 0) | (year_index >= len(data['values']))).any():
+            raise ValueError(f'Years must be within {data["first_year"]} - '
+                             f'{data["first_year"] + len(data["values"]) - 1}')
+        if ((month < 1) | (month > 12)).any():
+            raise ValueError('Months must be within 1 - 12')
+        indices = [_nearest(data[name], values) for name, values in (('depth', depth), ('lat', lat), ('lon', lon))]
+        return data['values'][(year_index, month.astype(int) - 1, *indices)]
+
+    def handle_json(self, request: dict):
+        """
+        Answer a JSON request (see module documentation)
+
+        @param request: dict of the request
+        @return: tuple of (dict of lists of the answer, number of rows)
+        """
+        if not isinstance(request, dict):
+            raise ValueError('Request must be a JSON object')
+        if 'temp' in request:
+            temp = request['temp']
+        else:
+            missing = [key for key in ('year', 'month', 'depth', 'lat', 'lon') if key not in request]
+            if missing:
+                raise ValueError(f'Request needs "temp" or the keys {missing}')
+            temp = self.point_temperature(*(request[key] for key in ('year', 'month', 'depth', 'lat', 'lon')))
+        if 'weight' not in request:
+            raise ValueError('Request needs "weight"')
+        result = self.growth(np.asarray(temp, dtype='d'), request['weight'], request.get('dt', 1),
+                             request.get('engine', 'exact'))
+        rows = result['a'].size
+        if 'temp' not in request:
+            result['temp'] = np.broadcast_to(temp, result['a'].shape)
+        # NaN (land) is written as null
+        return {name: np.where(np.isnan(values), None, values).tolist() for name, values in result.items()}, rows
+
+    def handle_array(self, array, engine: str = 'exact'):
+        """
+        Answer a binary request (see module documentation)
+
+        @param array: array (rows, 2 or 3) of temp, weight and optionally dt
+        @param engine: parameter engine (see growth())
+        @return: array (rows, 4) of the columns GROWTH_COLUMNS
+        """
+        if array.ndim != 2 or array.shape[1] not in (2, 3):
+            raise ValueError(f'Binary requests are arrays (rows, 2 or 3) of temp, weight[, dt], got {array.shape}')
+        dt = array[:, 2] if array.shape[1] == 3 else 1
+        result = self.growth(array[:, 0], array[:, 1], dt, engine)
+        return np.stack([result[name] for name in GROWTH_COLUMNS], axis=1)
+
+
+def _nearest(coordinates, values):
+    """
+    @param coordinates: 1-D array of coordinate labels
+    @param values: array of values
+    @return: indices of the nearest labels
+    """
+    return np.abs(np.asarray(values, dtype='d')[..., np.newaxis] - coordinates).argmin(axis=-1)
+
+
+def _load_temperature(config_file: pathlib.Path):
+    """
+    Load the temperatures selected by a multi_dim config file into memory
+
+    @param config_file: multi_dim config file (input_data, first_year, final_year, depth, lat, lon)
+    @return: dict with first_year, depth, lat, lon and values (year, month, depth, lat, lon) in °C
+    """
+    from growth_model.temperature import load_temperature, open_input, require_monthly
+    from growth_model.utils import load_config
+
+    settings = load_config(config_file)
+    depth, lat, lon = settings['depth'], settings['lat'], settings['lon']
+    first_year, final_year = settings['first_year'], settings['final_year']
+    input_files = open_input(settings['input_data'], first_year, final_year)
+    require_monthly(input_files, first_year, final_year, 'The growth query service')
+    values = np.stack([load_temperature(input_files, year, depth, lat, lon)
+                       .reshape(12, len(depth), len(lat), len(lon)) for year in range(first_year, final_year + 1)])
+    logging.info(f'Loaded temperatures of {first_year} - {final_year}, {len(depth)} depths x {len(lat)} latitudes '
+                 f'x {len(lon)} longitudes ({values.nbytes / 1024 ** 2:.1f} MB)')
+    return {'first_year': first_year, 'depth': np.asarray(depth, dtype='d'), 'lat': np.asarray(lat, dtype='d'),
+            'lon': np.asarray(lon, dtype='d'), 'values': values}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    HTTP request handler of the growth query service (the service is the attribute "service" of the server)
+    """
+
+    # Keep connections open between requests of a client
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif path == '/stats':
+            self._send_json(200, self.server.service.stats.summary())
+        else:
+            self._send_json(404, {'error': f'Unknown path {path}'})
+
+    def do_POST(self):
+        begin = time.perf_counter()
+        service = self.server.service
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if 0 < length <= MAX_REQUEST_BYTES else b''
+        if length > MAX_REQUEST_BYTES:
+            # The body is not read, the connection cannot be reused
+            self.close_connection = True
+        rows = 0
+        if url.path != '/growth':
+            status = 404
+            self._send_json(status, {'error': f'Unknown path {url.path}'})
+        elif not body:
+            status = 400
+            self._send_json(status, {'error': f'Request body must have 1 - {MAX_REQUEST_BYTES} bytes'})
+        else:
+            try:
+                if self.headers.get('Content-Type', '').startswith(NPY_CONTENT_TYPE):
+                    engine = parse_qs(url.query).get('engine', ['exact'])[0]
+                    array = np.load(io.BytesIO(body), allow_pickle=False)
+                    answer = service.handle_array(np.asarray(array, dtype='d'), engine)
+                    rows = len(answer)
+                    buffer = io.BytesIO()
+                    np.save(buffer, answer, allow_pickle=False)
+                    status = 200
+                    self._send(status, buffer.getvalue(), NPY_CONTENT_TYPE)
+                else:
+                    answer, rows = service.handle_json(json.loads(body))
+                    status = 200
+                    self._send_json(status, answer)
+            except (ValueError, TypeError, KeyError) as error:
+                status = 400
+                self._send_json(status, {'error': str(error)})
+        service.stats.add(time.perf_counter() - begin, rows, error=status != 200)
+
+    def _send_json(self, status: int, content: dict):
+        self._send(status, json.dumps(content).encode(), 'application/json')
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        logging.debug(f'{self.address_string()} {format % args}')
+
+
+class _TcpHandler(_Handler):
+    """
+    Request handler of the HTTP server on a TCP port, sends small answers without delay
+    """
+
+    disable_nagle_algorithm = True
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP server on a Unix socket, one thread per connection
+    """
+
+    daemon_threads = True
+
+
+def create_server(service: GrowthService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                  socket_path: pathlib.Path = None):
+    """
+    Create the HTTP server of a service (call serve_forever() to answer requests)
+
+    @param service: GrowthService
+    @param host: host name or address of the HTTP server (ignored with socket_path)
+    @param port: port of the HTTP server, 0 selects a free port (ignored with socket_path)
+    @param socket_path: Unix socket of the server instead of a TCP port
+    @return: socketserver.BaseServer with the attribute "service"
+    """
+    if socket_path is not None:
+        socket_path = pathlib.Path(socket_path)
+        if socket_path.is_socket():
+            # Left behind by a killed service
+            socket_path.unlink()
+        server = _UnixHTTPServer(str(socket_path), _Handler)
+    else:
+        server = ThreadingHTTPServer((host, port), _TcpHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+class Client:
+    """
+    Client of the growth query service, keeps its connection open between requests
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, socket_path: pathlib.Path = None,
+                 timeout: float = 60.):
+        """
+        @param host: host of the HTTP server
+        @param port: port of the HTTP server
+        @param socket_path: Unix socket of the server instead of host and port
+        @param timeout: timeout of a request (seconds)
+        """
+        if socket_path is not None:
+            self.connection = _UnixConnection(str(socket_path), timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def growth(self, temp=None, weight=1, dt=1, engine: str = 'exact', binary: bool = False, **points):
+        """
+        Query growth over one time step
+
+        @param temp: temperatures (°C), or None to select temperatures of the preloaded data with the keyword
+                     arguments year, month, depth, lat and lon
+        @param weight: initial weights (g)
+        @param dt: time steps (days)
+        @param engine: parameter engine (see GrowthService.growth())
+        @param binary: send the query as .npy array (temperatures only), faster for many rows
+        @return: dict of arrays by column (GROWTH_COLUMNS), NaN on land
+        """
+        if binary:
+            temp, weight, dt = np.broadcast_arrays(np.asarray(temp, dtype='d'), np.asarray(weight, dtype='d'),
+                                                   np.asarray(dt, dtype='d'))
+            buffer = io.BytesIO()
+            np.save(buffer, np.stack([temp.ravel(), weight.ravel(), dt.ravel()], axis=1), allow_pickle=False)
+            answer = np.load(io.BytesIO(self._request('POST', f'/growth?engine={engine}', buffer.getvalue(),
+                                                      NPY_CONTENT_TYPE)), allow_pickle=False)
+            return {name: answer[:, column].reshape(temp.shape) for column, name in enumerate(GROWTH_COLUMNS)}
+        request = dict(points, weight=np.asarray(weight).tolist(), dt=np.asarray(dt).tolist(), engine=engine)
+        if temp is not None:
+            request['temp'] = np.asarray(temp).tolist()
+        answer = json.loads(self._request('POST', '/growth', json.dumps(request).encode(), 'application/json'))
+        return {name: np.array(values, dtype='d') for name, values in answer.items()}
+
+    def stats(self):
+        """
+        @return: dict of request statistics of the service (see RequestStats.summary())
+        """
+        return json.loads(self._request('GET', '/stats'))
+
+    def health(self):
+        """
+        @return: True if the service answers
+        """
+        return json.loads(self._request('GET', '/health')).get('status') == 'ok'
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def _request(self, method: str, path: str, body: bytes = None, content_type: str = None):
+        headers = {'Content-Type': content_type} if content_type else {}
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        content = response.read()
+        if response.status != 200:
+            try:
+                message = json.loads(content)['error']
+            except (ValueError, KeyError):
+                message = content.decode(errors='replace')
+            raise ValueError(f'Growth service error {response.status}: {message}')
+        return content
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a Unix socket
+    """
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _parse_args(argv=None):
+    """
+    Parsing the commandline arguments
+
+    @param argv: arguments (default: sys.argv[1:])
+    @return: the parsed arguments (argparse.Namespace)
+    """
+    parser = argparse.ArgumentParser(prog='cod-growth-model serve',
+                                     description='Long-lived service answering batched growth queries',
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST,
+                        help=f'Host of the HTTP server (default: {DEFAULT_HOST}, local clients only)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'Port of the HTTP server (default: {DEFAULT_PORT})')
+    parser.add_argument('--socket', type=str, metavar='PATH',
+                        help='Serve on a Unix socket instead of a TCP port')
+    parser.add_argument('--temperature', type=str, metavar='CONFIG',
+                        help='multi_dim config file, the temperatures it selects are loaded into memory and can be\n'
+                             'queried by year, month, depth, lat and lon')
+    parser.add_argument('--lut-step', type=float, default=LUT_STEP,
+                        help=f'Temperature step (°C) of the lookup tables of engine "lut" (default: {LUT_STEP})')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Entrypoint of the growth query service, runs until interrupted
+
+    @param argv: arguments (default: sys.argv[1:])
+    @return: None
+    """
+    from growth_model.utils import init_logger
+
+    init_logger(pathlib.Path.cwd().joinpath('logger.conf'))
+    args = _parse_args(argv)
+    try:
+        service = GrowthService(pathlib.Path(args.temperature) if args.temperature else None, args.lut_step)
+        server = create_server(service, args.host, args.port, args.socket)
+    except (KeyError, ValueError, OSError) as error:
+        sys.exit(f'Error: {error}')
+
+    address = args.socket if args.socket else f'http://{args.host}:{server.server_address[1]}'
+    logging.info(f'Growth service listening on {address}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+        logging.info(f'Growth service stopped: {json.dumps(service.stats.summary())}')
+
+
+if __name__ == '__main__':
+    main()
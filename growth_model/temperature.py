@@ -0,0 +1,378 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides reading of input temperature data:
+- opening the input files of a range of years lazily (see manifest.py)
+- selecting the temperature fields of one year and the durations of their time steps (see time_axis.py)
+- finding the wet (ocean) points of the selection
+- a bounded cache of yearly temperature fields shared by all cohorts, or streaming of chunks of time steps
+- an input dataset shared by several runs, each year is read once for all of them
+"""
+
+import logging
+
+from collections import Counter, OrderedDict
+
+import numpy as np
+import xarray as xr
+
+from growth_model import metrics
+from growth_model.manifest import select_files
+from growth_model.time_axis import index_step_days, step_starts
+from growth_model.utils import NETCDF_LOCK
+
+# Coordinate of the input dataset holding the duration (days) of every time step
+STEP_DAYS = 'step_days'
+
+
+def open_input(input_data: str, first_year: int, final_year: int):
+    """
+    Open the input temperature files lazily
+
+    @param input_data: input folder (reads *.nc - files)
+    @param first_year: first year in the input dataset
+    @param final_year: last year in the input dataset
+    @return: xarray.Dataset
+    """
+    with metrics.span('input_open'):
+        # Open only the temperature files of the years of the run (see manifest.load_manifest())
+        my_files, years, durations, calendar = select_files(input_data, first_year, final_year)
+        # About one dask chunk per year (the files may be chunked per time step and depth level on disk).
+        # Files are concatenated in the order of the manifest, their coordinates were compared when indexing.
+        input_files = xr.open_mfdataset(my_files, combine='nested', concat_dim='time', data_vars='minimal',
+                                        coords='minimal', compat='override', decode_times=False,
+                                        chunks={'time': max(Counter(years).values()),
+                                                'depth_coord': -1})
+    logging.debug(f'DATA SET: {input_files}')
+    # Time index in the calendar of the files (selectable by year) and the duration of every time step,
+    # both from the manifest (time units in months are not supported by cftime for most calendars)
+    time = xr.CFTimeIndex(step_starts(years, durations, calendar))
+    return input_files.assign_coords({'time': time, STEP_DAYS: ('time', np.asarray(durations, dtype='d'))})
+
+
+def load_temperature(input_files, year: int, depth: list, lat: list, lon: list, steps: slice = None):
+    """
+    Select the temperature fields of one year
+
+    @param input_files: input dataset with variable "thetao"
+    @param year: calendar year
+    @param depth: depth levels
+    @param lat: latitudes
+    @param lon: longitudes
+    @param steps: time steps within the year, None selects all
+    @return: float32 temperature (step, depth, cell) in °C with NaN on masked points
+    """
+    with metrics.span('temperature_select'):
+        my_temp, subset = _select(input_files, slice(str(year), str(year)), depth, lat, lon)
+        if steps is not None:
+            my_temp = my_temp.isel(time=steps)
+        logging.debug(my_temp)
+        with NETCDF_LOCK:
+            values = my_temp.values
+        metrics.count('bytes_read', values.nbytes)
+        values = values[subset]
+    # Partly vectorize 4D temperature fields to accelerate the computations
+    temp_input_3d = values.astype('f', copy=False).reshape(len(values), len(depth), len(lat) * len(lon))
+    # Set NaN values
+    temp_input_3d[np.where(temp_input_3d[:, :, :] <= -998)] = np.nan
+    return temp_input_3d
+
+
+def load_step_days(input_files, year: int):
+    """
+    Durations of the time steps of one year
+
+    @param input_files: input dataset, durations are taken from its coordinate STEP_DAYS or derived from
+                        its time index (see time_axis.step_days())
+    @param year: calendar year
+    @return: numpy array of durations (days)
+    """
+    if STEP_DAYS in input_files.coords:
+        return input_files[STEP_DAYS].sel(time=slice(str(year), str(year))).values.astype('d')
+    index = input_files.indexes['time']
+    return index_step_days(index)[index.year == year]
+
+
+def require_monthly(input_files, first_year: int, final_year: int, user: str):
+    """
+    Check that the input holds 12 monthly fields of 30 days per year (360_day calendar)
+
+    @param input_files: input dataset
+    @param first_year: first calendar year
+    @param final_year: last calendar year
+    @param user: name of the model or tool that needs monthly input (for the error message)
+    @return: None
+    """
+    for year in range(first_year, final_year + 1):
+        durations = load_step_days(input_files, year)
+        if len(durations) != 12 or (durations != 30).any():
+            raise ValueError(f'{user} needs 12 monthly time steps of 30 days per year (360_day calendar), '
+                             f'the input of {year} has {len(durations)} time steps of {sum(durations):g} days')
+
+
+def load_wet_points(input_files, first_year: int, final_year: int, depth: list, lat: list, lon: list):
+    """
+    Find the points that hold valid temperature data in any month of the given years
+
+    Land and points below the sea floor (values <= -998 or NaN) are dry.
+
+    @param input_files: input dataset with variable "thetao"
+    @param first_year: first calendar year
+    @param final_year: last calendar year
+    @param depth: depth levels
+    @param lat: latitudes
+    @param lon: longitudes
+    @return: sorted flat indices of the wet points into a (depth, cell) field
+    """
+    with metrics.span('wet_points'):
+        my_temp, subset = _select(input_files, slice(str(first_year), str(final_year)), depth, lat, lon)
+        # Reduce over time chunk by chunk, only the (depth, lat, lon) mask is loaded
+        with NETCDF_LOCK:
+            wet = (my_temp > -998).any('time').values
+        metrics.count('bytes_read', my_temp.nbytes)
+    wet = wet[subset[1:]]
+    return np.flatnonzero(wet.reshape(len(depth), len(lat) * len(lon)))
+
+
+def _select(input_files, time: slice, depth: list, lat: list, lon: list):
+    """
+    Select the bounding box of depth levels and grid points lazily (cheap slicing of the input dataset)
+
+    @param input_files: input dataset with variable "thetao"
+    @param time: time slice
+    @param depth: depth levels
+    @param lat: latitudes
+    @param lon: longitudes
+    @return: tuple of (lazy temperature of the bounding box, index picking the selection from it)
+    """
+    positions = [_positions(input_files, name, labels) for name, labels in
+                 (('depth_coord', depth), ('latitude', lat), ('longitude', lon))]
+    my_temp = input_files.thetao.sel(time=time).isel(
+        depth_coord=_bounds(positions[0]), latitude=_bounds(positions[1]), longitude=_bounds(positions[2]))
+    return my_temp, (slice(None),) + np.ix_(*[index - index.min() for index in positions])
+
+
+def _positions(input_files, name: str, labels: list):
+    """
+    Positions of coordinate labels in the input dataset
+
+    @param input_files: input dataset
+    @param name: coordinate name
+    @param labels: coordinate labels
+    @return: numpy array of positions
+    """
+    positions = input_files.indexes[name].get_indexer(labels)
+    if (positions < 0).any():
+        missing = [label for label, position in zip(labels, positions) if position < 0]
+        raise KeyError(f'{name} {missing} not found in input data')
+    return positions
+
+
+def _bounds(positions):
+    """
+    Slice covering all positions
+
+    @param positions: numpy array of positions
+    @return: slice
+    """
+    return slice(positions.min(), positions.max() + 1)
+
+
+class TemperatureCache:
+    """
+    Least recently used cache of yearly temperature fields
+
+    Entries are keyed by year and selection (depth, lat, lon) and are read-only.
+    The cache holds at most max_mb megabytes, blocks larger than that are not cached.
+    If points are given, blocks only hold these points of the (depth, cell) field (read by point_loader if given,
+    otherwise selected from the blocks of loader, which copies them).
+    With chunk_steps, years of more time steps are streamed in chunks by chunks() and not cached.
+    """
+
+    def __init__(self, input_files, max_mb: float = 512, points=None, loader=None, chunk_steps: int = 0,
+                 step_loader=None, point_loader=None):
+        """
+        @param input_files: input dataset with variable "thetao"
+        @param max_mb: memory cap of the cache (MB), 0 disables caching
+        @param points: flat indices into the (depth, cell) field to keep (e.g. from load_wet_points())
+        @param loader: function reading a block with the arguments of load_temperature()
+                       (default: load_temperature(), see SharedInput.load())
+        @param chunk_steps: maximum number of time steps read at once by chunks(), 0 reads whole years
+        @param step_loader: function returning the durations of the time steps of a year with the arguments
+                            (input_files, year) (default: load_step_days(), see prepared.PreparedInput)
+        @param point_loader: function reading the points of a block with the arguments (input_files, year, depth,
+                             lat, lon, points, steps) (default: points selected from the blocks of loader,
+                             see prepared.PreparedInput.load_points())
+        """
+        self.input_files = input_files
+        self.points = points
+        self.loader = loader if loader is not None else load_temperature
+        self.step_loader = step_loader if step_loader is not None else load_step_days
+        self.point_loader = point_loader
+        self.chunk_steps = max(0, int(chunk_steps))
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.streamed = 0
+        self._blocks = OrderedDict()
+        self._step_days = {}
+
+    def step_days(self, year: int):
+        """
+        Durations of the time steps of one year (see load_step_days())
+
+        @return: read-only numpy array of durations (days)
+        """
+        if year not in self._step_days:
+            durations = self.step_loader(self.input_files, year)
+            durations.flags.writeable = False
+            self._step_days[year] = durations
+        return self._step_days[year]
+
+    def chunks(self, year: int, depth: list, lat: list, lon: list):
+        """
+        Iterate over the temperature fields of one year in chunks of at most chunk_steps time steps
+
+        Years of up to chunk_steps time steps (or all years if chunk_steps is 0) are one chunk from get().
+        Longer years are read chunk by chunk in the order of time, only the current chunk is held in memory.
+
+        @return: iterator of tuples of (read-only float32 temperature (step, depth, cell) or (step, point),
+                 durations (days) of the steps, True for the last chunk of the year)
+        """
+        durations = self.step_days(year)
+        if not self.chunk_steps or len(durations) <= self.chunk_steps:
+            yield self.get(year, depth, lat, lon), durations, True
+            return
+        for start in range(0, len(durations), self.chunk_steps):
+            steps = slice(start, min(start + self.chunk_steps, len(durations)))
+            block = self._load(year, depth, lat, lon, steps)
+            block.flags.writeable = False
+            self.streamed += 1
+            yield block, durations[steps], steps.stop == len(durations)
+
+    def get(self, year: int, depth: list, lat: list, lon: list):
+        """
+        Return the temperature fields of one year (see load_temperature())
+
+        @return: read-only float32 temperature (step, depth, cell) or (step, point)
+        """
+        key = (int(year), tuple(depth), tuple(lat), tuple(lon))
+        block = self._blocks.get(key)
+        if block is not None:
+            self.hits += 1
+            self._blocks.move_to_end(key)
+            return block
+
+        self.misses += 1
+        block = self._load(year, depth, lat, lon)
+        block.flags.writeable = False
+        if block.nbytes <= self.max_bytes:
+            self._blocks[key] = block
+            self.nbytes += block.nbytes
+            # Evict least recently used blocks
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return block
+
+    def _load(self, year: int, depth: list, lat: list, lon: list, steps: slice = None):
+        """
+        Read a block of one year (all time steps or steps) with the points of the cache
+
+        @return: float32 temperature (step, depth, cell) or (step, point)
+        """
+        if self.points is not None and self.point_loader is not None:
+            return self.point_loader(self.input_files, year, depth, lat, lon, self.points, steps)
+        if steps is None:
+            block = self.loader(self.input_files, year, depth, lat, lon)
+        else:
+            block = self.loader(self.input_files, year, depth, lat, lon, steps)
+        if self.points is not None:
+            block = block.reshape(len(block), -1)[:, self.points]
+        return block
+
+    def clear(self):
+        """
+        Drop all cached blocks (counters are kept)
+
+        @return: None
+        """
+        self._blocks.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __repr__(self):
+        streamed = f', {self.streamed} streamed chunks' if self.streamed else ''
+        return (f'TemperatureCache({len(self)} blocks, {self.nbytes / 1024 ** 2:.1f} of '
+                f'{self.max_bytes / 1024 ** 2:.1f} MB, {self.hits} hits, {self.misses} misses{streamed})')
+
+
+class SharedInput:
+    """
+    Input dataset opened once and shared by several runs (e.g. the runs of a batch on the same input folder)
+
+    Yearly blocks cover the union of the (depth, lat, lon) selections of all runs. They are read once
+    while they fit into the memory cap, every run takes its selection from the blocks.
+    """
+
+    def __init__(self, input_files, selections: list, max_mb: float = 2048):
+        """
+        @param input_files: input dataset with variable "thetao"
+        @param selections: (depth, lat, lon) lists of labels of every run
+        @param max_mb: memory cap of the cache of yearly blocks (MB)
+        """
+        self.input_files = input_files
+        names = ('depth_coord', 'latitude', 'longitude')
+        # Positions of the union of all selections in the input dataset
+        self.positions = [np.unique(np.concatenate([_positions(input_files, name, selection[axis])
+                                                    for selection in selections]))
+                          for axis, name in enumerate(names)]
+        self.labels = [list(input_files.indexes[name][positions])
+                       for name, positions in zip(names, self.positions)]
+        self.cache = TemperatureCache(input_files, max_mb=max_mb)
+        self._wet = {}
+
+    def _index(self, depth: list, lat: list, lon: list):
+        """
+        Index of a selection within the union of all selections
+
+        @return: tuple for numpy indexing of a (depth, lat, lon) block
+        """
+        return np.ix_(*[np.searchsorted(union, _positions(self.input_files, name, labels))
+                        for union, name, labels in zip(self.positions, ('depth_coord', 'latitude', 'longitude'),
+                                                        (depth, lat, lon))])
+
+    def wet_points(self, first_year: int, final_year: int, depth: list, lat: list, lon: list):
+        """
+        Find the wet points of a selection (see load_wet_points()), the mask of the union is computed once
+
+        @return: sorted flat indices of the wet points into a (depth, cell) field
+        """
+        key = (first_year, final_year)
+        if key not in self._wet:
+            wet = np.zeros([len(labels) for labels in self.labels], dtype=bool)
+            wet.reshape(-1)[load_wet_points(self.input_files, first_year, final_year, *self.labels)] = True
+            self._wet[key] = wet
+        return np.flatnonzero(self._wet[key][self._index(depth, lat, lon)])
+
+    def load(self, input_files, year: int, depth: list, lat: list, lon: list, steps: slice = None):
+        """
+        Select the temperature fields of one year from the shared block (see load_temperature())
+
+        @param input_files: input dataset (ignored, the shared dataset is used)
+        @return: float32 temperature (step, depth, cell) in °C with NaN on masked points
+        """
+        block = self.cache.get(year, *self.labels)
+        if steps is not None:
+            block = block[steps]
+        block = block.reshape((len(block),) + tuple(len(labels) for labels in self.labels))
+        return block[(slice(None),) + self._index(depth, lat, lon)].reshape(len(block), len(depth),
+                                                                            len(lat) * len(lon))
+
+    def __repr__(self):
+        return f'SharedInput({" x ".join(str(len(labels)) for labels in self.labels)} points, {self.cache})'
@@ -0,0 +1,135 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides the time axis of the input temperature data in its own calendar
+(standard, noleap, 360_day, ...):
+- calendar year and duration (days) of every time step (daily, pentad, monthly or any other resolution)
+- start dates of the time steps, used as time index of the input dataset
+"""
+
+import datetime
+
+import cftime
+import numpy as np
+
+# Smallest spacing (days) of time steps in consecutive months that are taken as monthly means
+MONTHLY_MIN_DAYS = 27
+
+
+def decode(values, units: str, calendar: str = 'standard', bounds=None):
+    """
+    Calendar year and duration of every time step of a CF time variable
+
+    Steps in units of months cover their calendar month. Otherwise a step lasts from its lower to its
+    upper bound if bounds are given, or from halfway after the previous step to halfway before the
+    next step (the first and the last step are as long as their neighbour).
+
+    @param values: time values
+    @param units: CF time units (e.g. "months since 1960-01-01", "days since 1980-01-01 00:00:00")
+    @param calendar: CF calendar
+    @param bounds: time bounds (step, 2) in units, None if the file has none
+    @return: tuple of (list of years, list of durations in days)
+    """
+    values = np.asarray(values, dtype='d')
+    if units.startswith('months since'):
+        # Not supported by cftime for most calendars, months have a fixed position within a year
+        reference = cftime.num2date(0, units.replace('months', 'days'), calendar)
+        months = np.floor(values).astype(int) + reference.month - 1
+        years = reference.year + months // 12
+        durations = [month_days(year, month % 12 + 1, calendar) for year, month in zip(years, months)]
+        return years.tolist(), durations
+
+    dates = cftime.num2date(values, units, calendar)
+    if bounds is not None:
+        bounds = np.asarray(bounds, dtype='d')
+        starts = cftime.num2date(bounds[:, 0], units, calendar)
+        ends = cftime.num2date(bounds[:, 1], units, calendar)
+        durations = [(end - start).total_seconds() / 86400 for start, end in zip(starts, ends)]
+    else:
+        durations = step_days(dates, calendar).tolist()
+    return [date.year for date in dates], durations
+
+
+def step_days(dates, calendar: str = 'standard'):
+    """
+    Duration of time steps from their dates
+
+    Dates in consecutive calendar months at least MONTHLY_MIN_DAYS apart are monthly means covering their
+    month, other steps last from halfway after the previous date to halfway before the next date.
+
+    @param dates: dates of the time steps (cftime or datetime objects, ascending)
+    @param calendar: CF calendar of the dates
+    @return: numpy array of durations (days)
+    """
+    dates = list(dates)
+    if len(dates) < 2:
+        if len(dates) == 1 and dates[0].day == 1:
+            # A single monthly field (e.g. an in-memory dataset of one month)
+            return np.array([month_days(dates[0].year, dates[0].month, calendar)])
+        raise ValueError('The duration of a single time step needs time bounds')
+    days = np.asarray(cftime.date2num(dates, 'days since 1970-01-01', calendar), dtype='d')
+    spacing = np.diff(days)
+    if (spacing <= 0).any():
+        raise ValueError('Time steps must be in ascending order')
+    months = np.array([date.year * 12 + date.month for date in dates])
+    if (np.diff(months) == 1).all() and (spacing >= MONTHLY_MIN_DAYS).all():
+        return np.array([month_days(date.year, date.month, calendar) for date in dates])
+    edges = np.concatenate([[days[0] - spacing[0] / 2], (days[1:] + days[:-1]) / 2, [days[-1] + spacing[-1] / 2]])
+    return np.diff(edges)
+
+
+def index_step_days(index):
+    """
+    Duration of the time steps of a time index (see step_days())
+
+    @param index: pandas.DatetimeIndex or xarray.CFTimeIndex
+    @return: numpy array of durations (days)
+    """
+    calendar = getattr(index, 'calendar', None)
+    if calendar is None:
+        return step_days(index.to_pydatetime(), 'standard')
+    return step_days(index, calendar)
+
+
+def step_starts(years: list, durations: list, calendar: str = 'standard'):
+    """
+    Start dates of time steps, the first step of a year starts on January 1
+
+    Steps are placed one after another within their year (squeezed if they add up to more than the year),
+    so the dates select the right year even if a step reaches into the neighbouring year (e.g. pentads).
+
+    @param years: year of every time step
+    @param durations: duration of every time step (days)
+    @return: list of cftime dates
+    """
+    totals = {}
+    for year, duration in zip(years, durations):
+        totals[year] = totals.get(year, 0.) + duration
+    starts = []
+    offset, current = 0., None
+    for year, duration in zip(years, durations):
+        if year != current:
+            offset, current = 0., year
+            scale = min(1., year_days(year, calendar) / totals[year])
+        starts.append(cftime.datetime(year, 1, 1, calendar=calendar) + datetime.timedelta(days=offset * scale))
+        offset += duration
+    return starts
+
+
+def month_days(year: int, month: int, calendar: str = 'standard'):
+    """
+    @return: number of days of a month in a calendar
+    """
+    start = cftime.datetime(year, month, 1, calendar=calendar)
+    end = cftime.datetime(year + month // 12, month % 12 + 1, 1, calendar=calendar)
+    return (end - start).total_seconds() / 86400
+
+
+def year_days(year: int, calendar: str = 'standard'):
+    """
+    @return: number of days of a year in a calendar
+    """
+    start = cftime.datetime(year, 1, 1, calendar=calendar)
+    return (cftime.datetime(year + 1, 1, 1, calendar=calendar) - start).total_seconds() / 86400
@@ -0,0 +1,220 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+This file provides the tools of uncertainty analyses over the growth model coefficients:
+- parameter sets: draws of the coefficients of constants.PARAMETERS from distributions,
+  equation2(), equation3() and the kernels evaluate all draws in one pass over a leading draw axis
+- statistics reduced in-stream over batches of draws (count, mean, std, min, max and P² quantile
+  estimates), memory does not depend on the number of draws
+
+A distribution is a number (fixed value) or a dict with key "distribution" and its arguments:
+    normal: mean, std          lognormal: mean, sigma (of the underlying normal distribution)
+    uniform: min, max          triangular: min, mode, max
+"mean" of normal and "mode" of triangular default to the value in constants.py.
+"""
+
+import numpy as np
+
+from growth_model.constants import PARAMETERS
+
+# Arguments of the supported distributions
+DISTRIBUTIONS = {'normal': ('mean', 'std'), 'lognormal': ('mean', 'sigma'), 'uniform': ('min', 'max'),
+                 'triangular': ('min', 'mode', 'max')}
+
+
+def sample_parameters(distributions: dict, draws: int, seed=None):
+    """
+    Draw parameter sets
+
+    @param distributions: distribution by coefficient name (see constants.PARAMETERS),
+                          coefficients that are not given keep the values of constants.py
+    @param draws: number of parameter sets
+    @param seed: seed of the random generator (None draws different sets every call)
+    @return: dict of arrays (draws,) by coefficient name
+    """
+    unknown = sorted(set(distributions) - set(PARAMETERS))
+    if unknown:
+        raise ValueError(f'Unknown coefficients {unknown}, available are {list(PARAMETERS)}')
+    if draws < 1:
+        raise ValueError(f'Number of draws must be positive, got {draws}')
+    rng = np.random.default_rng(seed)
+
+    parameters = {}
+    for name, spec in distributions.items():
+        if not isinstance(spec, dict):
+            parameters[name] = np.full(draws, float(spec))
+            continue
+        kind = spec.get('distribution')
+        if kind not in DISTRIBUTIONS:
+            raise ValueError(f'Distribution of {name} must be one of {list(DISTRIBUTIONS)}, got "{kind}"')
+        # Defaults of the arguments, overridden by the arguments given in spec
+        args = {'normal': {'mean': PARAMETERS[name]}, 'triangular': {'mode': PARAMETERS[name]}}.get(kind, {})
+        args.update(spec)
+        missing = [arg for arg in DISTRIBUTIONS[kind] if arg not in args]
+        if missing:
+            raise ValueError(f'Distribution {kind} of {name} needs the keys {missing}')
+        values = [float(args[arg]) for arg in DISTRIBUTIONS[kind]]
+        if kind == 'normal':
+            parameters[name] = rng.normal(*values, size=draws)
+        elif kind == 'lognormal':
+            parameters[name] = rng.lognormal(*values, size=draws)
+        elif kind == 'uniform':
+            parameters[name] = rng.uniform(*values, size=draws)
+        else:
+            parameters[name] = rng.triangular(*values, size=draws)
+    return parameters
+
+
+class StreamingStats:
+    """
+    Statistics of a field over draws, updated batch by batch
+
+    Count, mean, standard deviation, minimum and maximum are exact (pairwise update of Chan et al.),
+    quantiles are estimated with the P² algorithm of Jain and Chlamtac (1985), five markers per quantile
+    and cell. The estimate is exact for up to five draws and its error shrinks with the number of draws.
+    """
+
+    def __init__(self, shape, quantiles=(0.05, 0.5, 0.95)):
+        """
+        @param shape: shape of the field of one draw
+        @param quantiles: probabilities of the estimated quantiles
+        """
+        self.shape = tuple(shape)
+        self.quantiles = np.asarray(quantiles, dtype='d')
+        if ((self.quantiles <= 0) | (self.quantiles >= 1)).any():
+            raise ValueError(f'Quantiles must be between 0 and 1, got {list(quantiles)}')
+        self.count = 0
+        self.mean = np.zeros(self.shape)
+        self._m2 = np.zeros(self.shape)
+        self.min = np.full(self.shape, np.inf)
+        self.max = np.full(self.shape, -np.inf)
+        # P² markers (quantile, marker, *shape): heights, positions, desired positions and their increments
+        p = self.quantiles[:, None]
+        self._first = []
+        self._heights = None
+        self._positions = None
+        self._desired = np.hstack([np.zeros_like(p), 2 * p, 4 * p, 2 + 2 * p, np.full_like(p, 4)])
+        self._increments = np.hstack([np.zeros_like(p), p / 2, p, (1 + p) / 2, np.ones_like(p)])
+
+    def update(self, batch):
+        """
+        Add the fields of a batch of draws
+
+        @param batch: array (draws, *shape)
+        @return: None
+        """
+        batch = np.asarray(batch, dtype='d')
+        if batch.shape[1:] != self.shape:
+            raise ValueError(f'Expected fields of shape {self.shape}, got {batch.shape[1:]}')
+        if not len(batch):
+            return
+        count = len(batch)
+        mean = batch.mean(axis=0)
+        delta = mean - self.mean
+        total = self.count + count
+        self._m2 += ((batch - mean) ** 2).sum(axis=0) + delta ** 2 * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+        np.minimum(self.min, batch.min(axis=0), out=self.min)
+        np.maximum(self.max, batch.max(axis=0), out=self.max)
+        for values in batch:
+            self._add(values)
+
+    def _add(self, values):
+        """
+        P² update of the quantile markers with the field of one draw
+        """
+        if self._heights is None:
+            self._first.append(values.copy())
+            if len(self._first) == 5:
+                heights = np.sort(np.stack(self._first), axis=0)
+                self._heights = np.repeat(heights[None], len(self.quantiles), axis=0)
+                self._positions = np.broadcast_to(np.arange(5.).reshape((1, 5) + (1,) * len(self.shape)),
+                                                  self._heights.shape).copy()
+                self._first = []
+            return
+        q, n = self._heights, self._positions
+        # Extreme markers move to new extremes, markers above the value shift by one position
+        np.minimum(q[:, 0], values, out=q[:, 0])
+        np.maximum(q[:, 4], values, out=q[:, 4])
+        n[:, 1:4] += values < q[:, 1:4]
+        n[:, 4] += 1
+        self._desired += self._increments
+        desired = self._desired.reshape(self._desired.shape + (1,) * len(self.shape))
+        for i in (1, 2, 3):
+            d = desired[:, i] - n[:, i]
+            move = (((d >= 1) & (n[:, i + 1] - n[:, i] > 1)) | ((d <= -1) & (n[:, i - 1] - n[:, i] < -1)))
+            if not move.any():
+                continue
+            d = np.where(move, np.sign(d), 0.)
+            parabolic = q[:, i] + d / (n[:, i + 1] - n[:, i - 1]) * (
+                (n[:, i] - n[:, i - 1] + d) * (q[:, i + 1] - q[:, i]) / (n[:, i + 1] - n[:, i])
+                + (n[:, i + 1] - n[:, i] - d) * (q[:, i] - q[:, i - 1]) / (n[:, i] - n[:, i - 1]))
+            neighbour_q = np.where(d > 0, q[:, i + 1], q[:, i - 1])
+            neighbour_n = np.where(d > 0, n[:, i + 1], n[:, i - 1])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                linear = q[:, i] + d * (neighbour_q - q[:, i]) / (neighbour_n - n[:, i])
+            inside = (q[:, i - 1] < parabolic) & (parabolic < q[:, i + 1])
+            q[:, i] = np.where(move, np.where(inside, parabolic, linear), q[:, i])
+            n[:, i] += d
+
+    def state(self):
+        """
+        @return: dict of numpy arrays holding the statistics, see restore()
+        """
+        state = {'count': np.array(self.count), 'mean': self.mean, 'm2': self._m2, 'min': self.min, 'max': self.max,
+                 'first': np.array(self._first).reshape((len(self._first),) + self.shape),
+                 'desired': self._desired}
+        if self._heights is not None:
+            state.update(heights=self._heights, positions=self._positions)
+        return state
+
+    def restore(self, state: dict):
+        """
+        Continue from the statistics of state()
+
+        @param state: dict of numpy arrays from state()
+        @return: None
+        """
+        self.count = int(state['count'])
+        self.mean = np.array(state['mean'], dtype='d')
+        self._m2 = np.array(state['m2'], dtype='d')
+        self.min = np.array(state['min'], dtype='d')
+        self.max = np.array(state['max'], dtype='d')
+        self._first = list(np.array(state['first'], dtype='d'))
+        self._desired = np.array(state['desired'], dtype='d')
+        if 'heights' in state:
+            self._heights = np.array(state['heights'], dtype='d')
+            self._positions = np.array(state['positions'], dtype='d')
+
+    def quantile_estimates(self):
+        """
+        @return: array (quantile, *shape) of the quantile estimates
+        """
+        if self._heights is not None:
+            return self._heights[:, 2].copy()
+        if not self._first:
+            return np.full((len(self.quantiles),) + self.shape, np.nan)
+        # Less than five draws: exact quantiles
+        return np.quantile(np.stack(self._first), self.quantiles, axis=0)
+
+    def result(self):
+        """
+        @return: dict of arrays (shape) with keys mean, std (sample standard deviation), min, max and
+                 one key per quantile (e.g. "q5", "q50", "q97.5")
+        """
+        std = np.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else np.full(self.shape, np.nan)
+        result = {'mean': self.mean.copy(), 'std': std, 'min': self.min.copy(), 'max': self.max.copy()}
+        for probability, values in zip(self.quantiles, self.quantile_estimates()):
+            result[quantile_name(probability)] = values
+        return result
+
+
+def quantile_name(probability: float):
+    """
+    @param probability: probability of a quantile (e.g. 0.05)
+    @return: name of the quantile (e.g. "q5")
+    """
+    return f'q{probability * 100:g}'
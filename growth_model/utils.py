@@ -8,15 +8,21 @@ This file provides supporting functions:
 - saving the multi_dim model output
 """
 
-import xarray as xr
 import tomli
 import pathlib
 import logging
 import sys
+import threading
 import configparser
 
 from logging import config as logging_config
 
+from growth_model import metrics
+
+# The netCDF/HDF5 libraries are not thread-safe: hold this lock while reading or writing
+# netCDF files in a thread that runs concurrently to other netCDF access
+NETCDF_LOCK = threading.Lock()
+
 
 def load_config(config_file):
     """
@@ -45,6 +51,8 @@ def save_netcdf(data, var_name, directory: pathlib.Path, year, age, depths, lat,
     @param dimension_labels: dimension labels
     @return: None
     """
+    import xarray as xr
+
     if "depth_coord" in dimension_labels:
         coordinates = [('depth_coord', depths),
                        ('latitude', lat),
@@ -57,10 +65,25 @@ def save_netcdf(data, var_name, directory: pathlib.Path, year, age, depths, lat,
     da = xr.DataArray(data, dims=dimension_labels, coords=coordinates,
                       name=var_name)
 
-    suffix = str(year) + '_' + var_name + '_' + 'age' + str(age) + '.nc'
-    filename = directory.joinpath(suffix)
+    filename = netcdf_filename(directory, var_name, year, age)
+
+    with metrics.span('save_netcdf'):
+        da.to_netcdf(filename)
+    metrics.count('bytes_written', da.nbytes)
+
+
+def netcdf_filename(directory: pathlib.Path, var_name, year, age):
+    """
+    File name of the data of one variable, year and age (see save_netcdf())
 
-    da.to_netcdf(filename)
+    @param directory: output directory
+    @param var_name: variable name
+    @param year: specific year in a time series
+    @param age: age of individual (years)
+    @return: pathlib.Path
+    """
+    suffix = str(year) + '_' + var_name + '_' + 'age' + str(age) + '.nc'
+    return directory.joinpath(suffix)
 
 
 def init_logger(logger_config: pathlib.Path):
@@ -0,0 +1,116 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the compute backends of the growth kernels against the NumPy reference
+The tests of a backend are skipped if its package is not installed.
+"""
+
+import numpy as np
+import pytest
+
+from growth_model.backends import TOLERANCE, check_backends, get_backend
+from growth_model.kernels import allocate_workspace, integrate_year
+
+FUSED_BACKENDS = ['numexpr', 'numba']
+
+
+@pytest.fixture(params=FUSED_BACKENDS)
+def backend(request):
+    pytest.importorskip(request.param)
+    return get_backend(request.param)
+
+
+def temperature(shape, seed=0):
+    """
+    float32 temperatures between -2 and 30 °C, a tenth of the points and the first cells are NaN (land)
+    """
+    rng = np.random.default_rng(seed)
+    temp = rng.uniform(-2., 30., shape).astype('f')
+    temp[..., rng.random(shape[-1]) < 0.1] = np.nan
+    temp[..., :2] = np.nan
+    return temp
+
+
+def assert_close(actual, expected, rtol=TOLERANCE):
+    # Same land points and differences within float32 rounding relative to the largest value
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected))
+    scale = np.nanmax(np.abs(expected))
+    assert np.nanmax(np.abs(actual - expected)) <= rtol * scale
+
+
+@pytest.mark.parametrize('shape', [(4, 50), (3, 4, 50)])
+def test_parameters(backend, shape):
+    reference = get_backend('numpy')
+    temp = temperature(shape)
+    a = backend.a(temp)
+    b = backend.b(temp)
+    assert a.dtype == temp.dtype and b.dtype == temp.dtype
+    assert_close(a, reference.a(temp), rtol=1e-6)
+    assert_close(b, reference.b(temp), rtol=1e-6)
+    # Scalars fall back to the reference
+    assert backend.a(10.) == reference.a(10.)
+
+
+def grow(backend, weight, temp, dt, days):
+    """
+    Integrate days steps of dt with constant temperature, a and b of shape temp.shape
+    """
+    a = backend.a(temp)
+    b = backend.b(temp) * np.float32(-1.)
+    growth_rates = np.zeros_like(weight)
+    workspace = allocate_workspace(weight.shape, weight.dtype)
+    for _ in range(days):
+        backend.grow_day(weight, growth_rates, a, b, dt, workspace)
+    return weight, growth_rates
+
+
+@pytest.mark.parametrize('dt', [1, 0.5])
+def test_grow_day(backend, dt):
+    temp = temperature((4, 50))
+    expected = grow(get_backend('numpy'), np.ones(temp.shape, dtype='f'), temp, dt, 60)
+    actual = grow(backend, np.ones(temp.shape, dtype='f'), temp, dt, 60)
+    for field, reference in zip(actual, expected):
+        assert_close(field, reference)
+
+
+def test_grow_day_stacked_cohorts(backend):
+    # Fields of stacked cohorts (cohort, depth, cell) share a and b of shape (depth, cell)
+    temp = temperature((4, 50), seed=1)
+    initial = np.array([1., 100., 3000.], dtype='f')[:, None, None]
+    expected = grow(get_backend('numpy'), np.ones((3,) + temp.shape, dtype='f') * initial, temp, 1, 60)
+    actual = grow(backend, np.ones((3,) + temp.shape, dtype='f') * initial, temp, 1, 60)
+    for field, reference in zip(actual, expected):
+        assert_close(field, reference)
+
+
+@pytest.mark.parametrize('stacked', [False, True])
+def test_integrate_year_with_remainder(backend, stacked):
+    # Time steps of real durations (see time_axis.py), dt = 2 days leaves a shorter last step in odd months
+    temp = temperature((12, 4, 50), seed=2)
+    durations = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype='d')
+    shape = ((3,) if stacked else ()) + temp.shape[1:]
+    results = []
+    for candidate in (get_backend('numpy'), backend):
+        weight = np.ones(shape, dtype='f')
+        growth_rates = np.zeros(shape, dtype='f')
+        a = np.zeros(temp.shape[1:], dtype='f')
+        b = np.zeros(temp.shape[1:], dtype='f')
+        integrate_year(temp, weight, growth_rates, a, b, dt=2, parameters=(candidate.a, candidate.b),
+                       durations=durations, backend=candidate)
+        results.append((weight, growth_rates, a, b))
+    for field, reference in zip(results[1], results[0]):
+        assert_close(field, reference)
+
+
+def test_check_backends():
+    results = check_backends((4, 60), days=60, repeat=1)
+    assert set(results) >= {'numpy'}
+    for result in results.values():
+        assert result['max_rel_diff'] <= TOLERANCE
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        get_backend('cuda')
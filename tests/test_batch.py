@@ -0,0 +1,77 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the batch runner
+"""
+
+import pathlib
+
+import numpy as np
+import xarray as xr
+
+from growth_model import cli
+from growth_model.batch import load_runs, plan_tasks, run_batch
+from growth_model.models.multi_dim import multi_dim
+from growth_model.temperature import SharedInput
+
+INPUT_DATA = str(pathlib.Path(__file__).parents[1].joinpath('input_data'))
+
+BATCH = f"""
+[model_settings]
+model = "multi_dim"
+input_data = "{INPUT_DATA}"
+first_year = 1980
+final_year = 1983
+max_age = 2
+depth = [30, 40]
+lon = [-5.75, -5.25, -4.75]
+exp_name = "SODA"
+region = "CelticSea"
+prepared_input = false
+
+[[runs]]
+name = "south"
+lat = [47.25, 47.75]
+
+[[runs]]
+name = "north"
+lat = [47.75, 48.25]
+depth = [40, 50]
+"""
+
+
+def test_runs_share_input(tmp_path, monkeypatch):
+    tmp_path.joinpath('batch.toml').write_text(BATCH)
+    runs = load_runs([str(tmp_path.joinpath('batch.toml'))])
+    assert [run['name'] for run in runs] == ['south', 'north']
+    assert len(plan_tasks(runs)) == 1
+
+    # Input of every run
+    inputs = []
+    run_model = cli.run_model
+
+    def recording_run_model(settings, output, resume=False, shared_input=None):
+        inputs.append(shared_input)
+        run_model(settings, output, resume, shared_input)
+
+    monkeypatch.setattr(cli, 'run_model', recording_run_model)
+    results = run_batch(runs, tmp_path.joinpath('batch'))
+    assert [result['status'] for result in results] == ['ok', 'ok'], results
+    assert len(inputs) == 2 and isinstance(inputs[0], SharedInput) and inputs[1] is inputs[0]
+    # The years 1981 - 1983 grown by the cohorts are read once by the first run and reused by the second
+    assert inputs[0].cache.misses == 3 and inputs[0].cache.hits == 3
+
+    for run in runs:
+        settings = {key: value for key, value in run['settings'].items() if key != 'model'}
+        separate = tmp_path.joinpath('separate', run['name'])
+        multi_dim(**settings, output=separate)
+        # Five variables of the cohort-years 1981 - 1983 (cohorts 1980 and 1981 of ages 1 and 2)
+        paths = sorted(separate.rglob('*.nc'))
+        assert len(paths) == 5 * 4
+        for path in paths:
+            batch_path = tmp_path.joinpath('batch', run['name'], path.relative_to(separate))
+            with xr.open_dataset(path) as expected, xr.open_dataset(batch_path) as ds:
+                xr.testing.assert_identical(ds, expected)
+                assert np.isfinite(ds.to_array()).any()
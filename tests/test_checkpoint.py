@@ -0,0 +1,80 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the checkpoints of multi_dim runs
+"""
+
+import pathlib
+import threading
+
+import numpy as np
+import pytest
+
+from growth_model.checkpoint import Checkpoint
+from growth_model.models.multi_dim import multi_dim
+from growth_model.output import AsyncWriter
+
+INPUT_DATA = str(pathlib.Path(__file__).parents[1].joinpath('input_data'))
+
+
+class BlockedWriter:
+    """
+    Writer whose writes wait until release is set
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.written = []
+
+    def write(self, year, age, fields):
+        self.release.wait()
+        self.written.append((year, age))
+
+    def flush(self):
+        return None
+
+    def pending(self):
+        return []
+
+    def close(self):
+        return None
+
+
+def test_checkpoint_saves_pending_writes(tmp_path):
+    inner = BlockedWriter()
+    writer = AsyncWriter(inner, queue_size=4)
+    for age in (1, 2, 3):
+        writer.write(1980 + age, age, {'weight_3d': np.full((2, 3), age, dtype='f')})
+    checkpoint = Checkpoint(tmp_path.joinpath('checkpoint.npz'), 'run', interval=1)
+    # Saved without waiting for the background writer
+    checkpoint.save(writer, year=1984, weight=np.ones(4, dtype='f'))
+    inner.release.set()
+    writer.close()
+    assert inner.written == [(1981, 1), (1982, 2), (1983, 3)]
+    assert writer.pending() == []
+
+    state = Checkpoint(tmp_path.joinpath('checkpoint.npz'), 'run').load()
+    assert int(state['year']) == 1984
+    np.testing.assert_array_equal(state['weight'], 1.)
+    assert [(year, age) for year, age, _ in state['pending']] == [(1981, 1), (1982, 2), (1983, 3)]
+    for year, age, fields in state['pending']:
+        np.testing.assert_array_equal(fields['weight_3d'], np.full((2, 3), age, dtype='f'))
+
+
+def test_checkpoint_without_pending_writes(tmp_path):
+    checkpoint = Checkpoint(tmp_path.joinpath('checkpoint.npz'), 'run', interval=2)
+    checkpoint.save(None, year=1981)
+    assert not tmp_path.joinpath('checkpoint.npz').exists()
+    checkpoint.save(None, year=1982)
+    state = Checkpoint(tmp_path.joinpath('checkpoint.npz'), 'run').load()
+    assert int(state['year']) == 1982 and state['pending'] == []
+    assert Checkpoint(tmp_path.joinpath('checkpoint.npz'), 'other run').load() is None
+
+
+def test_resume_without_checkpoints(tmp_path):
+    # Checkpoints are disabled by default, --resume would silently start from the beginning
+    with pytest.raises(ValueError, match='checkpoints are disabled'):
+        multi_dim(lat=[47.25], lon=[-11.75], depth=[30], max_age=2, first_year=1980, final_year=1982,
+                  exp_name='test', region='test', input_data=INPUT_DATA, output=tmp_path, resume=True)
@@ -0,0 +1,68 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of multi_dim_dataset(), the multi_dim model on temperature data in memory
+"""
+
+import dask.array
+import numpy as np
+import pytest
+
+from growth_model.models.multi_dim import multi_dim_dataset
+from growth_model.output import OUTPUT_VARIABLES
+
+DEPTH = [30., 40.]
+LAT = [47.25, 47.75, 48.25]
+LON = [-11.75, -11.25, -10.75, -10.25]
+FIRST_YEAR, FINAL_YEAR, MAX_AGE = 1980, 1986, 3
+
+
+@pytest.fixture(scope='module')
+def temperature():
+    rng = np.random.default_rng(7)
+    months = 12 * (FINAL_YEAR - FIRST_YEAR + 1)
+    values = rng.uniform(2., 16., (months, len(DEPTH), len(LAT), len(LON))).astype('f')
+    # Land and a point below the sea floor
+    values[:, :, 0, 0] = np.nan
+    values[:, 1, 2, 3] = np.nan
+    return values
+
+
+def run(temperature, **kwargs):
+    return multi_dim_dataset(temperature, max_age=MAX_AGE, first_year=FIRST_YEAR, final_year=FINAL_YEAR,
+                             depth=DEPTH, lat=LAT, lon=LON, **kwargs)
+
+
+@pytest.mark.parametrize('cohort_mode', ['stacked', 'sequential'])
+def test_lazy_matches_eager(temperature, cohort_mode):
+    lazy = run(temperature)
+    eager = run(temperature, cohort_mode=cohort_mode, lazy=False)
+    for var_name in OUTPUT_VARIABLES:
+        assert isinstance(lazy[var_name].data, dask.array.Array)
+        assert lazy[var_name].data.chunks[0] == (1,) * (FINAL_YEAR - FIRST_YEAR - MAX_AGE + 1)
+        assert isinstance(eager[var_name].data, np.ndarray)
+    assert lazy.compute().identical(eager)
+    assert np.isnan(eager.weight_3d.values[:, :, :, 0, 0]).all()
+    assert not np.isnan(eager.weight_3d.values[:, :, 0, 1:]).any()
+
+
+def test_lazy_cohort(temperature):
+    eager = run(temperature, lazy=False)
+    np.testing.assert_array_equal(run(temperature).weight_3d.sel(cohort=1982).values,
+                                  eager.weight_3d.sel(cohort=1982).values)
+
+
+def test_output_is_computed(temperature, tmp_path):
+    written = run(temperature, output=tmp_path, output_format='store', name='test')
+    assert isinstance(written.weight_3d.data, np.ndarray)
+    assert written.identical(run(temperature).compute())
+    assert tmp_path.joinpath('test.nc').exists()
+
+
+def test_without_cohorts(temperature):
+    # No cohort completes its life cycle within the years
+    ds = multi_dim_dataset(temperature[:24], max_age=MAX_AGE, first_year=FIRST_YEAR, final_year=FIRST_YEAR + 1,
+                           depth=DEPTH, lat=LAT, lon=LON)
+    assert ds.sizes['cohort'] == 0 and ds.sizes['age'] == MAX_AGE
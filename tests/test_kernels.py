@@ -0,0 +1,85 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Regression tests of the vectorized integration kernel against the original month x day x depth loop of multi_dim
+"""
+
+import numpy as np
+import pytest
+
+from growth_model.constants import C_AVG
+from growth_model.equations import equation2, equation3
+from growth_model.kernels import allocate_workspace, integrate_year
+
+
+def reference_year(temp_3d, weight, growth_rates, dt=1):
+    """
+    One year of the original multi_dim loop (before the vectorized kernel), updates weight and growth_rates
+
+    @return: tuple of (a, b) of the last day
+    """
+    length_depth = temp_3d.shape[1]
+    a = np.zeros(shape=weight.shape, dtype='f')
+    b = np.zeros(shape=weight.shape, dtype='f')
+    for mon in np.arange(0, 12):
+        for _ in np.arange(0, 30):
+            for i in np.arange(0, length_depth):
+                a[i, :] = equation2(temp_3d[mon, i, :])
+                b[i, :] = equation3(temp_3d[mon, i, :]) * (-1.)
+                growth_rates[i, :] = 0.01 * (a[i, :] * weight[i, :] ** b[i, :] - C_AVG)
+                growth_rates[i, :] = np.where(growth_rates[i, :] < 0, 0, growth_rates[i, :])
+                weight[i, :] = weight[i, :] * (1. + dt * growth_rates[i, :])
+    return a, b
+
+
+def synthetic_temperature(years, depth=4, cells=30, seed=0):
+    """
+    Monthly temperature fields (year, month, depth, cell) in float32 with land points (NaN) as read by multi_dim
+    """
+    rng = np.random.default_rng(seed)
+    temp = rng.uniform(-2., 20., size=(years, 12, depth, cells)).astype('f')
+    temp[..., :3] = np.nan
+    temp[:, :, -1, 3:6] = np.nan
+    return temp
+
+
+@pytest.mark.parametrize('years', [1, 3])
+def test_integrate_year_matches_original_loop(years):
+    temp = synthetic_temperature(years)
+    shape = temp.shape[2:]
+    weight_ref = np.ones(shape, dtype='f')
+    rates_ref = np.zeros(shape, dtype='f')
+    weight = np.ones(shape, dtype='f')
+    rates = np.zeros(shape, dtype='f')
+    a = np.zeros(shape, dtype='f')
+    b = np.zeros(shape, dtype='f')
+    workspace = allocate_workspace(shape)
+    for year_temp in temp:
+        a_ref, b_ref = reference_year(year_temp, weight_ref, rates_ref)
+        integrate_year(year_temp, weight, rates, a, b, workspace=workspace)
+        # Bit-identical, NaN on the same (land) points
+        np.testing.assert_array_equal(weight, weight_ref)
+        np.testing.assert_array_equal(rates, rates_ref)
+        np.testing.assert_array_equal(a, a_ref)
+        np.testing.assert_array_equal(b, b_ref)
+    assert np.isnan(weight[:, :3]).all()
+    assert np.isfinite(weight[:-1, 3:]).all()
+
+
+def test_integrate_year_stacked_cohorts_match_original_loop():
+    # Stacked cohorts (cohort, depth, cell) share a and b of the year
+    temp = synthetic_temperature(1, seed=1)[0]
+    initial = np.array([1., 250., 2000.], dtype='f')
+    weight = np.ones((len(initial),) + temp.shape[1:], dtype='f') * initial[:, None, None]
+    rates = np.zeros_like(weight)
+    a = np.zeros(temp.shape[1:], dtype='f')
+    b = np.zeros(temp.shape[1:], dtype='f')
+    integrate_year(temp, weight, rates, a, b)
+    for cohort, value in enumerate(initial):
+        weight_ref = np.full(temp.shape[1:], value, dtype='f')
+        rates_ref = np.zeros(temp.shape[1:], dtype='f')
+        reference_year(temp, weight_ref, rates_ref)
+        np.testing.assert_array_equal(weight[cohort], weight_ref)
+        np.testing.assert_array_equal(rates[cohort], rates_ref)
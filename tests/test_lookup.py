@@ -0,0 +1,64 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the lookup tables of the parameters a and b against the exact formulas
+"""
+
+import numpy as np
+import pytest
+
+from growth_model.equations import equation2, equation3
+from growth_model.lookup import LUT_MAX_TEMP, LUT_MIN_TEMP, ParameterTable, parameter_functions
+
+
+def relative_error(table_function, equation, temp):
+    exact = equation(temp)
+    return np.abs(table_function(temp) - exact) / np.abs(exact)
+
+
+@pytest.mark.parametrize('lut_step', [0.001, 0.01, 0.05, 0.1, 0.5, 1.])
+def test_error_within_bound(lut_step):
+    table = ParameterTable(lut_step)
+    # Dense temperatures, several points in every interval of the table
+    temp = np.linspace(LUT_MIN_TEMP, LUT_MAX_TEMP, 450001)
+    assert relative_error(table.a, equation2, temp).max() <= table.max_error['a']
+    assert relative_error(table.b, equation3, temp).max() <= table.max_error['b']
+
+
+def test_error_within_bound_float32_temperature():
+    # The multi_dim model passes float32 fields
+    table = ParameterTable()
+    temp = np.linspace(-2., 30., 100001, dtype='f')
+    for table_function, equation, name in ((table.a, equation2, 'a'), (table.b, equation3, 'b')):
+        values = table_function(temp)
+        assert values.dtype == np.float64 and values.shape == temp.shape
+        # Exact values at the float32 temperatures
+        exact = equation(temp.astype('d'))
+        assert (np.abs(values - exact) / np.abs(exact)).max() <= table.max_error[name]
+
+
+def test_default_error_bound():
+    # Documented in ParameterTable: below 1e-6 with the default step
+    table = ParameterTable()
+    assert table.max_error['a'] < 1e-6
+    assert table.max_error['b'] < 1e-6
+
+
+def test_outside_of_table_and_nan():
+    table = ParameterTable(0.1, min_temp=0., max_temp=10.)
+    temp = np.array([-3., 12.5, np.nan])
+    np.testing.assert_array_equal(table.a(temp), equation2(temp))
+    np.testing.assert_array_equal(table.b(temp), equation3(temp))
+    assert table.a(-3.) == equation2(-3.)
+
+
+def test_parameter_functions_lut():
+    a_function, b_function = parameter_functions('lut', 0.05)
+    table = ParameterTable(0.05)
+    temp = np.linspace(0., 20., 1001)
+    assert relative_error(a_function, equation2, temp).max() <= table.max_error['a']
+    assert relative_error(b_function, equation3, temp).max() <= table.max_error['b']
+    with pytest.raises(ValueError):
+        parameter_functions('spline')
@@ -0,0 +1,95 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the manifest of the input files
+"""
+
+import os
+import shutil
+import pathlib
+
+import netCDF4
+import pytest
+
+from growth_model import manifest
+from growth_model.manifest import MANIFEST_NAME, load_manifest, select_files, year_hashes
+
+INPUT_DATA = pathlib.Path(__file__).parents[1].joinpath('input_data')
+
+
+@pytest.fixture
+def input_data(tmp_path):
+    # Copy of the input files, so files can be changed
+    for path in INPUT_DATA.glob('*.nc'):
+        shutil.copy2(path, tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def scanned(monkeypatch):
+    # Names of the scanned files
+    names = []
+    scan = manifest._scan
+
+    def counting_scan(path, stat):
+        names.append(path.name)
+        return scan(path, stat)
+
+    monkeypatch.setattr(manifest, '_scan', counting_scan)
+    return names
+
+
+def test_rescan_changed_files(input_data, scanned):
+    files = load_manifest(input_data)
+    assert len(files) == len(scanned) == 10
+    assert input_data.joinpath(MANIFEST_NAME).exists()
+    del scanned[:]
+
+    assert load_manifest(input_data) == files
+    assert scanned == []
+
+    # A file with a new modification time and a file with new content
+    changed = sorted(input_data.glob('*.nc'))
+    stat = changed[2].stat()
+    os.utime(changed[2], (stat.st_atime, stat.st_mtime + 10))
+    shutil.copy(changed[4], changed[3])
+    rescanned = load_manifest(input_data)
+    assert sorted(scanned) == [changed[2].name, changed[3].name]
+    assert rescanned[changed[3].name]['hash'] == files[changed[4].name]['hash']
+    assert rescanned[changed[2].name]['hash'] == files[changed[2].name]['hash']
+
+    # New and removed files
+    del scanned[:]
+    changed[0].unlink()
+    shutil.copy2(changed[1], input_data.joinpath('copy.nc'))
+    files = load_manifest(input_data)
+    assert scanned == ['copy.nc'] and changed[0].name not in files
+
+
+def test_select_files(input_data, scanned):
+    paths, years, durations, calendar = select_files(input_data, 1982, 1984)
+    assert [path.name[:4] for path in paths] == ['1982', '1983', '1984']
+    assert years == [1982] * 12 + [1983] * 12 + [1984] * 12
+    assert durations == [30.] * 36 and calendar == '360_day'
+    with pytest.raises(ValueError, match=r'for the years \[1990, 1991\]'):
+        select_files(input_data, 1988, 1991)
+    with pytest.raises(ValueError, match='No "salinity" data'):
+        select_files(input_data, 1982, 1984, variable='salinity')
+
+    input_data.joinpath('1983_temp_SODA_masked_north_atlantic.nc_30-580m_CelticSea.nc').unlink()
+    with pytest.raises(ValueError, match=r'for the years \[1983\]'):
+        select_files(input_data, 1982, 1984)
+
+
+def test_year_hashes(input_data):
+    hashes = year_hashes(input_data, 1981, 1983)
+    assert sorted(hashes) == [1981, 1982, 1983] and len(set(hashes.values())) == 3
+    # The hash of a year changes with the content of its file
+    with netCDF4.Dataset(input_data.joinpath('1982_temp_SODA_masked_north_atlantic.nc_30-580m_CelticSea.nc'),
+                         'a') as ds:
+        ds['thetao'][0, 0, 0, 0] = 10.
+    changed = year_hashes(input_data, 1981, 1983)
+    assert changed[1982] != hashes[1982]
+    assert changed[1981] == hashes[1981] and changed[1983] == hashes[1983]
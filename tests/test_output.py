@@ -0,0 +1,149 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the writers of the multi_dim output
+"""
+
+import threading
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from growth_model.output import AsyncWriter, FileWriter
+from growth_model.utils import netcdf_filename
+
+DEPTH = [30., 40.]
+LON = [-11.75, -11.25, -10.75, -10.25]
+
+
+class RecordingWriter:
+    """
+    Writer that records its calls, writes wait until release is set and fail for the year fail_year
+    """
+
+    def __init__(self, fail_year=None):
+        self.fail_year = fail_year
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def write(self, year, age, fields):
+        self.started.set()
+        self.release.wait()
+        if year == self.fail_year:
+            raise OSError(f'Cannot write {year}')
+        self.calls.append(('write', year, age, float(fields['weight_3d'].mean())))
+
+    def flush(self):
+        self.calls.append(('flush',))
+
+    def pending(self):
+        return []
+
+    def close(self):
+        self.calls.append(('close',))
+
+
+def fields(depth, lat, lon, value):
+    return {'weight_3d': np.full((len(depth), len(lat), len(lon)), value, dtype='f'),
+            'weight_max': np.full((len(lat), len(lon)), value, dtype='f')}
+
+
+def read(output_dir, var_name='weight_3d', year=1981, age=1):
+    with xr.open_dataset(netcdf_filename(output_dir.joinpath(var_name), var_name, year, age)) as ds:
+        return ds[var_name].load()
+
+
+def test_regions_fill_the_whole_grid(tmp_path):
+    lat = [47.25, 47.75, 48.25]
+    for region, value in (((slice(0, 2), slice(0, 4)), 1.), ((slice(2, 3), slice(0, 4)), 2.)):
+        writer = FileWriter(tmp_path, DEPTH, lat, LON, region=region, variables=['weight_3d', 'weight_max'])
+        writer.write(1981, 1, fields(DEPTH, lat[region[0]], LON, value))
+    data = read(tmp_path)
+    assert data.shape == (2, 3, 4)
+    np.testing.assert_array_equal(data.values[:, :2], 1.)
+    np.testing.assert_array_equal(data.values[:, 2:], 2.)
+
+
+def test_regions_of_another_grid(tmp_path):
+    # Files of an earlier run on 10 latitudes in the same output folder
+    full_lat = list(np.arange(47.25, 52., 0.5))
+    FileWriter(tmp_path, DEPTH, full_lat, LON).write(1981, 1, fields(DEPTH, full_lat, LON, 5.))
+    lat = full_lat[:3]
+    writer = FileWriter(tmp_path, DEPTH, lat, LON, region=(slice(0, 3), slice(0, 4)), variables=['weight_3d'])
+    with pytest.raises(ValueError, match='another latitude grid'):
+        writer.write(1981, 1, fields(DEPTH, lat, LON, 1.))
+
+    # Replaced by the files of the whole grid of the run (see multi_dim._run_tiled())
+    writer.create_grids([1980], max_age=1)
+    writer.write(1981, 1, fields(DEPTH, lat, LON, 1.))
+    data = read(tmp_path)
+    np.testing.assert_array_equal(data.latitude, lat)
+    np.testing.assert_array_equal(data.values, 1.)
+
+
+def test_async_writer_reraises_errors():
+    inner = RecordingWriter(fail_year=1982)
+    inner.release.set()
+    writer = AsyncWriter(inner, queue_size=2)
+    writer.write(1981, 1, fields(DEPTH, [47.25], LON, 1.))
+    writer.write(1982, 1, fields(DEPTH, [47.25], LON, 2.))
+    writer.write(1983, 1, fields(DEPTH, [47.25], LON, 3.))
+    # The error of the background thread is raised by close() after the queue is drained
+    with pytest.raises(OSError, match='Cannot write 1982'):
+        writer.close()
+    # Items after the error are not written, the underlying writer is closed anyway
+    assert inner.calls == [('write', 1981, 1, 1.), ('close',)]
+    assert writer.pending() == []
+
+    # ... or by the next write() or flush()
+    inner = RecordingWriter(fail_year=1981)
+    inner.release.set()
+    writer = AsyncWriter(inner)
+    writer.write(1981, 1, fields(DEPTH, [47.25], LON, 1.))
+    writer._queue.join()
+    for call in (writer.flush, lambda: writer.write(1982, 1, fields(DEPTH, [47.25], LON, 2.))):
+        with pytest.raises(OSError, match='Cannot write 1981'):
+            call()
+    with pytest.raises(OSError):
+        writer.close()
+
+
+def test_async_writer_backpressure():
+    inner = RecordingWriter()
+    writer = AsyncWriter(inner, queue_size=2)
+    writer.write(1981, 1, fields(DEPTH, [47.25], LON, 1.))
+    # The background thread is blocked in the first write, two items fill the queue
+    assert inner.started.wait(timeout=10.)
+    writer.write(1982, 1, fields(DEPTH, [47.25], LON, 2.))
+    writer.write(1983, 1, fields(DEPTH, [47.25], LON, 3.))
+    producer = threading.Thread(target=writer.write, args=(1984, 1, fields(DEPTH, [47.25], LON, 4.)))
+    producer.start()
+    producer.join(timeout=0.5)
+    assert producer.is_alive()
+    assert [(year, age) for year, age, _ in writer.pending()] == [(1981, 1), (1982, 1), (1983, 1), (1984, 1)]
+    inner.release.set()
+    producer.join(timeout=10.)
+    assert not producer.is_alive()
+    writer.close()
+    assert [call[1] for call in inner.calls[:-1]] == [1981, 1982, 1983, 1984]
+
+
+def test_async_writer_close_drains_queue():
+    inner = RecordingWriter()
+    writer = AsyncWriter(inner, queue_size=8)
+    buffer = fields(DEPTH, [47.25], LON, 0.)
+    for year in range(1981, 1986):
+        buffer['weight_3d'][:] = year
+        # Fields are copied when submitted, the buffer is reused
+        writer.write(year, 1, buffer)
+    # Flushed after the next written item
+    writer.flush()
+    threading.Timer(0.2, inner.release.set).start()
+    writer.close()
+    assert writer.pending() == [] and writer.items == 5
+    assert inner.calls == ([('write', 1981, 1, 1981.), ('flush',)]
+                           + [('write', year, 1, float(year)) for year in range(1982, 1986)] + [('close',)])
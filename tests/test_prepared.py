@@ -0,0 +1,59 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the prepared input of the multi_dim model
+"""
+
+import pathlib
+
+import numpy as np
+import pytest
+
+from growth_model.prepared import open_prepared, prepare
+from growth_model.temperature import TemperatureCache
+
+INPUT_DATA = str(pathlib.Path(__file__).parents[1].joinpath('input_data'))
+DEPTH = [30, 40, 50, 60, 70, 80, 90, 100, 115, 135, 160, 190, 230, 280, 340, 410, 490, 580]
+LAT = [47.25, 47.75, 48.25, 48.75, 49.25]
+LON = [-11.75, -11.25, -10.75, -10.25, -9.75, -9.25, -8.75, -8.25, -7.75, -7.25, -6.75, -6.25, -5.75, -5.25]
+
+
+@pytest.fixture(scope='module')
+def prepared(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('prepared')
+    prepare(INPUT_DATA, 1980, 1982, DEPTH, LAT, LON, str(directory))
+    return open_prepared(INPUT_DATA, 1980, 1982, DEPTH, LAT, LON, str(directory))
+
+
+def cache(prepared, points, chunk_steps=0):
+    return TemperatureCache(prepared, points=points, loader=prepared.load, chunk_steps=chunk_steps,
+                            step_loader=prepared.load_step_days, point_loader=prepared.load_points)
+
+
+def expected(prepared, year, depth, lat, lon, points):
+    block = prepared.load(None, year, depth, lat, lon)
+    return block.reshape(len(block), -1)[:, points]
+
+
+@pytest.mark.parametrize('chunk_steps', [0, 5])
+def test_wet_points_are_views(prepared, chunk_steps):
+    points = prepared.wet_points(1980, 1982, DEPTH, LAT, LON)
+    assert 0 < len(points) < len(DEPTH) * len(LAT) * len(LON)
+    temperature = cache(prepared, points, chunk_steps)
+    for year in (1980, 1982):
+        blocks = [block for block, _, _ in temperature.chunks(year, DEPTH, LAT, LON)]
+        assert all(np.shares_memory(block, prepared.compact) and not block.flags.writeable for block in blocks)
+        np.testing.assert_array_equal(np.concatenate(blocks), expected(prepared, year, DEPTH, LAT, LON, points))
+    assert not np.isnan(temperature.get(1981, DEPTH, LAT, LON)).all(axis=0).any()
+
+
+def test_other_points_are_copied(prepared):
+    # Points of fewer years or of a tile are selected from the (step, depth, cell) layout
+    for depth, lat, lon, points in ((DEPTH, LAT, LON, prepared.wet_points(1980, 1982, DEPTH, LAT, LON)[::2]),
+                                    (DEPTH, LAT[1:3], LON[:4], prepared.wet_points(1980, 1982, DEPTH, LAT[1:3],
+                                                                                   LON[:4]))):
+        block = cache(prepared, points).get(1981, depth, lat, lon)
+        assert not np.shares_memory(block, prepared.compact)
+        np.testing.assert_array_equal(block, expected(prepared, 1981, depth, lat, lon, points))
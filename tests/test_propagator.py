@@ -0,0 +1,78 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Accuracy of the monthly propagator against the daily integrator of multi_dim
+"""
+
+import numpy as np
+import pytest
+
+from growth_model.kernels import allocate_workspace, integrate_year
+from growth_model.propagator import PROPAGATOR_LOG_WEIGHT_STEP, PROPAGATOR_TEMP_STEP, monthly_propagators
+
+# Maximum relative error of weight and absolute error of the growth rate (per day) of the default tables
+WEIGHT_TOLERANCE = 1e-3
+GROWTH_RATE_TOLERANCE = 1e-5
+
+
+def integrate(temp, integrator, steps=(PROPAGATOR_TEMP_STEP, PROPAGATOR_LOG_WEIGHT_STEP), durations=None):
+    """
+    Integrate one cohort over all years of temp (year, month, depth, cell)
+
+    @return: list of (weight, growth rates) at the end of every year
+    """
+    shape = temp.shape[2:]
+    weight = np.ones(shape, dtype='f')
+    rates = np.zeros(shape, dtype='f')
+    a = np.zeros(shape, dtype='f')
+    b = np.zeros(shape, dtype='f')
+    workspace = allocate_workspace(shape)
+    propagators = monthly_propagators(integrator, 1, 30, *steps)
+    results = []
+    for year_temp in temp:
+        integrate_year(year_temp, weight, rates, a, b, workspace=workspace, propagators=propagators,
+                       durations=durations)
+        results.append((weight.copy(), rates.copy()))
+    return results
+
+
+@pytest.fixture(scope='module')
+def temperature():
+    # Five years of a cohort, land points (NaN)
+    rng = np.random.default_rng(1)
+    temp = rng.uniform(-2., 20., size=(5, 12, 4, 50)).astype('f')
+    temp[..., :3] = np.nan
+    return temp
+
+
+def max_errors(temp, steps=(PROPAGATOR_TEMP_STEP, PROPAGATOR_LOG_WEIGHT_STEP)):
+    weight_error, rate_error = 0., 0.
+    for (weight, rates), (daily_weight, daily_rates) in zip(integrate(temp, 'monthly', steps),
+                                                            integrate(temp, 'daily')):
+        np.testing.assert_array_equal(np.isnan(weight), np.isnan(daily_weight))
+        weight_error = max(weight_error, float(np.nanmax(np.abs(weight.astype('d') / daily_weight - 1))))
+        rate_error = max(rate_error, float(np.nanmax(np.abs(rates.astype('d') - daily_rates))))
+    return weight_error, rate_error
+
+
+def test_default_tables_within_tolerance(temperature):
+    weight_error, rate_error = max_errors(temperature)
+    assert weight_error < WEIGHT_TOLERANCE
+    assert rate_error < GROWTH_RATE_TOLERANCE
+
+
+def test_coarser_tables_are_less_accurate(temperature):
+    coarse = max_errors(temperature, (2 * PROPAGATOR_TEMP_STEP, 2 * PROPAGATOR_LOG_WEIGHT_STEP))
+    default = max_errors(temperature)
+    assert coarse[0] > default[0] and coarse[1] > default[1]
+
+
+def test_other_durations_are_integrated_daily(temperature):
+    # Months of 31 days do not match the tables of 30 days
+    durations = np.full(12, 31.)
+    for monthly, daily in zip(integrate(temperature, 'monthly', durations=durations),
+                              integrate(temperature, 'daily', durations=durations)):
+        np.testing.assert_array_equal(monthly[0], daily[0])
+        np.testing.assert_array_equal(monthly[1], daily[1])
@@ -0,0 +1,150 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the reductions of the multi_dim output and of their writer
+"""
+
+import warnings
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from growth_model.reductions import Reduction, ReductionWriter, parse_reductions
+
+DEPTH = [5., 15., 30., 50.]
+LAT = [47., 47.5, 48.]
+LON = [-12., -11.5, -11., -10.5]
+GRID = {'depth_coord': DEPTH, 'latitude': LAT, 'longitude': LON}
+MAX_AGE = 3
+
+
+def field(seed):
+    """
+    Random field of a 3d output variable with land points (NaN)
+    """
+    values = np.random.default_rng(seed).uniform(1., 100., size=(len(DEPTH), len(LAT), len(LON)))
+    values[:, 0, 0] = np.nan
+    values[3] = np.nan
+    return values.astype('f')
+
+
+def test_box():
+    reduction = Reduction('weight_3d', GRID, MAX_AGE, depth=[10, 30], lat=[48, 47.4], lon=[-11.5, -11.])
+    np.testing.assert_array_equal(reduction.coords['depth_coord'], [15., 30.])
+    np.testing.assert_array_equal(reduction.coords['latitude'], [47.5, 48.])
+    np.testing.assert_array_equal(reduction.coords['longitude'], [-11.5, -11.])
+    values = field(1)
+    np.testing.assert_array_equal(reduction.reduce(values), values[1:3, 1:3, 1:3])
+    # Surface variables have no depth dimension
+    surface = Reduction('weight_max', GRID, MAX_AGE, lat=[47.5, 48])
+    np.testing.assert_array_equal(surface.reduce(values[0]), values[0, 1:])
+    with pytest.raises(ValueError, match='no dimension depth_coord'):
+        Reduction('weight_max', GRID, MAX_AGE, depth=[0, 10])
+    with pytest.raises(ValueError, match='No latitude within'):
+        Reduction('weight_3d', GRID, MAX_AGE, lat=[50, 60])
+    with pytest.raises(ValueError, match=r'Expected \[min, max\]'):
+        Reduction('weight_3d', GRID, MAX_AGE, lon=[-12])
+
+
+@pytest.mark.parametrize('method, function', [('mean', np.nanmean), ('max', np.nanmax), ('min', np.nanmin)])
+@pytest.mark.parametrize('dims, axes', [(['depth'], (0,)), (['lat', 'longitude'], (1, 2)),
+                                        (['depth', 'lat', 'lon'], (0, 1, 2))])
+def test_methods(method, function, dims, axes):
+    reduction = Reduction('weight_3d', GRID, MAX_AGE, dims=dims, method=method)
+    assert reduction.name == f'weight_3d_{method}'
+    values = field(2)
+    with warnings.catch_warnings():
+        # Land points (NaN) leave cells without a valid point
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        expected = function(values.astype('d'), axis=axes)
+    np.testing.assert_array_equal(reduction.reduce(values), expected)
+
+
+def test_statistics_across_cohorts():
+    # Quantiles are exact for less than five cohorts (see uncertainty.StreamingStats)
+    reduction = Reduction('weight_3d', GRID, MAX_AGE, dims='depth', statistics=['mean', 'std', 'min', 'max', 'q5',
+                                                                                 'q50', 'q97.5'])
+    cohorts = [1980, 1981, 1982, 1983]
+    for cohort in cohorts:
+        reduction.add(cohort, 2, field(cohort))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        reduced = np.stack([np.nanmean(field(cohort).astype('d'), axis=0) for cohort in cohorts])
+    ds = reduction.dataset(list(range(1, MAX_AGE + 1)))
+    np.testing.assert_array_equal(ds['weight_3d_mean_count'], [0, 4, 0])
+    summary = ds.isel(age=1)
+    np.testing.assert_allclose(summary['weight_3d_mean_mean'], reduced.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(summary['weight_3d_mean_std'], reduced.std(axis=0, ddof=1), rtol=1e-10)
+    np.testing.assert_array_equal(summary['weight_3d_mean_min'], reduced.min(axis=0))
+    np.testing.assert_array_equal(summary['weight_3d_mean_max'], reduced.max(axis=0))
+    for statistic, probability in (('q5', 0.05), ('q50', 0.5), ('q97.5', 0.975)):
+        np.testing.assert_allclose(summary[f'weight_3d_mean_{statistic}'],
+                                   np.quantile(reduced, probability, axis=0), rtol=1e-12)
+    with pytest.raises(ValueError, match='Unknown statistic "median"'):
+        Reduction('weight_3d', GRID, MAX_AGE, statistics=['median'])
+
+
+def test_parse_reductions():
+    specs = [{'variable': 'weight_3d', 'dims': ['depth'], 'method': 'max'},
+             {'variable': 'weight_3d', 'name': 'weight_box', 'lat': [47.5, 48]}]
+    reductions = parse_reductions(specs, DEPTH, LAT, LON, MAX_AGE)
+    assert [reduction.name for reduction in reductions] == ['weight_3d_max', 'weight_box']
+    assert parse_reductions(None, DEPTH, LAT, LON, MAX_AGE) == []
+    with pytest.raises(ValueError, match=r"unique names, got \['weight_3d'\]"):
+        parse_reductions([{'variable': 'weight_3d'}, {'variable': 'weight_3d', 'lon': [-12, -11]}],
+                         DEPTH, LAT, LON, MAX_AGE)
+    with pytest.raises(ValueError, match=r"Invalid reduction .* got \['box'\]"):
+        parse_reductions([{'variable': 'weight_3d', 'box': [0, 10]}], DEPTH, LAT, LON, MAX_AGE)
+    with pytest.raises(ValueError, match='expected a variable'):
+        parse_reductions([{'dims': ['depth']}], DEPTH, LAT, LON, MAX_AGE)
+    with pytest.raises(ValueError, match='Unknown variable "weight"'):
+        parse_reductions([{'variable': 'weight'}], DEPTH, LAT, LON, MAX_AGE)
+
+
+def writer(tmp_path, append=False):
+    specs = [{'variable': 'weight_3d', 'dims': ['depth', 'lat', 'lon']},
+             {'variable': 'weight_max', 'name': 'weight_max_stats', 'dims': ['lat'], 'statistics': ['mean', 'q50']}]
+    return ReductionWriter(parse_reductions(specs, DEPTH, LAT, LON, MAX_AGE), tmp_path.joinpath('run_summary.nc'),
+                           MAX_AGE, state_file=tmp_path.joinpath('state.npz'), append=append)
+
+
+def write(reduction_writer, year, age):
+    seed = 100 * year + age
+    reduction_writer.write(year, age, {'weight_3d': field(seed), 'weight_max': field(seed)[0]})
+
+
+def test_flush_restore(tmp_path):
+    # Run without interruption
+    complete = writer(tmp_path.joinpath('complete'))
+    for year in (1980, 1981, 1982):
+        for age in range(1, MAX_AGE + 1):
+            write(complete, year, age)
+    complete.close()
+
+    # Run that stops after the checkpoint of 1981 and writes 1982 again after it was interrupted
+    first = writer(tmp_path)
+    for year in (1980, 1981):
+        for age in range(1, MAX_AGE + 1):
+            write(first, year, age)
+    first.flush()
+    write(first, 1982, 1)
+    resumed = writer(tmp_path, append=True)
+    assert resumed.done == {(year, age) for year in (1980, 1981) for age in range(1, MAX_AGE + 1)}
+    for year in (1981, 1982):
+        for age in range(1, MAX_AGE + 1):
+            # The cohort-years of 1981 are skipped, they are in the restored summaries
+            write(resumed, year, age)
+    resumed.close()
+
+    with xr.open_dataset(complete.filename) as expected, xr.open_dataset(resumed.filename) as ds:
+        xr.testing.assert_identical(ds, expected)
+        np.testing.assert_array_equal(ds['weight_max_stats_count'], [3, 3, 3])
+
+    # Summaries of other reductions are ignored
+    other = ReductionWriter(parse_reductions([{'variable': 'weight_3d'}], DEPTH, LAT, LON, MAX_AGE),
+                            tmp_path.joinpath('other_summary.nc'), MAX_AGE, state_file=tmp_path.joinpath('state.npz'),
+                            append=True)
+    assert other.done == set()
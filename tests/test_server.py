@@ -0,0 +1,79 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the growth query service with a local client
+"""
+
+import threading
+
+import numpy as np
+import pytest
+
+from growth_model.constants import C_AVG
+from growth_model.equations import equation2, equation3
+from growth_model.server import Client, GrowthService, create_server
+
+TEMPS = np.array([2., 5.5, 10., 14.])
+WEIGHTS = np.array([1., 50., 1000., 2500.])
+
+
+@pytest.fixture(scope='module')
+def client():
+    server = create_server(GrowthService(), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    with Client(port=server.server_address[1]) as client:
+        yield client
+    server.shutdown()
+    server.server_close()
+
+
+def expected(temp, weight, dt=1):
+    a = equation2(temp)
+    b = equation3(temp) * (-1.)
+    growth_rate = 0.01 * (a * weight ** b - C_AVG)
+    return {'a': a, 'b': b, 'growth_rate': growth_rate, 'final_weight': weight * (1. + dt * growth_rate)}
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_growth(client, binary):
+    temp, weight = np.meshgrid(TEMPS, WEIGHTS, indexing='ij')
+    answer = client.growth(temp, weight, dt=2, binary=binary)
+    for name, values in expected(temp, weight, dt=2).items():
+        assert answer[name].shape == temp.shape
+        np.testing.assert_allclose(answer[name], values, rtol=1e-14)
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_lut_engine(client, binary):
+    answer = client.growth(TEMPS, 50., engine='lut', binary=binary)
+    for name, values in expected(TEMPS, 50.).items():
+        np.testing.assert_allclose(answer[name], values, rtol=1e-5)
+
+
+def test_land(client):
+    answer = client.growth([np.nan, 10.], 50.)
+    assert np.isnan(answer['growth_rate'][0]) and not np.isnan(answer['growth_rate'][1])
+
+
+@pytest.mark.parametrize('request_kwargs', [dict(temp=10., weight=0.), dict(temp=10., weight=-5., binary=True),
+                                            dict(temp=10., weight=50., engine='unknown'),
+                                            dict(weight=50., year=1980, month=1, depth=30, lat=47.25, lon=-11.75)])
+def test_bad_requests(client, request_kwargs):
+    errors = client.stats()['errors']
+    with pytest.raises(ValueError, match='Growth service error 400'):
+        client.growth(**request_kwargs)
+    # The connection is still usable after an error
+    assert client.health()
+    assert client.stats()['errors'] == errors + 1
+
+
+def test_stats(client):
+    requests = client.stats()['requests']
+    client.growth(TEMPS, 50.)
+    stats = client.stats()
+    # Growth queries are counted, GET /stats is not
+    assert stats['requests'] == requests + 1
+    assert stats['rows'] >= len(TEMPS) and stats['latency_ms']['max'] > 0
@@ -0,0 +1,85 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the sweep model and of its wrappers base, one_temp and one_weight
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from growth_model.constants import C_AVG
+from growth_model.equations import equation2, equation3
+from growth_model.models.base import base
+from growth_model.models.one_init_weight import one_weight
+from growth_model.models.one_temp_input import one_temp
+from growth_model.models.sweep import sweep, sweep_frame
+
+TEMPS = [2., 5.5, 10., 14.]
+WEIGHTS = [1., 50., 1000.]
+
+
+def reference(temp, weight, sign, dt=1):
+    """
+    One row of the original row loops: a, b, growth rate and final weight with the exponent sign * b
+    """
+    a = equation2(temp)
+    b = equation3(temp) * sign
+    growth_rate = 0.01 * (a * weight ** b - C_AVG)
+    return a, b, growth_rate, weight * (1. + dt * growth_rate)
+
+
+def test_one_temp(tmp_path):
+    output = tmp_path.joinpath('one_temp.csv')
+    one_temp(temp=10., weight=WEIGHTS, output=output)
+    df = pd.read_csv(output, index_col='Init_Weight')
+    assert list(df.index) == WEIGHTS
+    expected = [reference(10., weight, 1.) for weight in WEIGHTS]
+    np.testing.assert_allclose(df[['a', 'b', 'Growth_Rate', 'Final_Weight']].values, expected, rtol=1e-12)
+
+
+def test_one_weight(tmp_path):
+    output = tmp_path.joinpath('one_weight.csv')
+    one_weight(temp=TEMPS, weight=50., output=output)
+    df = pd.read_csv(output, index_col='Input_Temp')
+    assert list(df.index) == TEMPS
+    expected = [reference(temp, 50., 1.) for temp in TEMPS]
+    np.testing.assert_allclose(df[['a', 'b', 'Growth_Rate', 'Final_Weight']].values, expected, rtol=1e-12)
+
+
+def test_one_temp_reference_values(tmp_path):
+    # Output of the row loop of one_temp before the sweep wrappers (exponent +b of Eq. 3)
+    output = tmp_path.joinpath('one_temp.csv')
+    one_temp(temp=10., weight=WEIGHTS, output=output)
+    df = pd.read_csv(output, index_col='Init_Weight')
+    np.testing.assert_allclose(df['b'], 0.307945, atol=1e-6)
+    np.testing.assert_allclose(df['Growth_Rate'], [0.060565, 0.208825, 0.529736], atol=1e-6)
+    np.testing.assert_allclose(df['Final_Weight'], [1.060565, 60.441263, 1529.735847], atol=1e-6)
+
+
+def test_base(tmp_path):
+    output = tmp_path.joinpath('base.csv')
+    base(temp=10., weight=50., output=output, dt=3)
+    row = pd.read_csv(output, index_col=0).loc['output']
+    a, b, growth_rate, final_weight = reference(10., 50., -1., dt=3)
+    np.testing.assert_allclose(row[['a', 'b', 'final_weight']].values.astype(float), [a, b, final_weight],
+                               rtol=1e-12)
+    assert row['growth_rate'] == round(growth_rate, 3)
+
+
+@pytest.mark.parametrize('dt', [1, 2.5])
+def test_sweep_frame(dt):
+    df = sweep_frame(TEMPS, WEIGHTS, dt)
+    assert len(df) == len(TEMPS) * len(WEIGHTS)
+    expected = [reference(temp, weight, -1., dt) for temp in TEMPS for weight in WEIGHTS]
+    np.testing.assert_allclose(df[['a', 'b', 'growth_rate', 'final_weight']].values, expected, rtol=1e-12)
+    np.testing.assert_array_equal(df[['temp', 'weight']].values, [(t, w) for t in TEMPS for w in WEIGHTS])
+
+
+def test_sweep_chunks(tmp_path):
+    output = tmp_path.joinpath('sweep.csv')
+    sweep({'min': 0., 'max': 20., 'step': 0.5}, WEIGHTS, output, chunk_rows=7)
+    df = pd.read_csv(output)
+    pd.testing.assert_frame_equal(df, sweep_frame(np.arange(0., 20., 0.5), WEIGHTS), check_exact=False, rtol=1e-14)
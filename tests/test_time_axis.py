@@ -0,0 +1,95 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the time axis of the input data in its calendar
+"""
+
+import datetime
+
+import cftime
+import numpy as np
+import pytest
+
+from growth_model.time_axis import decode, month_days, step_days, step_starts, year_days
+
+CALENDARS = ['360_day', 'noleap', 'standard', 'gregorian']
+
+
+@pytest.mark.parametrize('calendar, year, days', [('360_day', 1980, 360), ('360_day', 1981, 360),
+                                                  ('noleap', 1980, 365), ('noleap', 1981, 365),
+                                                  ('standard', 1980, 366), ('standard', 1981, 365),
+                                                  ('gregorian', 1900, 365), ('gregorian', 2000, 366)])
+def test_year_days(calendar, year, days):
+    assert year_days(year, calendar) == days
+    assert sum(month_days(year, month, calendar) for month in range(1, 13)) == days
+
+
+@pytest.mark.parametrize('calendar, february', [('360_day', 30), ('noleap', 28), ('standard', 29), ('gregorian', 29)])
+def test_month_days(calendar, february):
+    assert month_days(1980, 2, calendar) == february
+    assert month_days(1980, 12, calendar) == (30 if calendar == '360_day' else 31)
+
+
+@pytest.mark.parametrize('calendar', CALENDARS)
+def test_decode_months_since(calendar):
+    # Monthly means of two years from January 1980, one step per calendar month
+    years, durations = decode(np.arange(24) + 0.5, 'months since 1980-01-01', calendar)
+    assert years == [1980] * 12 + [1981] * 12
+    assert durations == [month_days(year, month, calendar) for year in (1980, 1981) for month in range(1, 13)]
+    # A reference date in another month shifts the months
+    years, durations = decode([0, 1, 2], 'months since 1979-11-01', calendar)
+    assert years == [1979, 1979, 1980]
+    assert durations == [30, month_days(1979, 12, calendar), month_days(1980, 1, calendar)]
+
+
+@pytest.mark.parametrize('calendar', CALENDARS)
+def test_decode_days_since_monthly(calendar):
+    # Mid-month dates of 1980 in days since the start of the year
+    starts = [cftime.date2num(cftime.datetime(1980, month, 1, calendar=calendar), 'days since 1980-01-01', calendar)
+              for month in range(1, 13)]
+    values = np.array(starts) + 14
+    years, durations = decode(values, 'days since 1980-01-01 00:00:00', calendar)
+    assert years == [1980] * 12
+    assert durations == [month_days(1980, month, calendar) for month in range(1, 13)]
+    assert sum(durations) == year_days(1980, calendar)
+
+
+@pytest.mark.parametrize('calendar', CALENDARS)
+def test_decode_days_since_daily(calendar):
+    days = int(year_days(1980, calendar))
+    years, durations = decode(np.arange(days) + 0.5, 'days since 1980-01-01', calendar)
+    assert years == [1980] * days
+    np.testing.assert_array_equal(durations, 1.)
+
+
+def test_decode_bounds():
+    # Pentads with bounds, the last step reaches into the next year
+    bounds = np.array([[0, 5], [5, 10], [360, 365], [365, 370]])
+    years, durations = decode(bounds.mean(axis=1), 'days since 1980-01-01', 'noleap', bounds)
+    assert years == [1980, 1980, 1980, 1981]
+    assert durations == [5, 5, 5, 5]
+
+
+@pytest.mark.parametrize('calendar', CALENDARS)
+def test_step_days(calendar):
+    # Pentads without bounds: halfway between the dates, the first and the last step as long as their neighbour
+    dates = [cftime.datetime(1980, 1, 3, calendar=calendar) + datetime.timedelta(days=5 * step) for step in range(6)]
+    np.testing.assert_array_equal(step_days(dates, calendar), 5.)
+    # One monthly field covers its month
+    np.testing.assert_array_equal(step_days([cftime.datetime(1980, 2, 1, calendar=calendar)], calendar),
+                                  [month_days(1980, 2, calendar)])
+    with pytest.raises(ValueError, match='ascending'):
+        step_days(dates[::-1], calendar)
+    with pytest.raises(ValueError, match='bounds'):
+        step_days([cftime.datetime(1980, 2, 15, calendar=calendar)], calendar)
+
+
+@pytest.mark.parametrize('calendar', CALENDARS)
+def test_step_starts(calendar):
+    years = [1980] * 12 + [1981] * 12
+    durations = [month_days(year, month, calendar) for year in (1980, 1981) for month in range(1, 13)]
+    starts = step_starts(years, durations, calendar)
+    assert [(date.year, date.month, date.day) for date in starts] == [(year, month, 1) for year in (1980, 1981)
+                                                                       for month in range(1, 13)]
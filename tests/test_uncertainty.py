@@ -0,0 +1,60 @@
+"""
+SPDX-FileCopyrightText: 2021 Alfred Wegener Institute Helmholtz Centre for Polar and Marine Research (AWI)
+SPDX-License-Identifier: MIT
+
+
+Tests of the parameter sets drawn for uncertainty analyses
+"""
+
+import numpy as np
+import pytest
+
+from growth_model.constants import PARAMETERS
+from growth_model.uncertainty import sample_parameters
+
+DRAWS = 20000
+
+
+@pytest.mark.parametrize('spec, mean', [
+    (0.3, 0.3),
+    ({'distribution': 'normal', 'mean': 0.3, 'std': 0.01}, 0.3),
+    ({'distribution': 'normal', 'std': 0.01}, PARAMETERS['C_AVG']),
+    ({'distribution': 'lognormal', 'mean': np.log(0.3), 'sigma': 0.01}, 0.3),
+    ({'distribution': 'uniform', 'min': 0.25, 'max': 0.35}, 0.3),
+    ({'distribution': 'triangular', 'min': 0.2, 'mode': 0.3, 'max': 0.4}, 0.3),
+    ({'distribution': 'triangular', 'min': PARAMETERS['C_AVG'] - 0.1, 'max': PARAMETERS['C_AVG'] + 0.1},
+     PARAMETERS['C_AVG']),
+])
+def test_distributions(spec, mean):
+    parameters = sample_parameters({'C_AVG': spec}, DRAWS, seed=1)
+    assert list(parameters) == ['C_AVG']
+    values = parameters['C_AVG']
+    assert values.shape == (DRAWS,)
+    assert abs(values.mean() - mean) < 0.005
+    if isinstance(spec, dict) and 'min' in spec:
+        assert values.min() >= spec['min'] and values.max() <= spec['max']
+
+
+def test_config_distributions():
+    # Distributions of config/monte_carlo.toml and a triangular distribution with its own mode
+    distributions = {'A_R': {'distribution': 'normal', 'std': 0.4},
+                     'C_AVG': {'distribution': 'uniform', 'min': 0.25, 'max': 0.33},
+                     'T_H': {'distribution': 'triangular', 'min': 285, 'max': 287},
+                     'T_R': {'distribution': 'triangular', 'min': 280, 'mode': 283, 'max': 285}}
+    first = sample_parameters(distributions, 100, seed=42)
+    second = sample_parameters(distributions, 100, seed=42)
+    for name in distributions:
+        np.testing.assert_array_equal(first[name], second[name])
+    assert (first['T_R'] >= 280).all() and (first['T_R'] <= 285).all()
+
+
+@pytest.mark.parametrize('distributions, draws', [
+    ({'D_R': 1.}, 10),
+    ({'A_R': {'distribution': 'gamma', 'shape': 2.}}, 10),
+    ({'C_AVG': {'distribution': 'uniform', 'min': 0.25}}, 10),
+    ({'T_H': {'distribution': 'triangular', 'mode': 286}}, 10),
+    ({'A_R': 1.}, 0),
+])
+def test_invalid_distributions(distributions, draws):
+    with pytest.raises(ValueError):
+        sample_parameters(distributions, draws)